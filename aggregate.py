@@ -0,0 +1,204 @@
+"""
+Vectorised group-by over parsed payments.
+
+Payments are grouped by any combination of keys, a date bucket ('day',
+'month', 'year'), 'transaction_type', 'direction' ('in' or 'out'), or a
+string column of PaymentBatch ('account', 'place', 'detail_from'...), and
+reduced to the number of payments and their total in integer minor units.
+Groups are found by sorting one combined int64 code per row, so the work is
+done by NumPy, which is needed by this module.
+
+    rollup = Rollup(('month', 'transaction_type'))
+    rollup.add(Unicredit('2019.csv').parse())
+    rollup.add(Unicredit('2020-01-02.csv').parse())   # only the new payments are grouped
+    rollup.top(10, where={'transaction_type': PaymentType.TYPE_CARD})
+
+A Rollup keeps the per-group totals of everything added, so new data is
+grouped on its own and merged into them instead of regrouping the history.
+"""
+from operator import attrgetter
+
+from czech_banks.batch import STRING_FIELDS, PaymentBatch, to_timestamp
+
+DATE_BUCKETS = {'day': 'datetime64[D]', 'month': 'datetime64[M]', 'year': 'datetime64[Y]'}
+DIRECTIONS = ('out', 'in')
+# Payment objects grouped together
+CHUNK_SIZE = 100000
+
+
+def _chunks(payments, keys):
+    """
+    Column dictionaries like PaymentBatch.to_numpy(decode=False) of a batch,
+    an iterable of batches or an iterable of Payment objects, or a mix of
+    both. Payment objects are buffered in chunks of up to CHUNK_SIZE read
+    into the columns of the keys, a chunk ends early at a batch.
+    """
+    if isinstance(payments, PaymentBatch):
+        payments = (payments,)
+    chunk = []
+    for item in payments:
+        if isinstance(item, PaymentBatch):
+            if chunk:
+                yield _payment_columns(chunk, keys)
+                chunk = []
+            if len(item):
+                yield item.to_numpy(decode=False)
+            continue
+        chunk.append(item)
+        if len(chunk) >= CHUNK_SIZE:
+            yield _payment_columns(chunk, keys)
+            chunk = []
+    if chunk:
+        yield _payment_columns(chunk, keys)
+
+
+def _encode(values):
+    """
+    (codes, distinct values) of a list.
+    """
+    import numpy
+    distinct = list(dict.fromkeys(values))
+    index = {value: code for code, value in enumerate(distinct)}
+    return numpy.fromiter(map(index.__getitem__, values), dtype=numpy.intp, count=len(values)), distinct
+
+
+def _payment_columns(payments, keys):
+    import numpy
+    prices = numpy.fromiter(map(attrgetter('price'), payments), dtype=numpy.float64, count=len(payments))
+    # rounds half to even like to_minor_units()
+    columns = {'price': numpy.rint(prices * 100).astype(numpy.int64)}
+    if any(key in DATE_BUCKETS for key in keys):
+        # payments share few distinct dates, convert each one once
+        codes, dates = _encode(list(map(attrgetter('date'), payments)))
+        timestamps = numpy.array([to_timestamp(date) for date in dates], dtype=numpy.int64)
+        columns['date'] = timestamps[codes].view('datetime64[us]')
+    if 'transaction_type' in keys:
+        columns['transaction_type'] = numpy.fromiter(map(attrgetter('transaction_type'), payments),
+                                                     dtype=numpy.uint8, count=len(payments))
+    for field in STRING_FIELDS:
+        if field in keys:
+            columns[field] = _encode(list(map(attrgetter(field), payments)))
+    return columns
+
+
+def _key_column(columns, key):
+    """
+    (codes, values) of a key: int64 codes per row and the key value of every code.
+    """
+    import numpy
+    if key in DATE_BUCKETS:
+        buckets = columns['date'].astype(DATE_BUCKETS[key])
+        values, codes = numpy.unique(buckets, return_inverse=True)
+        return codes, [None if numpy.isnat(value) else value.item() for value in values]
+    if key == 'transaction_type':
+        values, codes = numpy.unique(columns['transaction_type'], return_inverse=True)
+        return codes, [int(value) for value in values]
+    if key == 'direction':
+        return (columns['price'] >= 0).astype(numpy.int64), DIRECTIONS
+    if key in STRING_FIELDS:
+        codes, values = columns[key]
+        return codes.astype(numpy.int64), list(values)
+    raise ValueError('unknown key %r' % key)
+
+
+def group_by(payments, keys):
+    """
+    {key tuple: (count, total in minor units)} of the payments, see the module docstring for the keys.
+    """
+    result = {}
+    for columns in _chunks(payments, keys):
+        _merge(result, _group(columns, keys))
+    return result
+
+
+def _group(columns, keys):
+    import numpy
+    price = columns['price']
+    group = numpy.zeros(len(price), dtype=numpy.int64)
+    size = 1
+    key_values = []
+    for key in keys:
+        codes, values = _key_column(columns, key)
+        if size * len(values) >= 2 ** 63:
+            # renumber the combinations seen so far densely to keep the codes in int64
+            combinations, group = numpy.unique(group, return_inverse=True)
+            key_values = [_decode_all(combinations.tolist(), key_values)]
+            size = len(combinations)
+        group = group * len(values) + codes
+        size *= len(values)
+        key_values.append(values)
+    order = numpy.argsort(group, kind='stable')
+    groups, starts, counts = numpy.unique(group[order], return_index=True, return_counts=True)
+    totals = numpy.add.reduceat(price[order], starts)
+    keys = _decode_all(groups.tolist(), key_values)
+    return {key: (count, total) for key, count, total in zip(keys, counts.tolist(), totals.tolist())}
+
+
+def _decode(code, key_values):
+    key = ()
+    for values in reversed(key_values):
+        code, index = divmod(code, len(values))
+        value = values[index]
+        # an element of key_values may hold already combined key tuples
+        key = (value if type(value) is tuple else (value,)) + key
+    return key
+
+
+def _decode_all(codes, key_values):
+    return [_decode(code, key_values) for code in codes]
+
+
+def _merge(result, groups):
+    for key, (count, total) in groups.items():
+        previous = result.get(key)
+        result[key] = (count, total) if previous is None else (previous[0] + count, previous[1] + total)
+
+
+def _matches(key, keys, where):
+    return all(key[keys.index(name)] == value for name, value in where.items())
+
+
+class Rollup:
+    """
+    Incrementally maintained group-by of the payments added so far.
+    """
+
+    def __init__(self, keys):
+        """
+        :param keys: names of the grouping keys, e.g. ('month', 'transaction_type')
+        """
+        self.keys = tuple(keys)
+        self.groups = {}
+
+    def add(self, payments):
+        """
+        Group the new payments (PaymentBatch objects or Payment objects) and merge them in.
+        """
+        for columns in _chunks(payments, self.keys):
+            _merge(self.groups, _group(columns, self.keys))
+
+    def total(self, **where):
+        """
+        (count, total in minor units) of the groups matching the key values, e.g. total(month=date(2020, 1, 1)).
+        """
+        count = total = 0
+        for key, (group_count, group_total) in self.groups.items():
+            if _matches(key, self.keys, where):
+                count += group_count
+                total += group_total
+        return count, total
+
+    def top(self, k, by='total', where=None, reverse=True):
+        """
+        The k (key, count, total) groups with the largest total or count,
+        the smallest ones with reverse=False (the largest spending is the most negative total).
+        """
+        where = where or {}
+        index = 1 if by == 'count' else 2
+        rows = [(key, count, total) for key, (count, total) in self.groups.items()
+                if _matches(key, self.keys, where)]
+        rows.sort(key=lambda row: row[index], reverse=reverse)
+        return rows[:k]
+
+    def to_dict(self):
+        return dict(self.groups)
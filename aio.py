@@ -0,0 +1,111 @@
+"""
+asyncio counterparts of the downloaders for polling many mailboxes at once.
+
+imaplib is blocking, so every IMAP step of an EmailDownloader session runs
+in a worker thread while the event loop interleaves the mailboxes.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from czech_banks.downloader import DownloaderBase
+
+
+class AsyncDownloaderBase(DownloaderBase):
+    def download(self):
+        raise NotImplementedError()
+
+    async def set_unseen(self, num):
+        pass
+
+
+class AsyncEmailDownloader(AsyncDownloaderBase):
+
+    def __init__(self, downloader, executor=None, timeout=None):
+        """
+        :param downloader: EmailDownloader doing the actual work
+        :param executor: thread pool running the IMAP commands, defaults to the loop's one
+        :param timeout: seconds allowed for a single IMAP step
+        """
+        self.downloader = downloader
+        self.executor = executor
+        self.timeout = timeout
+
+    @property
+    def host(self):
+        return self.downloader.server
+
+    async def _run(self, func, *args):
+        call = asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+        return await asyncio.wait_for(call, self.timeout)
+
+    async def download(self, search_query='UNSEEN', content_types=None):
+        completed = False
+        try:
+            if await self._run(self.downloader.open):
+                nums = await self._run(self.downloader.search, search_query)
+                messages = self.downloader.fetch(nums, content_types)
+                while True:
+                    item = await self._run(next, messages, None)
+                    if item is None:
+                        break
+                    yield item
+            completed = True
+        finally:
+            # a timeout, cancellation or failure leaves the session in an unknown state, drop it
+            await self._run(self.downloader.close if completed else self.downloader.abort)
+
+    async def set_unseen(self, num):
+        await self._run(self.downloader.set_unseen, num)
+
+    def held_checkpoint(self):
+        return self.downloader.held_checkpoint()
+
+
+class MailboxScheduler:
+    """
+    Sweeps many mailboxes concurrently, at most `concurrency` at once and at
+    most `per_host` against the same IMAP server, so the sweep takes about as
+    long as the slowest mailbox instead of the sum of all of them.
+    """
+
+    def __init__(self, concurrency=10, per_host=4, timeout=None):
+        """
+        :param timeout: seconds allowed for the whole sweep of one mailbox
+        """
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+
+    async def sweep(self, mailboxes):
+        """
+        Run the parsers of every mailbox, given as (AsyncEmailDownloader, parsers)
+        pairs. Returns one item per mailbox in the same order: the list of
+        parsed records, or the exception that stopped the mailbox.
+        """
+        mailboxes = list(mailboxes)
+        limit = asyncio.Semaphore(self.concurrency)
+        host_limits = {}
+        borrowed = [downloader for downloader, parsers in mailboxes if downloader.executor is None]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for downloader in borrowed:
+                downloader.executor = executor
+            try:
+                jobs = []
+                for downloader, parsers in mailboxes:
+                    host_limit = host_limits.setdefault(downloader.host, asyncio.Semaphore(self.per_host))
+                    jobs.append(self._sweep_mailbox(limit, host_limit, parsers))
+                return await asyncio.gather(*jobs, return_exceptions=True)
+            finally:
+                for downloader in borrowed:
+                    downloader.executor = None
+
+    async def _sweep_mailbox(self, limit, host_limit, parsers):
+        async with limit, host_limit:
+            return await asyncio.wait_for(self._parse(parsers), self.timeout)
+
+    async def _parse(self, parsers):
+        records = []
+        for parser in parsers:
+            records.extend([record async for record in parser.parse_async()])
+        return records
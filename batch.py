@@ -0,0 +1,132 @@
+"""
+Columnar storage of payments.
+
+Amounts are kept as int64 minor units, dates as int64 microseconds since the
+epoch (NaT for missing ones, so the buffer maps onto NumPy's datetime64[us]),
+transaction types as uint8 PaymentType codes and string columns as
+dictionary-encoded uint32 codes. NumPy is needed by to_numpy() only.
+"""
+import datetime
+from array import array
+
+from czech_banks.models import Payment
+
+STRING_FIELDS = ('account', 'account_from', 'vs', 'ks', 'ss', 'detail_from', 'place', 'description', 'message')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+NAT = -2 ** 63
+
+
+def to_minor_units(price):
+    return int(round(price * 100))
+
+
+def to_timestamp(date):
+    """
+    Microseconds since the epoch of a datetime or date, aware datetimes are converted to UTC.
+    """
+    if date is None:
+        return NAT
+    # datetime is a subclass of date, it goes first
+    if isinstance(date, datetime.datetime):
+        if date.tzinfo is not None:
+            date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    else:
+        date = datetime.datetime(date.year, date.month, date.day)
+    return (date - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_timestamp(value):
+    if value == NAT:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+
+class DictionaryColumn:
+    """
+    String column stored as codes into a list of distinct values.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = array('I')
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.values[self.codes[index]]
+
+    def append(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def to_numpy(self, decode=True):
+        """
+        Decoded object array, or a (codes, values) pair when decode is False.
+        """
+        import numpy
+        codes = numpy.frombuffer(self.codes, dtype=numpy.uint32)
+        values = numpy.array(self.values, dtype=object)
+        return values[codes] if decode else (codes, values)
+
+
+class PaymentBatch:
+
+    def __init__(self):
+        self.price = array('q')
+        self.date = array('q')
+        self.transaction_type = array('B')
+        self.strings = {field: DictionaryColumn() for field in STRING_FIELDS}
+
+    def __len__(self):
+        return len(self.price)
+
+    def __getitem__(self, index):
+        payment = Payment()
+        payment.price = self.price[index] / 100
+        payment.date = from_timestamp(self.date[index])
+        payment.transaction_type = self.transaction_type[index]
+        for field, column in self.strings.items():
+            setattr(payment, field, column[index])
+        return payment
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @classmethod
+    def from_payments(cls, payments):
+        batch = cls()
+        for payment in payments:
+            batch.append(payment)
+        return batch
+
+    def append(self, payment):
+        self.price.append(to_minor_units(payment.price))
+        self.date.append(to_timestamp(payment.date))
+        self.transaction_type.append(payment.transaction_type)
+        for field, column in self.strings.items():
+            column.append(getattr(payment, field))
+
+    def to_payments(self):
+        return list(self)
+
+    def to_numpy(self, decode=True):
+        """
+        Dictionary of NumPy arrays sharing the numeric buffers of the batch,
+        see DictionaryColumn.to_numpy() for the string columns.
+        """
+        import numpy
+        columns = {
+            'price': numpy.frombuffer(self.price, dtype=numpy.int64),
+            'date': numpy.frombuffer(self.date, dtype='datetime64[us]'),
+            'transaction_type': numpy.frombuffer(self.transaction_type, dtype=numpy.uint8),
+        }
+        for field, column in self.strings.items():
+            columns[field] = column.to_numpy(decode)
+        return columns
@@ -0,0 +1,112 @@
+"""
+Round-trip benchmark of EmailDownloader against an in-memory IMAP handle.
+
+Run as ``python -m czech_banks.benchmark.downloader [messages] [latency_ms]``.
+"""
+import argparse
+import time
+from email.mime.text import MIMEText
+
+from czech_banks.downloader import EmailDownloader
+
+
+class FakeIMAP:
+    """Minimal stand-in for imaplib.IMAP4 that counts commands and simulates latency."""
+
+    def __init__(self, messages, latency=0.0):
+        self.messages = messages
+        self.latency = latency
+        self.round_trips = 0
+
+    def _command(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def login(self, account, password):
+        self._command()
+        return 'OK', [b'LOGIN completed']
+
+    def select(self, mailbox):
+        self._command()
+        return 'OK', [b'%d' % len(self.messages)]
+
+    def search(self, charset, query):
+        self._command()
+        return 'OK', [b' '.join(b'%d' % (i + 1) for i in range(len(self.messages)))]
+
+    def fetch(self, message_set, parts):
+        self._command()
+        data = []
+        for num in self._expand(message_set):
+            raw = self.messages[num - 1]
+            data.append((b'%d (RFC822 {%d}' % (num, len(raw)), raw))
+            data.append(b')')
+        return 'OK', data
+
+    def store(self, message_set, command, flags):
+        self._command()
+        return 'OK', []
+
+    def close(self):
+        self._command()
+        return 'OK', []
+
+    def logout(self):
+        self._command()
+        return 'BYE', []
+
+    @staticmethod
+    def _expand(message_set):
+        for part in message_set.split(b','):
+            start, _, end = part.partition(b':')
+            for num in range(int(start), int(end or start) + 1):
+                yield num
+
+
+class FakeEmailDownloader(EmailDownloader):
+
+    def __init__(self, handle, batch_size=1):
+        super().__init__('localhost', 143, 'bench', 'bench', ssl=False, batch_size=batch_size)
+        self.fake_handle = handle
+
+    def _connect(self):
+        return self.fake_handle
+
+
+def make_messages(count):
+    messages = []
+    for i in range(count):
+        message = MIMEText('Částka: %d,00 CZK\nVS: %d\n' % (i + 1, i), 'plain', 'utf-8')
+        message['Subject'] = 'Info 24 - Avízo'
+        message['From'] = 'info@rb.cz'
+        message['Date'] = 'Mon, 12 Oct 2026 10:15:00 +0200'
+        messages.append(message.as_bytes())
+    return messages
+
+
+def run(count=2000, latency=0.0, batch_sizes=(1, 10, 50, 200)):
+    messages = make_messages(count)
+    results = []
+    for batch_size in batch_sizes:
+        handle = FakeIMAP(messages, latency)
+        downloader = FakeEmailDownloader(handle, batch_size)
+        start = time.perf_counter()
+        downloaded = sum(1 for _ in downloader.download())
+        results.append((batch_size, downloaded, handle.round_trips, time.perf_counter() - start))
+    return results
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args.add_argument('count', type=int, nargs='?', default=2000, help='messages in the mailbox')
+    args.add_argument('latency', type=float, nargs='?', default=0.0, help='milliseconds added to every command')
+    args = args.parse_args(argv)
+    count, latency = args.count, args.latency / 1000
+    print('%10s %10s %12s %10s' % ('batch', 'messages', 'round-trips', 'seconds'))
+    for batch_size, downloaded, round_trips, seconds in run(count, latency):
+        print('%10d %10d %12d %10.3f' % (batch_size, downloaded, round_trips, seconds))
+
+
+if __name__ == '__main__':
+    main()
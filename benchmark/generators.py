@@ -0,0 +1,258 @@
+"""
+Deterministic synthetic data in the formats the parsers read: the CSV
+exports of parser/export.py and the notification e-mails of parser/email.py.
+The same seed always gives the same bytes.
+"""
+import datetime
+import email
+import random
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+
+from czech_banks.downloader import DownloaderBase
+
+START = datetime.datetime(2020, 1, 1, 8, 0)
+
+MERCHANTS = ('Albert Praha', 'Lidl Brno', 'Kaufland Ostrava', 'Tesco Plzeň', 'Shell Říčany', 'Rohlík.cz',
+             'Alza.cz', 'Česká pošta', 'Lékárna U Anděla', 'Bageterie Boulevard')
+NAMES = ('Jan Novák', 'Petra Svobodová', 'Tomáš Dvořák', 'Eva Černá', 'Jiří Procházka', 'Lucie Kučerová',
+         'ACME s.r.o.', 'Stavby Šťastný a.s.')
+BANK_CODES = ('0100', '0300', '0600', '0800', '2010', '2700', '3030', '5500', '6100')
+
+
+def _account(rng):
+    if rng.random() < 0.3:
+        return '%d-%d' % (rng.randint(1, 999999), rng.randint(10000000, 9999999999))
+    return '%d' % rng.randint(10000000, 9999999999)
+
+
+def _czech(amount, thousands=''):
+    text = '%.2f' % abs(amount)
+    whole, decimals = text.split('.')
+    if thousands:
+        groups = []
+        while len(whole) > 3:
+            groups.insert(0, whole[-3:])
+            whole = whole[:-3]
+        whole = thousands.join([whole] + groups)
+    return '%s%s,%s' % ('-' if amount < 0 else '', whole, decimals)
+
+
+def _amount(rng):
+    return round(rng.uniform(-25000, 25000), 2)
+
+
+def _date(rng, index, rows):
+    return START + datetime.timedelta(days=index * 3650 // max(rows, 1), minutes=rng.randint(0, 600))
+
+
+def equabank_export(rows, seed=0):
+    rng = random.Random(seed)
+    types = ('Odchozí platba v rámci ČR', 'Platba kartou', 'Příchozí platba v rámci ČR', 'Trvalý příkaz',
+             'Poplatek za výběr z bankomatu', 'Připsaný úrok')
+    lines = ['Číslo účtu;IBAN;Protiúčet;Název protiúčtu;Datum zaúčtování;Datum valuty;Částka;Typ transakce;'
+             'Popis;Kategorie;Kód']
+    for i in range(rows):
+        date = _date(rng, i, rows).strftime('%d.%m.%Y')
+        lines.append(';'.join((
+            '1020304050/6100', 'CZ6561000000001020304050', '%s/%s' % (_account(rng), rng.choice(BANK_CODES)),
+            rng.choice(NAMES + MERCHANTS), date, date, _czech(_amount(rng)), rng.choice(types),
+            rng.choice(('', 'Nájem', 'Faktura %d' % i)), rng.choice(('Bydlení', 'Nákupy', 'Ostatní')), 'CZK')))
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+def zuno_export(rows, seed=0):
+    rng = random.Random(seed)
+    types = ('Platba KARTOU', 'Odeslaná domácí platba', 'Přijatá domácí platba', 'Poplatek', 'Úrok',
+             'Výběr z bankomatu')
+    lines = ['Datum,Typ transakce,Název účtu,Číslo účtu,Kód banky,Popis,Částka,Měna']
+    for i in range(rows):
+        lines.append(','.join((
+            _date(rng, i, rows).strftime('%d.%m.%Y'), rng.choice(types), '"%s"' % rng.choice(NAMES),
+            '%010d' % rng.randint(0, 9999999999), rng.choice(BANK_CODES),
+            '"%s, %d"' % (rng.choice(MERCHANTS), i), '"%s"' % _czech(_amount(rng), ' '), 'CZK')))
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+def mbank_export(rows, seed=0):
+    rng = random.Random(seed)
+    types = ('PLATBA KARTOU', 'ODCHOZÍ PLATBA DO JINÉ BANKY', 'PŘÍCHOZÍ PLATBA Z JINÉ BANKY', 'INKASO / SIPO',
+             'VÝBĚR Z BANKOMATU', 'ZÚČTOVÁNÍ ÚROKŮ')
+    lines = ['mBank S.A., organizační složka;', 'Výpis pohybů na účtu;', '#Klient;', 'Jan Novák;', '',
+             '#Za období:;01.01.2020;31.12.2029;', '',
+             '#Datum uskutečnění transakce;#Datum zaúčtování transakce;#Popis transakce;#Zpráva pro příjemce;'
+             '#Plátce/Příjemce;#Číslo účtu plátce/příjemce;#KS;#VS;#SS;#Částka transakce;'
+             '#Účetní zůstatek po transakci;']
+    balance = 100000.0
+    for i in range(rows):
+        date = _date(rng, i, rows).strftime('%d-%m-%Y')
+        amount = _amount(rng)
+        balance += amount
+        tr_type = rng.choice(types)
+        if tr_type == 'PLATBA KARTOU':
+            description = "'%s/%s'" % (rng.choice(MERCHANTS), rng.choice(('Praha', 'Brno', 'Ostrava')))
+        else:
+            description = "'Platba %d'" % i
+        lines.append(';'.join((
+            date, date, tr_type, description, "'%s'" % rng.choice(NAMES),
+            "'%s/%s'" % (_account(rng), rng.choice(BANK_CODES)), '0308', str(i), '',
+            _czech(amount, ' '), _czech(balance, ' '), '')))
+    lines += ['', ';;#Konečný zůstatek:;%s;' % _czech(balance, ' ')]
+    return ('\r\n'.join(lines) + '\r\n').encode('iso-8859-2')
+
+
+def unicredit_export(rows, seed=0):
+    rng = random.Random(seed)
+    types = ('KARETNÍ TRANSAKCE', 'TUZEMSKÁ PLATBA ODCHOZÍ', 'TUZEMSKÁ PLATBA PŘÍCHOZÍ', 'POPLATKY', 'TRVALÝ PŘÍKAZ',
+             'Poplatek za vedení účtu', 'SEPA PLATBA')
+    lines = ['Pohyby na účtu;', 'Účet;Částka;Měna;Datum zaúčtování;Datum valuty;Banka;Název banky;Název banky;'
+             'Číslo účtu;Název účtu;Adresa;Adresa;Adresa;Detaily transakce;Detaily transakce;Detaily transakce;'
+             'Detaily transakce;Detaily transakce;Detaily transakce;Konstantní kód;Variabilní kód;Specifický kód;'
+             'Platební titul;Reference']
+    for i in range(rows):
+        date = _date(rng, i, rows).strftime('%Y-%m-%d')
+        card = rng.random() < 0.4
+        lines.append(';'.join((
+            '1234567890', '%.2f' % _amount(rng) if rng.random() < 0.5 else _czech(_amount(rng)), 'CZK', date, date,
+            '' if card else rng.choice(BANK_CODES), '', '', '' if card else _account(rng),
+            '' if card else rng.choice(NAMES), '', '', '', 'KARETNÍ TRANSAKCE' if card else rng.choice(types),
+            'Platba %d' % i, 'detail', '', '', rng.choice(MERCHANTS) if card else '',
+            '0308', str(rng.randint(1, 9999999999)), '', '', 'REF%08d' % i)))
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+EXPORTS = {
+    'Equabank': equabank_export,
+    'Zuno': zuno_export,
+    'Mbank': mbank_export,
+    'Unicredit': unicredit_export,
+}
+
+
+def _message(sender, subject, date, body, subtype='plain'):
+    message = MIMEText(body, subtype, 'utf-8')
+    message['From'] = sender
+    message['Subject'] = subject
+    message['Date'] = format_datetime(date)
+    return message
+
+
+def csob_message(rng, index, payments=3):
+    date = START + datetime.timedelta(hours=index)
+    blocks = ['Vážený kliente,', '']
+    for i in range(payments):
+        card = rng.random() < 0.5
+        blocks += [
+            'dne %s byla na účtu 123456789 zaúčtována transakce %s.' % (
+                date.strftime('%d.%m.%Y'), 'platební kartou' if card else 'TPS'),
+            'Částka: %s CZK' % _czech(_amount(rng)),
+        ]
+        if card:
+            blocks += ['Místo %s' % rng.choice(MERCHANTS)]
+        else:
+            blocks += ['Protiúčet: %s/%s' % (_account(rng), rng.choice(BANK_CODES)),
+                       'VS %010d' % rng.randint(1, 99999999), 'KS 0308', 'SS %d' % i,
+                       'detail platby', rng.choice(NAMES)]
+        blocks += ['Zůstatek na účtu po zaúčtování transakce: %s CZK.' % _czech(rng.uniform(0, 100000)), '']
+    blocks += ['Vaše ČSOB', 'Toto je automaticky generovaná zpráva.']
+    return _message('info@csob.cz', 'Info 24 - Avízo o zaúčtování', date, '\n'.join(blocks))
+
+
+def raiffeisen_message(rng, index):
+    date = START + datetime.timedelta(hours=index)
+    outgoing = rng.random() < 0.5
+    body = '\n'.join((
+        'ODCHOZI' if outgoing else 'PRICHOZI',
+        'Z: %s/%s/%s' % (_account(rng), rng.choice(BANK_CODES), rng.choice(NAMES)),
+        'Na: %s/5500/Jan Novák' % _account(rng),
+        'Castka: %s CZK' % _czech(abs(_amount(rng)), ' '),
+        'Dne: %s' % date.strftime('%d.%m.%Y %H:%M'),
+        'KS: 0308',
+        'VS: %d' % rng.randint(1, 9999999999),
+        'SS: ',
+        'Zprava: Faktura %d' % index,
+    ))
+    return _message('info@rb.cz', 'Pohyb na účtu', date, body)
+
+
+def unicredit_message(rng, index):
+    date = START + datetime.timedelta(hours=index)
+    details = '                '.join(('PLATBA KARTOU', '%d' % index, date.strftime('%d.%m.%Y'), 'CZ',
+                                       rng.choice(MERCHANTS)))
+    body = '\n'.join((
+        'UniCredit Bank Vás informuje o pohybu na účtu: 1234567890 CZK',
+        'Číslo účtu protistrany: %s/%s' % (_account(rng), rng.choice(BANK_CODES)),
+        'Název účtu protistrany: %s' % rng.choice(NAMES),
+        'Částka: %s CZK' % _czech(_amount(rng), '.'),
+        'Konstatní symbol: 0308',
+        'Variabilní symbol: %d' % rng.randint(1, 9999999999),
+        'Specifický symbol: ',
+        'Datum: %s' % date.strftime('%d.%m.%Y %H:%M'),
+        'Detaily transakce: %s' % details,
+    ))
+    return _message('unicreditbank@unicreditgroup.cz', 'Informace o pohybu na účtu', date, body)
+
+
+def unicredit_balance_message(rng, index):
+    date = START + datetime.timedelta(hours=index)
+    body = '\n'.join((
+        'UniCredit Bank Vás informuje o zůstatku na účtu: %d/2700' % (1234567890 + index % 5),
+        'Disponibilní zůstatek: %s CZK' % _czech(rng.uniform(0, 500000), '.'),
+        'Datum: %s' % date.strftime('%d.%m.%Y %H:%M'),
+    ))
+    return _message('unicreditbank@unicreditgroup.cz', 'Informace o zůstatku na účtu', date, body)
+
+
+def equabank_balance_message(rng, index):
+    date = START + datetime.timedelta(hours=index)
+    body = '\n'.join((
+        'Vážený kliente,',
+        'Aktuální částka účtu %d/6100' % (1020304050 + index % 5),
+        'Zůstatek ke dne %s je %s CZK.' % (date.strftime('%d.%m.%Y %H:%M'), _czech(rng.uniform(0, 500000))),
+    ))
+    return _message('info@equabank.cz', 'Zůstatek na účtu', date, body)
+
+
+def mbank_balance_message(rng, index):
+    date = START + datetime.timedelta(hours=index)
+    message = MIMEMultipart('alternative')
+    message['From'] = 'kontakt@mbank.cz'
+    message['Subject'] = 'Email Push'
+    message['Date'] = format_datetime(date)
+    balance = _czech(rng.uniform(0, 500000)).replace('-', '')
+    message.attach(MIMEText('Vlast.prostr.: %s CZK.' % balance, 'plain', 'us-ascii'))
+    message.attach(MIMEText('<html><body><p>Ucet 1234</p><p>Vlast.prostr.: %s CZK.</p></body></html>' % balance,
+                            'html', 'us-ascii'))
+    return message
+
+
+MESSAGES = {
+    'Csob': csob_message,
+    'Raiffeisenbank': raiffeisen_message,
+    'Unicredit': unicredit_message,
+    'UnicreditBalance': unicredit_balance_message,
+    'EquabankBalance': equabank_balance_message,
+    'MbankBalance': mbank_balance_message,
+}
+
+
+def messages(kind, count, seed=0):
+    """
+    Raw RFC822 bytes of count notification e-mails of the given parser.
+    """
+    rng = random.Random(seed)
+    return [MESSAGES[kind](rng, index).as_bytes() for index in range(count)]
+
+
+class MemoryDownloader(DownloaderBase):
+    """
+    Serves raw messages from memory, parsing them the way EmailDownloader does.
+    """
+
+    def __init__(self, raw_messages):
+        self.raw_messages = raw_messages
+
+    def download(self, search_query='UNSEEN', content_types=None):
+        for num, raw in enumerate(self.raw_messages, 1):
+            yield b'%d' % num, email.message_from_bytes(raw)
@@ -0,0 +1,676 @@
+"""
+In-process IMAP server standing in for a bank notification mailbox.
+
+A real socket server speaking enough of IMAP4rev1 for EmailDownloader and
+the watcher: LOGIN, SELECT, SEARCH and UID SEARCH (flags, header, date, UID
+and sequence criteria with NOT, OR, lists and UTF-8 literals), FETCH and
+UID FETCH (RFC822, BODY[] and BODY.PEEK[] with sections, HEADER.FIELDS,
+BODYSTRUCTURE, UID, FLAGS), STORE, IDLE, CLOSE and LOGOUT. Every command
+can be slowed down by a latency, responses by a bandwidth cap, and faults
+are injected by dropping connections or failing commands at random.
+
+    mailbox = Mailbox(messages('Csob', 50000))
+    with IMAPServer(mailbox, latency=0.02, drop_rate=0.001) as server:
+        downloader = EmailDownloader(*server.address, 'user', 'password', ssl=False)
+        ...
+        print(server.round_trips, server.bytes_sent)
+"""
+import collections
+import datetime
+import email
+import email.parser
+import email.policy
+import random
+import re
+import socket
+import threading
+import time
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+
+CAPABILITIES = b'IMAP4rev1 IDLE LITERAL+'
+# slice of a response sent at once under a bandwidth cap
+SEND_CHUNK = 16 * 1024
+# commands never failed or dropped on purpose
+UNFAILING = {b'CAPABILITY', b'LOGOUT', b'DONE'}
+
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))')
+_LITERAL_RE = re.compile(rb'\{(\d+)\+?\}\r?\n$')
+# a header field with its folded continuation lines
+_FIELD_RE = re.compile(rb'^([^\s:]+):.*(?:\r?\n[ \t].*)*\r?\n', re.MULTILINE)
+_MONTHS = {b'JAN': 1, b'FEB': 2, b'MAR': 3, b'APR': 4, b'MAY': 5, b'JUN': 6, b'JUL': 7, b'AUG': 8, b'SEP': 9,
+           b'OCT': 10, b'NOV': 11, b'DEC': 12}
+
+
+class BadCommand(ValueError):
+    pass
+
+
+class _Message:
+    __slots__ = ('uid', 'raw', 'flags', '_headers')
+
+    def __init__(self, uid, raw, flags=()):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags)
+        self._headers = None
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = email.parser.BytesHeaderParser(policy=email.policy.compat32).parsebytes(self.raw)
+        return self._headers
+
+    def header(self, name):
+        """
+        Decoded value of the header, '' when missing.
+        """
+        value = self.headers.get(name)
+        if value is None:
+            return ''
+        try:
+            return str(make_header(decode_header(value)))
+        except (UnicodeDecodeError, LookupError):
+            return str(value)
+
+    def date(self):
+        try:
+            return parsedate_to_datetime(self.headers['Date']).date()
+        except (TypeError, ValueError):
+            return None
+
+
+class Mailbox:
+    """
+    Messages of the INBOX with their UIDs and flags, shared by all connections.
+    """
+
+    def __init__(self, messages=(), uidvalidity=1, first_uid=1):
+        """
+        :param messages: raw messages
+        :param first_uid: UID of the first message, others than 1 keep UIDs apart from sequence numbers
+        """
+        self.uidvalidity = uidvalidity
+        self.messages = []
+        self.next_uid = first_uid
+        self._lock = threading.Lock()
+        self._listeners = []
+        for raw in messages:
+            self.append(raw)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, raw, flags=()):
+        """
+        Deliver a message, IDLE-ing connections are told about it.
+        """
+        with self._lock:
+            self.messages.append(_Message(self.next_uid, raw, flags))
+            self.next_uid += 1
+            count = len(self.messages)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(count)
+
+    def reset_flags(self):
+        for message in self.messages:
+            message.flags.clear()
+
+    def listen(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unlisten(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+
+class IMAPServer:
+
+    def __init__(self, mailbox, latency=0.0, jitter=0.0, bandwidth=None, drop_rate=0.0, fail_rate=0.0, seed=0,
+                 password=None, host='127.0.0.1', port=0):
+        """
+        :param latency: seconds added before answering every command
+        :param jitter: up to this many more seconds added at random
+        :param bandwidth: bytes per second a connection sends at most
+        :param drop_rate: probability that a command gets its connection closed instead of an answer
+        :param fail_rate: probability that a command is answered NO
+        :param password: the only password accepted, any by default
+        """
+        self.mailbox = mailbox
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.drop_rate = drop_rate
+        self.fail_rate = fail_rate
+        self.password = password
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._listener = socket.create_server((host, port))
+        self._sessions = set()
+        self._thread = None
+        self.commands = collections.Counter()
+        self.bytes_sent = 0
+        self.connections = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def address(self):
+        """
+        (host, port) to connect to.
+        """
+        return self._listener.getsockname()[:2]
+
+    @property
+    def round_trips(self):
+        return sum(self.commands.values())
+
+    def reset_counters(self):
+        with self._lock:
+            self.commands.clear()
+            self.bytes_sent = self.connections = self.dropped = self.failed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept, name='imap-stand-in', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._listener.close()
+        for session in list(self._sessions):
+            session.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                return
+            # a short tagged reply after a long response would wait for the delayed ACK
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.connections += 1
+            session = _Session(self, connection)
+            self._sessions.add(session)
+            threading.Thread(target=session.serve, name='imap-session', daemon=True).start()
+
+    def _fault(self, name):
+        """
+        'drop', 'fail' or None for a command, counting it.
+        """
+        fault = None
+        with self._lock:
+            self.commands[name.decode('ascii', 'replace')] += 1
+            if name not in UNFAILING:
+                draw = self._random.random()
+                if draw < self.drop_rate:
+                    self.dropped += 1
+                    fault = 'drop'
+                elif draw < self.drop_rate + self.fail_rate:
+                    self.failed += 1
+                    fault = 'fail'
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if fault is None and delay:
+            time.sleep(delay)
+        return fault
+
+    def _sent(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+
+class _Dropped(Exception):
+    pass
+
+
+class _Session:
+
+    def __init__(self, server, connection):
+        self.server = server
+        self.connection = connection
+        self.reader = connection.makefile('rb')
+        self.selected = False
+        self._send_lock = threading.Lock()
+
+    def shutdown(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+    def send(self, data):
+        with self._send_lock:
+            bandwidth = self.server.bandwidth
+            if not bandwidth:
+                self.connection.sendall(data)
+            else:
+                for start in range(0, len(data), SEND_CHUNK):
+                    chunk = data[start:start + SEND_CHUNK]
+                    self.connection.sendall(chunk)
+                    time.sleep(len(chunk) / bandwidth)
+        self.server._sent(len(data))
+
+    def serve(self):
+        try:
+            self.send(b'* OK [CAPABILITY %s] stand-in ready\r\n' % CAPABILITIES)
+            while True:
+                command = self._read_command()
+                if command is None:
+                    return
+                tag, tokens = command
+                if self._handle(tag, tokens) == 'logout':
+                    return
+        except (OSError, _Dropped):
+            pass
+        finally:
+            self.server._sessions.discard(self)
+            self.shutdown()
+
+    def _read_command(self):
+        """
+        (tag, tokens) of the next command, literals read into the tokens; None at the end of the connection.
+        """
+        parts = []
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            match = _LITERAL_RE.search(line)
+            if match is None:
+                parts.append(line.rstrip(b'\r\n'))
+                break
+            parts.append(line[:match.start()])
+            if not match.group(0).startswith(b'{%s+' % match.group(1)):
+                self.send(b'+ Ready for literal\r\n')
+            parts.append(_Literal(self.reader.read(int(match.group(1)))))
+        tokens = []
+        for part in parts:
+            if isinstance(part, _Literal):
+                tokens.append(part.value)
+            else:
+                tokens.extend(_tokenize(part))
+        if not tokens:
+            return None
+        tag = tokens[0]
+        return tag, _nest(iter(tokens[1:]))
+
+    def _handle(self, tag, tokens):
+        if not tokens:
+            self.send(b'%s BAD missing command\r\n' % tag)
+            return
+        name = tokens[0].upper() if isinstance(tokens[0], bytes) else b''
+        uid = name == b'UID'
+        if uid:
+            if len(tokens) < 2:
+                self.send(b'%s BAD missing UID command\r\n' % tag)
+                return
+            name = tokens[1].upper()
+            arguments = tokens[2:]
+        else:
+            arguments = tokens[1:]
+        fault = self.server._fault((b'UID ' if uid else b'') + name)
+        if fault == 'drop':
+            raise _Dropped()
+        if fault == 'fail':
+            self.send(b'%s NO [UNAVAILABLE] injected failure\r\n' % tag)
+            return
+        handler = getattr(self, '_command_' + name.decode('ascii', 'replace').lower(), None)
+        if handler is None:
+            self.send(b'%s BAD unknown command %s\r\n' % (tag, name))
+            return
+        try:
+            result = handler(tag, arguments, uid)
+        except BadCommand as error:
+            self.send(b'%s BAD %s\r\n' % (tag, str(error).encode('ascii', 'replace')))
+            return
+        return result
+
+    def _command_capability(self, tag, arguments, uid):
+        self.send(b'* CAPABILITY %s\r\n%s OK CAPABILITY completed\r\n' % (CAPABILITIES, tag))
+
+    def _command_noop(self, tag, arguments, uid):
+        self.send(b'%s OK NOOP completed\r\n' % tag)
+
+    def _command_login(self, tag, arguments, uid):
+        if len(arguments) != 2:
+            raise BadCommand('LOGIN needs a user and a password')
+        if self.server.password is not None and arguments[1] != self.server.password.encode('utf-8'):
+            self.send(b'%s NO [AUTHENTICATIONFAILED] invalid credentials\r\n' % tag)
+            return
+        self.send(b'%s OK LOGIN completed\r\n' % tag)
+
+    def _command_select(self, tag, arguments, uid):
+        if not arguments or arguments[0].upper() != b'INBOX':
+            self.send(b'%s NO [NONEXISTENT] only INBOX exists\r\n' % tag)
+            return
+        mailbox = self.server.mailbox
+        self.selected = True
+        self.send(b'* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)\r\n'
+                  b'* %d EXISTS\r\n* 0 RECENT\r\n'
+                  b'* OK [UIDVALIDITY %d] UIDs valid\r\n* OK [UIDNEXT %d] predicted next UID\r\n'
+                  b'%s OK [READ-WRITE] SELECT completed\r\n' % (len(mailbox), mailbox.uidvalidity, mailbox.next_uid,
+                                                              tag))
+
+    _command_examine = _command_select
+
+    def _command_close(self, tag, arguments, uid):
+        self.selected = False
+        self.send(b'%s OK CLOSE completed\r\n' % tag)
+
+    def _command_logout(self, tag, arguments, uid):
+        self.send(b'* BYE logging out\r\n%s OK LOGOUT completed\r\n' % tag)
+        return 'logout'
+
+    def _require_selected(self):
+        if not self.selected:
+            raise BadCommand('no mailbox selected')
+
+    def _command_search(self, tag, arguments, uid):
+        self._require_selected()
+        if arguments and isinstance(arguments[0], bytes) and arguments[0].upper() == b'CHARSET':
+            arguments = arguments[2:]
+        messages = list(self.server.mailbox.messages)
+        criterion = _all_of(iter(arguments), messages)
+        found = [message.uid if uid else index + 1 for index, message in enumerate(messages)
+                 if criterion(message, index + 1)]
+        self.send(b'* SEARCH%s\r\n%s OK SEARCH completed\r\n' % (b''.join(b' %d' % num for num in found), tag))
+
+    def _command_fetch(self, tag, arguments, uid):
+        self._require_selected()
+        if len(arguments) != 2:
+            raise BadCommand('FETCH needs a message set and items')
+        messages = list(self.server.mailbox.messages)
+        items = arguments[1] if isinstance(arguments[1], list) else [arguments[1]]
+        names = [item.upper() for item in items]
+        if uid and b'UID' not in names:
+            names.insert(0, b'UID')
+        for index in _message_set(arguments[0], messages, uid):
+            message = messages[index]
+            response = [b'* %d FETCH (' % (index + 1)]
+            for position, name in enumerate(names):
+                if position:
+                    response.append(b' ')
+                response.append(_fetch_item(message, name))
+            response.append(b')\r\n')
+            self.send(b''.join(response))
+        self.send(b'%s OK FETCH completed\r\n' % tag)
+
+    def _command_store(self, tag, arguments, uid):
+        self._require_selected()
+        if len(arguments) != 3:
+            raise BadCommand('STORE needs a message set, an action and flags')
+        action = arguments[1].upper()
+        flags = arguments[2] if isinstance(arguments[2], list) else [arguments[2]]
+        flags = set(flag.decode('ascii') for flag in flags)
+        messages = list(self.server.mailbox.messages)
+        for index in _message_set(arguments[0], messages, uid):
+            message = messages[index]
+            if action.startswith(b'+FLAGS'):
+                message.flags |= flags
+            elif action.startswith(b'-FLAGS'):
+                message.flags -= flags
+            elif action.startswith(b'FLAGS'):
+                message.flags = set(flags)
+            else:
+                raise BadCommand('unknown STORE action')
+            if not action.endswith(b'.SILENT'):
+                self.send(b'* %d FETCH (%s)\r\n' % (index + 1, _fetch_item(message, b'FLAGS')))
+        self.send(b'%s OK STORE completed\r\n' % tag)
+
+    def _command_idle(self, tag, arguments, uid):
+        def notify(count):
+            try:
+                self.send(b'* %d EXISTS\r\n' % count)
+            except OSError:
+                pass
+
+        self.send(b'+ idling\r\n')
+        self.server.mailbox.listen(notify)
+        try:
+            line = self.reader.readline()
+        finally:
+            self.server.mailbox.unlisten(notify)
+        if not line:
+            raise _Dropped()
+        if line.strip().upper() != b'DONE':
+            self.send(b'%s BAD expected DONE\r\n' % tag)
+            return
+        self.send(b'%s OK IDLE terminated\r\n' % tag)
+
+
+class _Literal:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _tokenize(text):
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match:
+            raise BadCommand('cannot parse %r' % text[position:])
+        position = match.end()
+        open_paren, close_paren, quoted, atom = match.groups()
+        if open_paren:
+            yield '('
+        elif close_paren:
+            yield ')'
+        elif quoted is not None:
+            yield re.sub(rb'\\(.)', rb'\1', quoted)
+        else:
+            yield atom
+
+
+def _nest(tokens):
+    values = []
+    for token in tokens:
+        if token == '(':
+            values.append(_nest(tokens))
+        elif token == ')':
+            return values
+        else:
+            values.append(token)
+    return values
+
+
+def _message_set(text, messages, uid):
+    """
+    Indexes of the messages in a sequence set or UID set, in mailbox order.
+    """
+    if not isinstance(text, bytes):
+        raise BadCommand('invalid message set')
+    if not messages:
+        return []
+    numbers = [message.uid for message in messages] if uid else range(1, len(messages) + 1)
+    largest = numbers[-1]
+    ranges = []
+    for part in text.split(b','):
+        start, _, end = part.partition(b':')
+        try:
+            start = largest if start == b'*' else int(start)
+            end = start if not end else largest if end == b'*' else int(end)
+        except ValueError:
+            raise BadCommand('invalid message set')
+        ranges.append((min(start, end), max(start, end)))
+    return [index for index, number in enumerate(numbers) if any(low <= number <= high for low, high in ranges)]
+
+
+def _text(value):
+    if not isinstance(value, bytes):
+        raise BadCommand('expected a string')
+    return value.decode('utf-8', 'replace').casefold()
+
+
+def _date(value):
+    try:
+        day, month, year = value.split(b'-')
+        return datetime.date(int(year), _MONTHS[month.upper()], int(day))
+    except (ValueError, KeyError, AttributeError):
+        raise BadCommand('invalid date')
+
+
+def _all_of(tokens, messages):
+    criteria = []
+    for token in tokens:
+        criteria.append(_criterion(token, tokens, messages))
+    return lambda message, number: all(criterion(message, number) for criterion in criteria)
+
+
+def _criterion(token, tokens, messages):
+    """
+    Predicate of (message, sequence number) for the search key starting with the token.
+    """
+    if isinstance(token, list):
+        return _all_of(iter(token), messages)
+    key = token.upper()
+    flag = {b'SEEN': '\\Seen', b'ANSWERED': '\\Answered', b'FLAGGED': '\\Flagged', b'DELETED': '\\Deleted',
+            b'DRAFT': '\\Draft'}
+    if key == b'ALL':
+        return lambda message, number: True
+    if key in flag:
+        return lambda message, number: flag[key] in message.flags
+    if key.startswith(b'UN') and key[2:] in flag:
+        return lambda message, number: flag[key[2:]] not in message.flags
+    if key == b'NEW':
+        return lambda message, number: '\\Seen' not in message.flags
+    if key == b'NOT':
+        inner = _criterion(_next(tokens), tokens, messages)
+        return lambda message, number: not inner(message, number)
+    if key == b'OR':
+        first = _criterion(_next(tokens), tokens, messages)
+        second = _criterion(_next(tokens), tokens, messages)
+        return lambda message, number: first(message, number) or second(message, number)
+    if key in (b'FROM', b'TO', b'CC', b'BCC', b'SUBJECT'):
+        field, value = key.decode('ascii'), _text(_next(tokens))
+        return lambda message, number: value in message.header(field).casefold()
+    if key == b'HEADER':
+        field, value = _text(_next(tokens)), _text(_next(tokens))
+        return lambda message, number: value in message.header(field).casefold()
+    if key in (b'BODY', b'TEXT'):
+        value = _next(tokens).lower()
+        return lambda message, number: value in message.raw.lower()
+    if key in (b'SINCE', b'SENTSINCE', b'BEFORE', b'SENTBEFORE', b'ON', b'SENTON'):
+        date = _date(_next(tokens))
+        if key.endswith(b'SINCE'):
+            return lambda message, number: message.date() is not None and message.date() >= date
+        if key.endswith(b'BEFORE'):
+            return lambda message, number: message.date() is not None and message.date() < date
+        return lambda message, number: message.date() == date
+    if key in (b'LARGER', b'SMALLER'):
+        size = int(_next(tokens))
+        if key == b'LARGER':
+            return lambda message, number: len(message.raw) > size
+        return lambda message, number: len(message.raw) < size
+    if key == b'UID':
+        indexes = set(_message_set(_next(tokens), messages, True))
+        return lambda message, number: number - 1 in indexes
+    if key[:1].isdigit() or key[:1] == b'*':
+        indexes = set(_message_set(key, messages, False))
+        return lambda message, number: number - 1 in indexes
+    raise BadCommand('unsupported search key %s' % key.decode('ascii', 'replace'))
+
+
+def _next(tokens):
+    try:
+        return next(tokens)
+    except StopIteration:
+        raise BadCommand('search key without its argument')
+
+
+def _literal(name, data):
+    return b'%s {%d}\r\n%s' % (name, len(data), data)
+
+
+def _fetch_item(message, name):
+    if name == b'UID':
+        return b'UID %d' % message.uid
+    if name == b'FLAGS':
+        return b'FLAGS (%s)' % ' '.join(sorted(message.flags)).encode('ascii')
+    if name == b'RFC822.SIZE':
+        return b'RFC822.SIZE %d' % len(message.raw)
+    if name == b'RFC822':
+        message.flags.add('\\Seen')
+        return _literal(b'RFC822', message.raw)
+    if name == b'RFC822.HEADER':
+        return _literal(b'RFC822.HEADER', _split(message.raw)[0])
+    if name == b'BODYSTRUCTURE':
+        return b'BODYSTRUCTURE ' + _bodystructure(email.message_from_bytes(message.raw))
+    if name.startswith(b'BODY[') or name.startswith(b'BODY.PEEK['):
+        section = name[name.index(b'[') + 1:name.rindex(b']')]
+        if not name.startswith(b'BODY.PEEK['):
+            message.flags.add('\\Seen')
+        return _literal(b'BODY[%s]' % section, _section(message.raw, section))
+    raise BadCommand('unsupported FETCH item %s' % name.decode('ascii', 'replace'))
+
+
+def _split(raw):
+    """
+    (header block with its blank line, body) of a raw message.
+    """
+    for separator in (b'\r\n\r\n', b'\n\n'):
+        position = raw.find(separator)
+        if position >= 0:
+            return raw[:position + len(separator)], raw[position + len(separator):]
+    return raw, b''
+
+
+def _section(raw, section):
+    header, body = _split(raw)
+    spec = section.upper()
+    if not spec:
+        return raw
+    if spec == b'HEADER':
+        return header
+    if spec == b'TEXT':
+        return body
+    if spec.startswith(b'HEADER.FIELDS'):
+        names = set(spec[spec.index(b'(') + 1:spec.rindex(b')')].split())
+        exclude = spec.startswith(b'HEADER.FIELDS.NOT')
+        lines = [match.group(0) for match in _FIELD_RE.finditer(header)
+                 if (match.group(1).upper() in names) != exclude]
+        return b''.join(lines) + b'\r\n'
+    part = email.message_from_bytes(raw)
+    for number in spec.split(b'.'):
+        if part.is_multipart():
+            try:
+                part = part.get_payload(int(number) - 1)
+            except (IndexError, ValueError):
+                return b''
+        elif number != b'1':
+            return b''
+    if part.is_multipart():
+        return b''
+    return part.get_payload(decode=False).encode('ascii', 'surrogateescape')
+
+
+def _quote(value):
+    return b'"%s"' % value.replace('\\', '\\\\').replace('"', '\\"').encode('utf-8')
+
+
+def _bodystructure(part):
+    if part.is_multipart():
+        return b'(%s %s)' % (b''.join(_bodystructure(subpart) for subpart in part.get_payload()),
+                             _quote(part.get_content_subtype().upper()))
+    params = [(key, value) for key, value in (part.get_params() or [])[1:]]
+    params = b'(%s)' % b' '.join(_quote(key.upper()) + b' ' + _quote(value) for key, value in params) \
+        if params else b'NIL'
+    payload = part.get_payload(decode=False).encode('ascii', 'surrogateescape')
+    encoding = _quote((part.get('Content-Transfer-Encoding') or '7bit').upper())
+    structure = b'%s %s %s NIL NIL %s %d' % (_quote(part.get_content_maintype().upper()),
+                                             _quote(part.get_content_subtype().upper()), params, encoding,
+                                             len(payload))
+    if part.get_content_maintype() == 'text':
+        structure += b' %d' % payload.count(b'\n')
+    return b'(%s)' % structure
@@ -0,0 +1,187 @@
+"""
+Load scenarios of EmailDownloader and the e-mail parsers against the
+in-process IMAP stand-in (czech_banks.benchmark.imapserver).
+
+One mailbox of --messages generated notifications of all banks is served
+with the given latency, bandwidth cap and faults. Every scenario does a
+full sync of one parser (or of all of them through MailboxDispatcher) from
+an all-unseen mailbox, reconnecting after injected faults, and reports the
+throughput, the IMAP round-trips and bytes, and the percentiles of the time
+the parser waited for each message:
+
+    python -m czech_banks.benchmark.load --messages 50000 --batch-size 50 --output before.json
+    python -m czech_banks.benchmark.load --messages 50000 --latency 20 --drop-rate 0.001 --compare before.json
+"""
+import argparse
+import imaplib
+import json
+import platform
+import sys
+import tempfile
+import time
+
+from czech_banks.benchmark.generators import MESSAGES, messages
+from czech_banks.benchmark.imapserver import IMAPServer, Mailbox
+from czech_banks.benchmark.run import _commit
+from czech_banks.checkpoint import CheckpointStore
+from czech_banks.dispatcher import MailboxDispatcher
+from czech_banks.downloader import DownloadingError, EmailDownloader
+from czech_banks.parser import email as email_parsers
+
+SCENARIOS = ('Csob', 'Raiffeisenbank', 'Unicredit', 'UnicreditBalance', 'EquabankBalance', 'MbankBalance',
+             'dispatcher')
+# connection failures a scenario recovers from by syncing again
+FAULTS = (OSError, imaplib.IMAP4.abort, DownloadingError)
+
+
+class TimedDownloader(EmailDownloader):
+    """
+    EmailDownloader recording the seconds its consumer waited for every message.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = []
+
+    def open(self):
+        # parsers take a mailbox that cannot be selected for an empty one, here it is a fault to retry
+        if not super().open():
+            raise DownloadingError('cannot select INBOX')
+        return True
+
+    def fetch(self, nums, content_types=None, peek=False):
+        start = time.perf_counter()
+        for item in super().fetch(nums, content_types, peek):
+            self.waits.append(time.perf_counter() - start)
+            yield item
+            start = time.perf_counter()
+
+
+def build_mailbox(size, seed):
+    """
+    Mailbox of size notifications, the kinds of MESSAGES taking turns.
+    """
+    kinds = list(MESSAGES)
+    generated = {kind: messages(kind, size // len(kinds) + 1, seed) for kind in kinds}
+    return Mailbox([generated[kinds[index % len(kinds)]][index // len(kinds)] for index in range(size)])
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _sync(scenario, downloader):
+    """
+    Yield the records of one sync of the scenario.
+    """
+    if scenario == 'dispatcher':
+        parsers = [getattr(email_parsers, name)() for name in SCENARIOS if name != 'dispatcher']
+        return MailboxDispatcher(downloader, parsers).parse()
+    return getattr(email_parsers, scenario)(downloader).parse()
+
+
+def run_scenario(scenario, server, batch_size, partial, incremental, retries, directory):
+    host, port = server.address
+    server.mailbox.reset_flags()
+    server.reset_counters()
+    checkpoints = CheckpointStore('%s/%s.json' % (directory, scenario)) if incremental else None
+    waits = []
+    records = attempts = 0
+    start = time.perf_counter()
+    while True:
+        downloader = TimedDownloader(host, port, 'load', 'load', ssl=False, batch_size=batch_size, partial=partial,
+                                     checkpoints=checkpoints, timeout=30)
+        attempts += 1
+        try:
+            for _ in _sync(scenario, downloader):
+                records += 1
+            break
+        except FAULTS:
+            downloader.abort()
+            if attempts > retries:
+                raise
+        finally:
+            waits.extend(downloader.waits)
+    seconds = time.perf_counter() - start
+    return {'benchmark': 'load.%s' % scenario, 'size': len(server.mailbox), 'messages': len(waits),
+            'records': records, 'seconds': seconds, 'rate': len(waits) / seconds if seconds else 0.0,
+            'round_trips': server.round_trips, 'bytes': server.bytes_sent, 'reconnects': attempts - 1,
+            'p50': _percentile(waits, 0.5), 'p95': _percentile(waits, 0.95), 'p99': _percentile(waits, 0.99),
+            'max': max(waits) if waits else 0.0}
+
+
+def compare(results, baseline):
+    """
+    Return (benchmark, baseline rate, rate, ratio, baseline p99, p99) for results present in both runs.
+    """
+    previous = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    rows = []
+    for result in results['results']:
+        old = previous.get((result['benchmark'], result['size']))
+        if old and old['rate']:
+            rows.append((result['benchmark'], old['rate'], result['rate'], result['rate'] / old['rate'], old['p99'],
+                         result['p99']))
+    return rows
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args.add_argument('--messages', type=int, default=5000, help='size of the mailbox')
+    args.add_argument('--batch-size', type=int, default=50)
+    args.add_argument('--partial', action='store_true', help='fetch the text parts only')
+    args.add_argument('--incremental', action='store_true', help='sync with UID checkpoints')
+    args.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every command')
+    args.add_argument('--jitter', type=float, default=0.0, help='up to this many random milliseconds more')
+    args.add_argument('--bandwidth', type=int, help='bytes per second the server sends at most')
+    args.add_argument('--drop-rate', type=float, default=0.0, help='probability a command drops the connection')
+    args.add_argument('--fail-rate', type=float, default=0.0, help='probability a command is answered NO')
+    args.add_argument('--retries', type=int, default=100, help='reconnections allowed per scenario')
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--only', help='run scenarios whose name contains this text')
+    args.add_argument('--output', help='write the results to this JSON file')
+    args.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = args.parse_args(argv)
+
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options': {name: value for name, value in vars(args).items() if name not in ('output', 'compare')},
+        'results': [],
+    }
+    mailbox = build_mailbox(args.messages, args.seed)
+    server = IMAPServer(mailbox, latency=args.latency / 1000, jitter=args.jitter / 1000, bandwidth=args.bandwidth,
+                        drop_rate=args.drop_rate, fail_rate=args.fail_rate, seed=args.seed)
+    print('%-26s %8s %8s %10s %10s %8s %10s %8s %8s %8s' % (
+        'scenario', 'messages', 'records', 'seconds', 'msg/s', 'trips', 'MB', 'retries', 'p50 ms', 'p99 ms'),
+        file=sys.stderr)
+    with server, tempfile.TemporaryDirectory(prefix='czech_banks-load-') as directory:
+        for scenario in SCENARIOS:
+            if args.only and args.only not in 'load.' + scenario:
+                continue
+            result = run_scenario(scenario, server, args.batch_size, args.partial, args.incremental, args.retries,
+                                  directory)
+            results['results'].append(result)
+            print('%-26s %8d %8d %10.3f %10.0f %8d %10.1f %8d %8.2f %8.2f' % (
+                result['benchmark'], result['messages'], result['records'], result['seconds'], result['rate'],
+                result['round_trips'], result['bytes'] / 2 ** 20, result['reconnects'], result['p50'] * 1e3,
+                result['p99'] * 1e3), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print('\n%-26s %10s %10s %8s %12s %12s' % ('scenario', 'before', 'after', 'ratio', 'p99 before', 'p99 after'),
+              file=sys.stderr)
+        for name, before, after, ratio, p99_before, p99_after in compare(results, baseline):
+            print('%-26s %10.0f %10.0f %7.2fx %10.2fms %10.2fms' % (name, before, after, ratio, p99_before * 1e3,
+                                                                    p99_after * 1e3), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Memory benchmark of the Payment model on synthetic payments.
+
+Compares the former dict-based model against the slotted one, with and
+without interning of the repeating string fields. Run as
+``python -m czech_banks.benchmark.models [count]``.
+"""
+import argparse
+import datetime
+import gc
+import tracemalloc
+
+from czech_banks.models import Payment, PaymentType, intern_string
+
+
+class LegacyPayment:
+    transaction_type = PaymentType.TYPE_UNDEFINED
+    price = 0
+    account = None
+    ks = None
+    ss = None
+    vs = None
+    detail_from = None
+    description = None
+    message = None
+    place = None
+    date = None
+    account_from = None
+
+
+def make_payments(cls, count, intern=False):
+    wrap = intern_string if intern else (lambda value: value)
+    start = datetime.datetime(2020, 1, 1)
+    payments = []
+    for i in range(count):
+        payment = cls()
+        payment.price = -float(i % 5000) / 100
+        payment.date = start + datetime.timedelta(days=i % 3650)
+        payment.transaction_type = PaymentType.TYPE_CARD
+        # strings are built per row, the way csv and str.split() hand them to the parsers
+        payment.account = wrap('%d/0800' % (1000000 + i % 200))
+        payment.account_from = wrap('%d/2700' % 12345678)
+        payment.detail_from = wrap('Merchant %d s.r.o.' % (i % 1000))
+        payment.place = wrap('Praha %d' % (i % 10))
+        payment.vs = '%d' % i
+        payments.append(payment)
+    return payments
+
+
+def measure(cls, count, intern=False):
+    gc.collect()
+    tracemalloc.start()
+    payments = make_payments(cls, count, intern)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del payments
+    return current, peak
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args.add_argument('count', type=int, nargs='?', default=1000000, help='payments created per model')
+    count = args.parse_args(argv).count
+    print('%-22s %12s %12s %10s' % ('model', 'current MB', 'peak MB', 'B/payment'))
+    for name, cls, intern in (('dict (legacy)', LegacyPayment, False),
+                              ('__slots__', Payment, False),
+                              ('__slots__ + interning', Payment, True)):
+        current, peak = measure(cls, count, intern)
+        print('%-22s %12.1f %12.1f %10.0f' % (name, current / 2 ** 20, peak / 2 ** 20, current / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Parser throughput and memory benchmark on synthetic data.
+
+Every CSV export parser and e-mail parser is run at several input sizes,
+reporting rows (or e-mails) per second and the peak memory traced while
+parsing. Results are written as JSON so two commits can be compared:
+
+    python -m czech_banks.benchmark.run --output before.json
+    python -m czech_banks.benchmark.run --output after.json --compare before.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from czech_banks.benchmark.generators import EXPORTS, MESSAGES, MemoryDownloader, messages
+from czech_banks.parser import email as email_parsers
+from czech_banks.parser import export as export_parsers
+
+CSV_SIZES = (1000, 10000, 100000)
+EMAIL_SIZES = (100, 1000, 5000)
+
+
+def _consume(parser):
+    return sum(1 for _ in parser.parse())
+
+
+def _measure(make_parser, repeat):
+    best = None
+    for _ in range(repeat):
+        parser = make_parser()
+        start = time.perf_counter()
+        records = _consume(parser)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # a separate pass, tracing allocations slows the parsing down
+    parser = make_parser()
+    tracemalloc.start()
+    _consume(parser)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, records, peak
+
+
+def bench_exports(sizes, repeat, seed, only=None):
+    for name, generate in EXPORTS.items():
+        if only and only not in 'export.' + name:
+            continue
+        parser_class = getattr(export_parsers, name)
+        for size in sizes:
+            data = generate(size, seed)
+            seconds, records, peak = _measure(lambda: parser_class(data), repeat)
+            yield {'benchmark': 'export.%s' % name, 'size': size, 'bytes': len(data), 'records': records,
+                   'seconds': seconds, 'rate': size / seconds, 'unit': 'rows/s', 'peak_memory': peak}
+
+
+def bench_emails(sizes, repeat, seed, only=None):
+    for name in MESSAGES:
+        if only and only not in 'email.' + name:
+            continue
+        parser_class = getattr(email_parsers, name)
+        for size in sizes:
+            raw = messages(name, size, seed)
+            seconds, records, peak = _measure(lambda: parser_class(MemoryDownloader(raw)), repeat)
+            yield {'benchmark': 'email.%s' % name, 'size': size, 'bytes': sum(len(m) for m in raw),
+                   'records': records, 'seconds': seconds, 'rate': size / seconds, 'unit': 'e-mails/s',
+                   'peak_memory': peak}
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=__file__.rsplit('/', 2)[0]).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Return (benchmark, size, baseline rate, rate, ratio) for results present in both runs.
+    """
+    previous = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    rows = []
+    for result in results['results']:
+        old = previous.get((result['benchmark'], result['size']))
+        if old:
+            rows.append((result['benchmark'], result['size'], old['rate'], result['rate'],
+                         result['rate'] / old['rate']))
+    return rows
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args.add_argument('--csv-sizes', type=int, nargs='+', default=CSV_SIZES)
+    args.add_argument('--email-sizes', type=int, nargs='+', default=EMAIL_SIZES)
+    args.add_argument('--repeat', type=int, default=3)
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--only', help='run benchmarks whose name contains this text')
+    args.add_argument('--output', help='write the results to this JSON file')
+    args.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = args.parse_args(argv)
+
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': [],
+    }
+    print('%-28s %8s %10s %14s %10s' % ('benchmark', 'size', 'seconds', 'rate', 'peak MB'), file=sys.stderr)
+    benchmarks = (bench_exports(args.csv_sizes, args.repeat, args.seed, args.only),
+                  bench_emails(args.email_sizes, args.repeat, args.seed, args.only))
+    for benchmark in benchmarks:
+        for result in benchmark:
+            results['results'].append(result)
+            print('%-28s %8d %10.3f %8.0f %-5s %10.1f' % (
+                result['benchmark'], result['size'], result['seconds'], result['rate'], result['unit'][:-2],
+                result['peak_memory'] / 2 ** 20), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print('\n%-28s %8s %12s %12s %8s' % ('benchmark', 'size', 'before', 'after', 'ratio'), file=sys.stderr)
+        for name, size, before, after, ratio in compare(results, baseline):
+            print('%-28s %8d %12.0f %12.0f %7.2fx' % (name, size, before, after, ratio), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Cold-start benchmark of the package imports.
+
+Every target is run in a fresh interpreter with python -X importtime,
+reporting the import time summed over all modules it loaded (the best of
+--repeat runs), the number of modules and the heaviest modules imported
+by the package's own modules. Results are written as JSON like
+czech_banks.benchmark.run:
+
+    python -m czech_banks.benchmark.startup --output before.json
+    python -m czech_banks.benchmark.startup --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import czech_banks
+from czech_banks.benchmark.run import _commit
+
+TARGETS = {
+    'parser.export': 'import czech_banks.parser.export',
+    'parser.email': 'import czech_banks.parser.email',
+    'registry.export': "from czech_banks.registry import get_parser; get_parser('unicredit', 'export')",
+    'registry.email': "from czech_banks.registry import get_parser; get_parser('csob', 'email')",
+    'ingest': 'import czech_banks.ingest',
+}
+
+
+def _environment():
+    environment = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(czech_banks.__file__)))
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, (root, environment.get('PYTHONPATH'))))
+    return environment
+
+
+def _parse_importtime(output):
+    """
+    [(self µs, cumulative µs, depth, module)] of the -X importtime lines.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((int(own), int(cumulative), depth, name.strip()))
+    return imports
+
+
+def _external_imports(imports):
+    """
+    (cumulative µs, module) of the modules other than czech_banks ones not imported by another such module.
+    """
+    # -X importtime lists a module after the modules it imported, walk it backwards from the parents;
+    # modules loaded by importlib.import_module() are listed at the top level
+    parents = []
+    for own, cumulative, depth, module in reversed(imports):
+        del parents[depth:]
+        if not module.startswith('czech_banks') and all(parent.startswith('czech_banks') for parent in parents):
+            yield cumulative, module
+        parents.append(module)
+
+
+def measure(code, repeat, environment=None):
+    """
+    (microseconds, imports) of the fastest run of the code, None when it fails.
+    """
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=environment or _environment(),
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode:
+            return None
+        imports = _parse_importtime(process.stderr)
+        total = sum(own for own, _, _, _ in imports)
+        if best is None or total < best[0]:
+            best = total, imports
+    return best
+
+
+def bench_startup(repeat, only=None):
+    environment = _environment()
+    # the interpreter's own imports, subtracted from every target
+    base, base_imports = measure('pass', repeat, environment)
+    base_modules = set(module for _, _, _, module in base_imports)
+    for name, code in TARGETS.items():
+        if only and only not in 'startup.' + name:
+            continue
+        measured = measure(code, repeat, environment)
+        if measured is None:
+            print('%-28s failed' % ('startup.' + name), file=sys.stderr)
+            continue
+        total, imports = measured
+        heaviest = sorted(((cumulative, module) for cumulative, module in _external_imports(imports)
+                           if module not in base_modules), reverse=True)[:5]
+        yield {'benchmark': 'startup.%s' % name, 'code': code, 'seconds': max(total - base, 0) / 1e6,
+               'modules': len(imports) - len(base_imports), 'heaviest': heaviest}
+
+
+def compare(results, baseline):
+    """
+    Return (benchmark, baseline seconds, seconds, ratio) for results present in both runs.
+    """
+    previous = {r['benchmark']: r for r in baseline['results']}
+    rows = []
+    for result in results['results']:
+        old = previous.get(result['benchmark'])
+        if old:
+            rows.append((result['benchmark'], old['seconds'], result['seconds'],
+                         old['seconds'] / result['seconds'] if result['seconds'] else float('inf')))
+    return rows
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    args.add_argument('--repeat', type=int, default=5)
+    args.add_argument('--only', help='run benchmarks whose name contains this text')
+    args.add_argument('--output', help='write the results to this JSON file')
+    args.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = args.parse_args(argv)
+
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': [],
+    }
+    print('%-28s %10s %8s  %s' % ('benchmark', 'ms', 'modules', 'heaviest imports (ms)'), file=sys.stderr)
+    for result in bench_startup(args.repeat, args.only):
+        results['results'].append(result)
+        print('%-28s %10.1f %8d  %s' % (
+            result['benchmark'], result['seconds'] * 1e3, result['modules'],
+            ', '.join('%s %.1f' % (module, cumulative / 1e3) for cumulative, module in result['heaviest'])),
+            file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print('\n%-28s %10s %10s %8s' % ('benchmark', 'before ms', 'after ms', 'speedup'), file=sys.stderr)
+        for name, before, after, ratio in compare(results, baseline):
+            print('%-28s %10.1f %10.1f %7.2fx' % (name, before * 1e3, after * 1e3, ratio), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
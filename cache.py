@@ -0,0 +1,180 @@
+"""
+Local cache of raw e-mail messages.
+
+Messages are stored content-addressed, one file per distinct message named
+by its SHA-256 in Maildir-like fan-out directories, optionally gzipped, and
+written through a temporary file so a crash never leaves a partial message.
+An SQLite index maps (mailbox, UIDVALIDITY, UID) to the files, so lookups
+need no directory scan. Old entries are evicted by age and total size.
+
+    cache = MessageCache('~/.cache/czech_banks', max_bytes=2 ** 30)
+    downloader = EmailDownloader(..., cache=cache)
+    ...
+    # after fixing a parser, without any network access
+    payments = Csob(CachedDownloader(cache, downloader.mailbox)).parse()
+"""
+import email
+import gzip
+import hashlib
+import os
+import sqlite3
+import time
+
+from czech_banks.downloader import DownloaderBase
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored REAL NOT NULL,
+    PRIMARY KEY (mailbox, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_stored ON messages (stored);
+CREATE INDEX IF NOT EXISTS messages_digest ON messages (digest);
+"""
+
+
+class MessageCache:
+
+    def __init__(self, directory, compress=True, max_bytes=None, max_age=None):
+        """
+        :param directory: cache root, created when missing
+        :param compress: gzip the stored messages
+        :param max_bytes: evict() removes the oldest messages above this size of the files
+        :param max_age: evict() removes messages stored more than max_age seconds ago
+        """
+        self.directory = os.path.expanduser(directory)
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(os.path.join(self.directory, 'tmp'), exist_ok=True)
+        # czech_banks.aio runs the steps of a download on pool threads, one at a time
+        self._index = sqlite3.connect(os.path.join(self.directory, 'index.db'), check_same_thread=False)
+        self._index.execute('PRAGMA journal_mode=WAL')
+        self._index.execute('PRAGMA synchronous=NORMAL')
+        self._index.executescript(INDEX_SCHEMA)
+
+    def _path(self, digest, compressed):
+        return os.path.join(self.directory, 'messages', digest[:2], digest + ('.eml.gz' if compressed else '.eml'))
+
+    def get(self, mailbox, uidvalidity, uid):
+        """
+        Raw message, None when it is not cached.
+        """
+        row = self._index.execute('SELECT digest FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?',
+                                  (mailbox, uidvalidity, int(uid))).fetchone()
+        return self._read(row[0]) if row else None
+
+    def _read(self, digest):
+        # the file may have been stored with the other compress setting
+        for compressed in (self.compress, not self.compress):
+            try:
+                with open(self._path(digest, compressed), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            return gzip.decompress(data) if compressed else data
+        return None
+
+    def put(self, mailbox, uidvalidity, uid, raw):
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._path(digest, self.compress)
+        if not os.path.exists(path):
+            data = gzip.compress(raw, 6) if self.compress else raw
+            tmp_path = os.path.join(self.directory, 'tmp', '%s.%d' % (digest, os.getpid()))
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        with self._index:
+            self._index.execute('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)',
+                                (mailbox, uidvalidity, int(uid), digest, os.path.getsize(path), time.time()))
+
+    def uids(self, mailbox, uidvalidity=None):
+        """
+        Cached (uidvalidity, uid) pairs of the mailbox in UID order.
+        """
+        if uidvalidity is None:
+            return self._index.execute('SELECT uidvalidity, uid FROM messages WHERE mailbox = ? '
+                                       'ORDER BY uidvalidity, uid', (mailbox,)).fetchall()
+        return self._index.execute('SELECT uidvalidity, uid FROM messages WHERE mailbox = ? AND uidvalidity = ? '
+                                   'ORDER BY uid', (mailbox, uidvalidity)).fetchall()
+
+    def size(self):
+        """
+        Bytes taken by the message files.
+        """
+        return self._index.execute('SELECT COALESCE(SUM(size), 0) FROM '
+                                   '(SELECT DISTINCT digest, size FROM messages)').fetchone()[0]
+
+    def evict(self):
+        """
+        Drop the messages older than max_age, then the oldest ones until the
+        files fit in max_bytes; a file shared by several entries counts once
+        they are all dropped. Returns the number of index entries removed.
+        """
+        expired = []
+        if self.max_age is not None:
+            expired = self._index.execute('SELECT mailbox, uidvalidity, uid, digest FROM messages WHERE stored < ?',
+                                          (time.time() - self.max_age,)).fetchall()
+            self._delete(expired)
+        oversized = []
+        if self.max_bytes is not None:
+            excess = self.size() - self.max_bytes
+            rows = ()
+            if excess > 0:
+                # a message file is removed with the last entry sharing it
+                references = dict(self._index.execute('SELECT digest, COUNT(*) FROM messages GROUP BY digest'))
+                rows = self._index.execute('SELECT mailbox, uidvalidity, uid, digest, size FROM messages '
+                                           'ORDER BY stored')
+            for mailbox, uidvalidity, uid, digest, size in rows:
+                if excess <= 0:
+                    break
+                oversized.append((mailbox, uidvalidity, uid, digest))
+                references[digest] -= 1
+                if not references[digest]:
+                    excess -= size
+            self._delete(oversized)
+        return len(expired) + len(oversized)
+
+    def _delete(self, entries):
+        with self._index:
+            self._index.executemany('DELETE FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?',
+                                    [entry[:3] for entry in entries])
+        for digest in set(entry[3] for entry in entries):
+            # the same message may be cached under another mailbox or UID
+            if self._index.execute('SELECT 1 FROM messages WHERE digest = ?', (digest,)).fetchone() is None:
+                for compressed in (True, False):
+                    try:
+                        os.remove(self._path(digest, compressed))
+                    except FileNotFoundError:
+                        pass
+
+    def close(self):
+        self._index.close()
+
+
+class CachedDownloader(DownloaderBase):
+    """
+    Serves the cached messages of a mailbox, for parsing them again without
+    network access. The search query is ignored, the parsers' accepts()
+    pick their messages.
+    """
+
+    def __init__(self, cache, mailbox, uidvalidity=None):
+        """
+        :param mailbox: EmailDownloader.mailbox of the account
+        :param uidvalidity: serve one generation of the mailbox only, all by default
+        """
+        self.cache = cache
+        self.mailbox = mailbox
+        self.uidvalidity = uidvalidity
+
+    def download(self, search_query='UNSEEN', content_types=None):
+        for uidvalidity, uid in self.cache.uids(self.mailbox, self.uidvalidity):
+            raw = self.cache.get(self.mailbox, uidvalidity, uid)
+            if raw is not None:
+                yield b'%d' % uid, email.message_from_bytes(raw)
@@ -0,0 +1,41 @@
+import json
+import os
+
+
+class CheckpointStore:
+    """
+    UIDVALIDITY and the highest processed UID per mailbox and search query,
+    persisted in a JSON file between runs.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, 'r') as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            self._data = {}
+        self._dirty = False
+
+    def last_uid(self, key, uidvalidity):
+        """
+        Highest processed UID, 0 when the key is unknown or the mailbox was
+        recreated (its UIDVALIDITY changed) so every message is new again.
+        """
+        state = self._data.get(key)
+        if not state or state['uidvalidity'] != uidvalidity:
+            return 0
+        return state['last_uid']
+
+    def update(self, key, uidvalidity, last_uid):
+        self._data[key] = {'uidvalidity': uidvalidity, 'last_uid': last_uid}
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self.filename)
+        self._dirty = False
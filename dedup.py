@@ -0,0 +1,158 @@
+"""
+Deduplication of payments ingested from overlapping sources.
+
+A payment's fingerprint hashes its canonical form: the normalised
+counterparty account, the amount in minor units, the booking day and the
+symbols and message. Fingerprints of processed payments are kept in an
+SQLite table, so re-ingesting years of exports costs one primary key
+lookup per payment.
+
+Identical payments within one source (two coffees of the same price on the
+same day) are told apart by their occurrence: the second one is
+fingerprinted as the second occurrence, so it is new unless an overlapping
+source delivered two of them as well.
+"""
+import hashlib
+import sqlite3
+
+from czech_banks.batch import to_minor_units
+
+SEPARATOR = '\x1f'
+
+
+def normalize_account(account):
+    """
+    Canonical 'prefix-number/bank' form: leading zeros and an empty prefix removed.
+    """
+    if not account:
+        return ''
+    number, _, bank = account.strip().partition('/')
+    prefix, _, number = number.rpartition('-')
+    number = number.strip().lstrip('0')
+    prefix = prefix.strip().lstrip('0')
+    if prefix:
+        number = prefix + '-' + number
+    return number + '/' + bank.strip() if bank.strip() else number
+
+
+def normalize_symbol(value):
+    """
+    Payment symbol (variable, constant, specific) without leading zeros.
+    """
+    return (value or '').strip().lstrip('0')
+
+
+def _text(value):
+    return ' '.join((value or '').split()).casefold()
+
+
+def canonical(payment):
+    """
+    Fields identifying the payment whatever source it came from.
+    """
+    date = payment.date.date().isoformat() if payment.date is not None else ''
+    return (normalize_account(payment.account), str(to_minor_units(payment.price or 0)), date,
+            normalize_symbol(payment.vs), normalize_symbol(payment.ks), normalize_symbol(payment.ss),
+            _text(payment.message))
+
+
+def fingerprint(payment, occurrence=0):
+    """
+    16 bytes hash of the canonical payment, occurrence numbers identical payments of one source.
+    """
+    data = SEPARATOR.join(canonical(payment))
+    if occurrence:
+        data += SEPARATOR + str(occurrence)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).digest()
+
+
+class PaymentIndex:
+    """
+    Persistent set of fingerprints of the payments already ingested.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: SQLite database, ':memory:' for an index living as long as the object
+        """
+        self.filename = filename
+        # fingerprints of the payments yielded by filter() and not recorded yet
+        self._claimed = set()
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints (fingerprint BLOB PRIMARY KEY) WITHOUT ROWID')
+        self._connection.commit()
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+
+    def __contains__(self, payment):
+        """
+        Whether the payment, as the first of its kind, was recorded.
+        """
+        return self._connection.execute('SELECT 1 FROM fingerprints WHERE fingerprint = ?',
+                                        (fingerprint(payment),)).fetchone() is not None
+
+    def filter(self, payments, commit=True):
+        """
+        Yield the payments not seen before and record them. A payment is
+        recorded once the next one is asked for, so the one the consumer
+        failed on is not, and the records are committed when the iteration
+        ends. A failure or an iteration left unfinished rolls back all
+        records not committed yet.
+
+        The payments must come from one source: identical payments are
+        numbered by their occurrence in it, so a stream merged from
+        overlapping exports would take the second copy of a payment for a
+        new one. Filter each export with its own call.
+
+        :param commit: commit when the iteration ends, False leaves it to
+            commit() once the consumer kept the payments of all the calls
+        """
+        # occurrences of the payments of this source, keyed by their first fingerprint
+        occurrences = {}
+        cursor = self._connection.cursor()
+        try:
+            for payment in payments:
+                digest = fingerprint(payment)
+                occurrence = occurrences.get(digest, 0)
+                occurrences[digest] = occurrence + 1
+                if occurrence:
+                    digest = fingerprint(payment, occurrence)
+                # another filter() call may be holding the same payment back
+                if digest in self._claimed or cursor.execute(
+                        'SELECT 1 FROM fingerprints WHERE fingerprint = ?', (digest,)).fetchone() is not None:
+                    continue
+                self._claimed.add(digest)
+                yield payment
+                self._claimed.discard(digest)
+                cursor.execute('INSERT INTO fingerprints VALUES (?)', (digest,))
+        except BaseException:
+            self.rollback()
+            raise
+        if commit:
+            self.commit()
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._claimed.clear()
+        self._connection.rollback()
+
+    def add(self, payments):
+        """
+        Record the payments without yielding them, returns the number of new ones.
+        """
+        return sum(1 for _ in self.filter(payments))
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
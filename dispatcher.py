@@ -0,0 +1,73 @@
+import contextlib
+
+from czech_banks.imap import UNSEEN, Or, as_query
+
+
+class MailboxDispatcher:
+    """
+    Feeds several e-mail parsers from one IMAP session.
+
+    One combined search selects the unseen messages of all registered parsers,
+    every message is fetched once (without setting \\Seen) and handed to each
+    parser that accepts it. Messages consumed by at least one parser are
+    marked seen with a single STORE at the end, the rest stay untouched.
+    """
+
+    def __init__(self, downloader, parsers=()):
+        self.downloader = downloader
+        self.parsers = []
+        for parser in parsers:
+            self.register(parser)
+
+    def register(self, parser):
+        self.parsers.append(parser)
+        return parser
+
+    def search_query(self):
+        criteria = []
+        for parser in self.parsers:
+            if parser.SEARCH_CRITERIA not in criteria:
+                criteria.append(parser.SEARCH_CRITERIA)
+        query = as_query(criteria[0])
+        for other in criteria[1:]:
+            query = Or(query, other)
+        return UNSEEN & query
+
+    def content_types(self):
+        return tuple(sorted(set(content_type for parser in self.parsers for content_type in parser.CONTENT_TYPES)))
+
+    def parse(self):
+        """
+        Yield (parser, record) pairs, payments as the messages arrive and the
+        latest balances of the balance parsers once the mailbox is exhausted.
+        """
+        if not self.parsers:
+            return
+        balances = {parser: [] for parser in self.parsers if parser.has_balance()}
+        consumed = []
+        if not self.downloader.open():
+            self.downloader.close()
+            return
+        try:
+            # a sync failing before the balances were yielded is repeated
+            with self.downloader.held_checkpoint() if balances else contextlib.nullcontext():
+                nums = self.downloader.search(self.search_query())
+                for num, message in self.downloader.fetch(nums, self.content_types(), peek=True):
+                    accepted = False
+                    for parser in self.parsers:
+                        if not parser.accepts(message):
+                            continue
+                        accepted = True
+                        if parser in balances:
+                            balances[parser].extend(parser._parse_message(message))
+                        else:
+                            for payment in parser._parse_message(message):
+                                yield parser, payment
+                    if accepted:
+                        consumed.append(num)
+                for parser, parser_balances in balances.items():
+                    for balance in parser.latest(parser_balances):
+                        yield parser, balance
+        finally:
+            self.downloader.set_seen(consumed)
+            self.downloader.close()
@@ -1,11 +1,26 @@
+import contextlib
 import email
+import email.message
 import imaplib
 
+from czech_banks.imap import as_query, chunks, find_parts, message_set, multipart_subtype, parse_fetch_response, uid
+from czech_banks.stats import NULL_STATS
+
+HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (DATE SUBJECT FROM)]'
+
 
 class DownloaderBase(object):
+    stats = NULL_STATS
+
     def download(self):
         raise NotImplementedError()
 
+    def set_unseen(self, num):
+        pass
+
+    def held_checkpoint(self):
+        return contextlib.nullcontext()
+
 
 class DownloadingError(RuntimeError):
     pass
@@ -14,38 +29,337 @@ class DownloadingError(RuntimeError):
 class EmailDownloader(DownloaderBase):
 
     _handle = None
+    _selected = False
+    _uidvalidity = None
+    _checkpoint_key = None
+    _last_uid = 0
+    _unseen = ()
+    _held = False
 
-    def __init__(self, server, port, account, password, ssl=True):
+    def __init__(self, server, port, account, password, ssl=True, batch_size=1, partial=False, checkpoints=None,
+                 timeout=None, stats=None, cache=None):
+        """
+        :param batch_size: number of messages requested by one FETCH command;
+            values greater than 1 save a round-trip per message
+        :param partial: when download() is given content types, fetch only the
+            BODYSTRUCTURE, a few headers and the matching MIME parts instead of
+            the whole RFC822 message with its attachments
+        :param checkpoints: CheckpointStore enabling the incremental mode: UNSEEN
+            in search queries stands for messages with UIDs above the last
+            processed one, messages are yielded under their UIDs and no flags
+            are changed on the server
+        :param timeout: socket timeout in seconds
+        :param stats: czech_banks.stats.Stats recording the IMAP stages, nothing is recorded by default
+        :param cache: czech_banks.cache.MessageCache keeping the raw messages; whole messages found
+            there are not downloaded again, fetched ones are stored (partial fetches are not cached);
+            the session addresses messages by UIDs then
+        """
         self.server = server
         self.port = port
         self.account = account
         self.password = password
         self.ssl = ssl
+        self.batch_size = max(1, batch_size)
+        self.partial = partial
+        self.checkpoints = checkpoints
+        self.timeout = timeout
+        self.stats = stats or NULL_STATS
+        self.cache = cache
 
-    def download(self, search_query='UNSEEN'):
+    def _connect(self):
         if self.ssl:
-            self._handle = imaplib.IMAP4_SSL(self.server, self.port)
-        else:
-            self._handle = imaplib.IMAP4(self.server, self.port)
+            return imaplib.IMAP4_SSL(self.server, self.port, timeout=self.timeout)
+        return imaplib.IMAP4(self.server, self.port, timeout=self.timeout)
+
+    @property
+    def mailbox(self):
+        return '%s@%s:%s/INBOX' % (self.account, self.server, self.port)
+
+    def download(self, search_query='UNSEEN', content_types=None):
+        if self.open():
+            for num, message in self.fetch(self.search(search_query), content_types):
+                yield (num, message)
+        self.close()
+
+    def open(self):
+        """
+        Log in and select INBOX, returns False when the mailbox cannot be selected.
+        """
+        with self.stats.timer('connect', server=self.server):
+            self._handle = self._connect()
         try:
-            self._handle.login(self.account, self.password)
+            with self.stats.timer('login', server=self.server):
+                self._handle.login(self.account, self.password)
         except imaplib.IMAP4.error:
             raise DownloadingError("cannot login")
-        res, data = self._handle.select('INBOX')
-        if res == 'OK':
-            rv, data = self._handle.search(None, search_query)
-            if rv != 'OK':
-                raise DownloadingError("cannot find message")
-            for num in data[0].split():
-                rv, data = self._handle.fetch(num, '(RFC822)')
-                if rv != 'OK':
-                    raise DownloadingError("cannot fetch message")
-                message = email.message_from_bytes(data[0][1])
-                yield (num, message)
-            self._handle.close()
-        self._handle.logout()
+        with self.stats.timer('select', server=self.server):
+            res, data = self._handle.select('INBOX')
+        self._selected = res == 'OK'
+        if self._selected and (self.checkpoints is not None or self.cache is not None):
+            rv, data = self._handle.response('UIDVALIDITY')
+            if not data or data[0] is None:
+                raise DownloadingError("server does not report UIDVALIDITY")
+            self._uidvalidity = int(data[0])
+        return self._selected
+
+    def close(self):
+        if self._unseen:
+            self._store_unseen()
+        if self.checkpoints is not None:
+            self.checkpoints.save()
+        if self.cache is not None:
+            self.cache.evict()
+        with self.stats.timer('logout', server=self.server):
+            if self._selected:
+                self._handle.close()
+                self._selected = False
+            self._handle.logout()
+        self._handle = None
+
+    def abort(self):
+        """
+        Drop a broken connection without logging out, the checkpoints are saved.
+        """
+        if self.checkpoints is not None:
+            self.checkpoints.save()
+        if self._handle is not None:
+            try:
+                self._handle.shutdown()
+            except OSError:
+                pass
         self._handle = None
+        self._selected = False
+        self._unseen = ()
+
+    def search(self, search_query):
+        """
+        :param search_query: SEARCH criteria as text or a czech_banks.imap.Query
+        """
+        query = as_query(search_query)
+        if self.checkpoints is not None:
+            return self._search_new(query)
+        criteria, literal = query.render()
+        with self.stats.timer('search', server=self.server):
+            if self.cache is not None:
+                # the cache is keyed by UIDs, so the session addresses messages by them
+                if literal is not None:
+                    self._handle.literal = literal
+                    rv, data = self._handle.uid('SEARCH', 'CHARSET', 'UTF-8', criteria)
+                else:
+                    rv, data = self._handle.uid('SEARCH', criteria)
+            elif literal is None:
+                rv, data = self._handle.search(None, criteria)
+            else:
+                self._handle.literal = literal
+                rv, data = self._handle.search('UTF-8', criteria)
+        if rv != 'OK':
+            raise DownloadingError("cannot find message")
+        return data[0].split()
+
+    def _search_new(self, query):
+        self._checkpoint_key = '%s %s' % (self.mailbox, query)
+        self._last_uid = self.checkpoints.last_uid(self._checkpoint_key, self._uidvalidity)
+        criteria, literal = (uid('%d:*' % (self._last_uid + 1)) & query.without('UNSEEN')).render()
+        with self.stats.timer('search', server=self.server):
+            if literal is None:
+                rv, data = self._handle.uid('SEARCH', criteria)
+            else:
+                self._handle.literal = literal
+                rv, data = self._handle.uid('SEARCH', 'CHARSET', 'UTF-8', criteria)
+        if rv != 'OK':
+            raise DownloadingError("cannot find message")
+        # "n:*" matches the last message even when its UID is below n
+        return [b'%d' % uid for uid in sorted(int(uid) for uid in data[0].split()) if uid > self._last_uid]
+
+    def mark_processed(self, nums):
+        """
+        Advance the checkpoint of the last search past the messages without
+        fetching them, in the incremental mode.
+        """
+        if self.checkpoints is not None and nums:
+            self._last_uid = max(self._last_uid, max(int(num) for num in nums))
+            if not self._held:
+                self.checkpoints.update(self._checkpoint_key, self._uidvalidity, self._last_uid)
+                self.checkpoints.save()
+
+    @contextlib.contextmanager
+    def held_checkpoint(self):
+        """
+        Keep the progress of the syncs within the block out of the checkpoints
+        and record it when the block completes, for consumers delivering their
+        records only after the last message (the newest balances). A sync
+        failing in the block is repeated from the last checkpoint.
+        """
+        self._held = True
+        try:
+            yield
+        finally:
+            self._held = False
+        if self.checkpoints is not None and self._checkpoint_key is not None:
+            self.checkpoints.update(self._checkpoint_key, self._uidvalidity, self._last_uid)
+            self.checkpoints.save()
+
+    def fetch(self, nums, content_types=None, peek=False):
+        """
+        Yield (num, message) tuples of the given messages.
+
+        :param peek: leave the messages unseen, see set_seen()
+        """
+        incremental = self.checkpoints is not None
+        for batch in chunks(nums, self.batch_size):
+            if self.partial and content_types:
+                messages = self._fetch_parts(batch, content_types, peek or incremental)
+            else:
+                messages = self._fetch_messages(batch, peek or incremental)
+            for num, message in messages:
+                yield (num, message)
+                if incremental:
+                    # the consumer asked for the next message, so this one is processed
+                    self._last_uid = max(self._last_uid, int(num))
+                    if not self._held:
+                        self.checkpoints.update(self._checkpoint_key, self._uidvalidity, self._last_uid)
+            if incremental and not self._held:
+                self.checkpoints.save()
+
+    @property
+    def _by_uid(self):
+        """
+        Whether search() returns UIDs, in the incremental mode and with a cache.
+        """
+        return self.checkpoints is not None or self.cache is not None
+
+    def _fetch(self, nums, parts):
+        """
+        Yield (num, items) of the FETCH responses, num being the UID when _by_uid.
+        """
+        message_set_ = nums[0] if len(nums) == 1 else message_set(nums)
+        with self.stats.timer('fetch', server=self.server):
+            if self._by_uid:
+                rv, data = self._handle.uid('FETCH', message_set_, parts)
+            else:
+                rv, data = self._handle.fetch(message_set_, parts)
+        if rv != 'OK':
+            raise DownloadingError("cannot fetch message")
+        if self.stats.enabled:
+            self.stats.count('fetched_bytes', sum(len(item[1]) for item in data if isinstance(item, tuple)),
+                             server=self.server)
+        for num, items in parse_fetch_response(data):
+            yield (items.get(b'UID') if self._by_uid else num), items
+
+    def _fetch_messages(self, nums, peek=False):
+        if self.cache is not None:
+            yield from self._fetch_cached(nums, peek)
+            return
+        raws = {}
+        for num, items in self._fetch(nums, '(BODY.PEEK[])' if peek else '(RFC822)'):
+            raw = items.get(b'BODY[]', items.get(b'RFC822'))
+            if raw is not None:
+                raws[num] = raw
+        # servers may answer in any order, the incremental mode relies on ascending UIDs
+        for num in nums:
+            if num in raws:
+                with self.stats.timer('decode', server=self.server):
+                    message = email.message_from_bytes(raws.pop(num))
+                self.stats.count('messages', server=self.server)
+                yield num, message
+
+    def _fetch_cached(self, nums, peek=False):
+        # nums are UIDs, see search()
+        raws = {}
+        for num in nums:
+            raw = self.cache.get(self.mailbox, self._uidvalidity, num)
+            if raw is not None:
+                raws[num] = raw
+        self.stats.count('cache_hits', len(raws), server=self.server)
+        missing = [num for num in nums if num not in raws]
+        if missing:
+            for num, items in self._fetch(missing, '(BODY.PEEK[])' if peek else '(RFC822)'):
+                raw = items.get(b'BODY[]', items.get(b'RFC822'))
+                if raw is not None:
+                    raws[num] = raw
+                    self.cache.put(self.mailbox, self._uidvalidity, num, raw)
+        if not peek and len(missing) < len(nums):
+            # cached messages were not fetched, mark them the way a RFC822 fetch would
+            self.set_seen([num for num in nums if num not in missing])
+        for num in nums:
+            if num in raws:
+                with self.stats.timer('decode', server=self.server):
+                    message = email.message_from_bytes(raws[num])
+                self.stats.count('messages', server=self.server)
+                yield num, message
+
+    def _fetch_parts(self, nums, content_types, peek=False):
+        structures = {}
+        sections = {}
+        for num, items in self._fetch(nums, '(BODYSTRUCTURE %s)' % HEADER_FIELDS):
+            if b'BODYSTRUCTURE' not in items:
+                continue
+            # a server leaving out the headers still gets the parts parsed
+            headers = next((value for key, value in items.items() if key.startswith(b'BODY[HEADER')), b'')
+            parts = find_parts(items[b'BODYSTRUCTURE'], content_types)
+            structures[num] = (items[b'BODYSTRUCTURE'], parts, headers)
+            sections.setdefault(tuple(part[0] for part in parts), []).append(num)
+        bodies = {}
+        for group, group_nums in sections.items():
+            if not group:
+                continue
+            query = '(%s)' % ' '.join('BODY.PEEK[%s]' % section.decode('ascii') for section in group)
+            bodies.update(self._fetch(group_nums, query))
+        if not peek:
+            # BODY.PEEK leaves the messages unseen, mark them the way a RFC822 fetch would
+            self.set_seen(nums)
+        for num in nums:
+            if num in structures:
+                structure, parts, headers = structures[num]
+                items = bodies.get(num, {})
+                with self.stats.timer('decode', server=self.server):
+                    message = _build_message(structure, parts, headers,
+                                             [items.get(b'BODY[%s]' % part[0]) for part in parts])
+                self.stats.count('messages', server=self.server)
+                yield num, message
+
+    def set_seen(self, nums):
+        if self._handle and nums and self.checkpoints is None:
+            self._store(nums, '+FLAGS.SILENT')
 
     def set_unseen(self, num):
-        if self._handle:
-            self._handle.store(num, '-FLAGS', '\SEEN')
+        """
+        Mark the message unseen again. The messages are collected and sent
+        in one STORE when the session is closed.
+        """
+        if self._handle and self.checkpoints is None:
+            if not self._unseen:
+                self._unseen = []
+            self._unseen.append(num)
+
+    def _store_unseen(self):
+        self._store(self._unseen, '-FLAGS.SILENT')
+        self._unseen = ()
+
+    def _store(self, nums, command):
+        with self.stats.timer('store', server=self.server):
+            if self._by_uid:
+                self._handle.uid('STORE', message_set(nums), command, '(\\Seen)')
+            else:
+                self._handle.store(message_set(nums), command, '(\\Seen)')
+
+
+def _build_message(structure, parts, headers, bodies):
+    """
+    Assemble a Message from fetched headers and MIME parts, shaped like the
+    original so EmailParser helpers (is_multipart, walk, get_payload) work on it.
+    """
+    message = email.message_from_bytes(headers)
+    if not isinstance(structure[0], list):
+        return _set_part(message, parts[0], bodies[0])
+    message['Content-Type'] = 'multipart/%s' % multipart_subtype(structure)
+    message.set_payload([_set_part(email.message.Message(), part, body) for part, body in zip(parts, bodies)])
+    return message
+
+
+def _set_part(message, part, body):
+    section, content_type, params, encoding = part
+    message.add_header('Content-Type', content_type, **dict(params))
+    message['Content-Transfer-Encoding'] = encoding
+    message.set_payload((body or b'').decode('ascii', 'surrogateescape'))
+    return message
@@ -0,0 +1,373 @@
+import re
+from itertools import takewhile
+
+
+def message_set(nums):
+    """
+    Build an IMAP sequence set from message numbers (or UIDs), collapsing
+    consecutive runs into ranges, e.g. [1, 2, 3, 7] -> b'1:3,7'.
+    """
+    values = sorted(set(int(num) for num in nums))
+    ranges = []
+    start = prev = None
+    for value in values:
+        if prev is not None and value == prev + 1:
+            prev = value
+            continue
+        if start is not None:
+            ranges.append((start, prev))
+        start = prev = value
+    if start is not None:
+        ranges.append((start, prev))
+    return b','.join(
+        b'%d' % start if start == end else b'%d:%d' % (start, end) for start, end in ranges
+    )
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ResponseError(ValueError):
+    pass
+
+
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))')
+
+
+def _tokenize(data):
+    for item in data:
+        text, literal = item if isinstance(item, tuple) else (item, None)
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if not match:
+                raise ResponseError('unexpected data %r' % text[pos:])
+            pos = match.end()
+            open_paren, close_paren, quoted, literal_size, atom = match.groups()
+            if open_paren:
+                yield '('
+            elif close_paren:
+                yield ')'
+            elif quoted is not None:
+                yield re.sub(rb'\\(.)', rb'\1', quoted)
+            elif literal_size is not None:
+                if literal is None:
+                    raise ResponseError('missing literal data')
+                yield literal
+                literal = None
+            else:
+                yield None if atom.upper() == b'NIL' else atom
+
+
+def _parse_list(tokens):
+    values = []
+    for token in tokens:
+        if token == '(':
+            values.append(_parse_list(tokens))
+        elif token == ')':
+            return values
+        else:
+            values.append(token)
+    raise ResponseError('unbalanced parentheses')
+
+
+def parse_fetch_response(data):
+    """
+    Yield (num, items) pairs from data returned by imaplib's fetch(), where
+    items maps upper-cased item names (b'UID', b'BODYSTRUCTURE', b'BODY[1]'...)
+    to parsed values. Literals are kept as bytes, lists as nested lists.
+    """
+    tokens = _tokenize(data)
+    for num in tokens:
+        if next(tokens, None) != '(':
+            raise ResponseError('malformed FETCH response')
+        values = _parse_list(tokens)
+        yield num, {key.upper(): value for key, value in zip(values[0::2], values[1::2])}
+
+
+def find_parts(bodystructure, content_types, section=None):
+    """
+    Return (section, content_type, params, encoding) tuples of the body parts
+    of the given content types. A single-part message yields its only part
+    whatever the type, the same way EmailParser._get_message_part does.
+    """
+    if section is None and not isinstance(bodystructure[0], list):
+        return [_part_info(b'1', bodystructure)]
+    parts = []
+    for index, part in enumerate(takewhile(lambda value: isinstance(value, list), bodystructure)):
+        part_section = b'%d' % (index + 1) if section is None else b'%s.%d' % (section, index + 1)
+        if isinstance(part[0], list):
+            parts.extend(find_parts(part, content_types, part_section))
+        else:
+            info = _part_info(part_section, part)
+            if info[1] in content_types:
+                parts.append(info)
+    return parts
+
+
+def multipart_subtype(bodystructure):
+    for value in bodystructure:
+        if not isinstance(value, list):
+            return (value or b'mixed').decode('ascii').lower()
+    return 'mixed'
+
+
+def _part_info(section, part):
+    content_type = ('%s/%s' % (part[0].decode('ascii'), part[1].decode('ascii'))).lower()
+    params = part[2] or []
+    params = [(key.decode('ascii').lower(), value.decode('ascii', 'replace'))
+              for key, value in zip(params[0::2], params[1::2])]
+    encoding = (part[5] or b'7bit').decode('ascii').lower()
+    return section, content_type, params, encoding
+
+
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def imap_date(date):
+    """
+    RFC 3501 date, e.g. 1-Feb-2020, independent of the locale.
+    """
+    return '%d-%s-%d' % (date.day, _MONTHS[date.month - 1], date.year)
+
+
+class _Literal:
+    """
+    Non-ASCII string, sent as a UTF-8 literal.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return _quote(self.value)
+
+
+def _join(tokens):
+    text = ''
+    for token in tokens:
+        token = str(token)
+        text += token if not text or text.endswith('(') or token == ')' else ' ' + token
+    return text
+
+
+def _quote(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Query:
+    """
+    IMAP SEARCH criteria, combined with & (all of), | (either of) and ~ (not).
+
+        UNSEEN & from_('info@rb.cz') & ~subject('o zůstatku') & since(datetime.date(2020, 1, 1))
+
+    imaplib sends at most one literal, at the end of the command, so
+    render() moves the criterion with a non-ASCII string to the end. When
+    that is not possible (several such strings, or one nested in OR), the
+    criteria holding them are relaxed to ALL, which selects a superset the
+    parsers' accepts() narrow down.
+    """
+
+    def __and__(self, other):
+        return And(self, as_query(other))
+
+    def __rand__(self, other):
+        return And(as_query(other), self)
+
+    def __or__(self, other):
+        return Or(self, as_query(other))
+
+    def __ror__(self, other):
+        return Or(as_query(other), self)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __str__(self):
+        return _join(str(token) for token in self.tokens())
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def tokens(self):
+        raise NotImplementedError()
+
+    def operand(self):
+        """
+        Tokens of the criteria as a single search key.
+        """
+        return ['('] + self.tokens() + [')']
+
+    def has_literal(self):
+        return any(isinstance(token, _Literal) for token in self.tokens())
+
+    def without(self, name):
+        """
+        The criteria with the key name (e.g. UNSEEN) dropped.
+        """
+        return self
+
+    def relaxed(self):
+        return self
+
+    def render(self):
+        """
+        (criteria, literal) for imaplib: the criteria text, and the UTF-8
+        string to send as a literal after it (searching with CHARSET UTF-8)
+        or None.
+        """
+        tokens = self.tokens()
+        literals = [index for index, token in enumerate(tokens) if isinstance(token, _Literal)]
+        if not literals:
+            return _join(tokens), None
+        if literals == [len(tokens) - 1]:
+            return _join(tokens[:-1]), tokens[-1].value.encode('utf-8')
+        return self.relaxed().render()
+
+
+class Key(Query):
+    """
+    Search key with its arguments: strings are quoted, dates formatted.
+    Atoms belong to the name, e.g. Key('HEADER From', 'info@rb.cz').
+    """
+
+    def __init__(self, name, *values):
+        self.name = name
+        self.values = values
+
+    def tokens(self):
+        tokens = [self.name]
+        for value in self.values:
+            if isinstance(value, str):
+                tokens.append(_quote(value) if value.isascii() else _Literal(value))
+            elif hasattr(value, 'year'):
+                tokens.append(imap_date(value))
+            else:
+                tokens.append(str(value))
+        return tokens
+
+    def operand(self):
+        return self.tokens()
+
+    def without(self, name):
+        return ALL if self.name.upper() == name.upper() else self
+
+    def relaxed(self):
+        return ALL if self.has_literal() else self
+
+
+class Raw(Query):
+    """
+    Criteria given as text.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def tokens(self):
+        return [self.text]
+
+    def operand(self):
+        return self.tokens() if ' ' not in self.text.strip() else ['(', self.text, ')']
+
+    def without(self, name):
+        text = re.sub(r'\b%s\b' % re.escape(name), '', self.text, flags=re.IGNORECASE)
+        return Raw(' '.join(text.split()) or 'ALL')
+
+
+class And(Query):
+
+    def __init__(self, *terms):
+        self.terms = []
+        for term in terms:
+            term = as_query(term)
+            self.terms.extend(term.terms if isinstance(term, And) else [term])
+
+    def tokens(self):
+        terms = [term for term in self.terms if term != ALL] or [ALL]
+        # a term with a literal goes last, see render()
+        terms.sort(key=Query.has_literal)
+        return [token for term in terms for token in term.tokens()]
+
+    def without(self, name):
+        return And(*(term.without(name) for term in self.terms))
+
+    def relaxed(self):
+        return And(*(term.relaxed() for term in self.terms))
+
+
+class Or(Query):
+
+    def __init__(self, first, second):
+        self.first = as_query(first)
+        self.second = as_query(second)
+
+    def tokens(self):
+        return ['OR'] + self.first.operand() + self.second.operand()
+
+    def operand(self):
+        return self.tokens()
+
+    def without(self, name):
+        return Or(self.first.without(name), self.second.without(name))
+
+    def relaxed(self):
+        return Or(self.first.relaxed(), self.second.relaxed())
+
+
+class Not(Query):
+
+    def __init__(self, term):
+        self.term = as_query(term)
+
+    def tokens(self):
+        return ['NOT'] + self.term.operand()
+
+    def operand(self):
+        return self.tokens()
+
+    def without(self, name):
+        return Not(self.term.without(name))
+
+    def relaxed(self):
+        # ALL is a superset of the negation whatever the term holds
+        return ALL if self.has_literal() else self
+
+
+def as_query(value):
+    return value if isinstance(value, Query) else Raw(value)
+
+
+ALL = Key('ALL')
+UNSEEN = Key('UNSEEN')
+SEEN = Key('SEEN')
+
+
+def from_(address):
+    return Key('FROM', address)
+
+
+def subject(text):
+    return Key('SUBJECT', text)
+
+
+def header(field, value):
+    return Key('HEADER %s' % field, value)
+
+
+def since(date):
+    return Key('SINCE', date)
+
+
+def before(date):
+    return Key('BEFORE', date)
+
+
+def uid(message_set_):
+    return Key('UID %s' % message_set_)
@@ -0,0 +1,178 @@
+"""
+Ingest of many export files into one chronological payment stream.
+
+Each file's format is sniffed from its first bytes: the sample is decoded
+(with the parser's encoding or the detected one) and its first rows are run
+through the column schema of every export parser, the parser decoding the
+most rows cleanly wins. Files are parsed by a pool of worker processes,
+each sorting one file by date into a spool file, in runs of SPOOL_RUN
+payments for long exports; the runs and spools are then merged lazily with
+a heap, so the merge holds one chunk per run in memory.
+
+    python -m czech_banks.ingest exports/*.csv --store payments.db --dedup seen.db
+    python -m czech_banks.ingest exports/*.csv --output payments.jsonl
+"""
+import argparse
+import contextlib
+import heapq
+import itertools
+import os
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from czech_banks.batch import to_timestamp
+from czech_banks.parser import export
+from czech_banks.parser.source import SAMPLE_SIZE, detect_encoding, open_binary
+
+EXPORT_PARSERS = (export.Equabank, export.Zuno, export.Mbank, export.Unicredit)
+# rows of the sample tried with every parser
+SNIFF_ROWS = 20
+# payments sorted in memory at once, longer exports are spooled in several sorted runs
+SPOOL_RUN = 100000
+# payments pickled together into a spool file
+SPOOL_CHUNK = 1000
+
+
+class UnknownFormat(ValueError):
+    pass
+
+
+def _sample(source):
+    with contextlib.ExitStack() as stack:
+        return open_binary(source, stack).peek(SAMPLE_SIZE)[:SAMPLE_SIZE]
+
+
+def _score(parser_class, sample):
+    parser = parser_class(None)
+    lines = sample.decode(parser.encoding or detect_encoding(sample), errors='replace').splitlines()
+    if len(sample) >= SAMPLE_SIZE:
+        # the sample most likely ends in the middle of a row
+        lines = lines[:-1]
+    return parser.score(lines, SNIFF_ROWS)
+
+
+def sniff(source, parsers=EXPORT_PARSERS):
+    """
+    The export parser class of the file (path, buffer or binary file object).
+    """
+    sample = _sample(source)
+    scores = [(_score(parser_class, sample), index) for index, parser_class in enumerate(parsers)]
+    score, index = max(scores, key=lambda item: (item[0], -item[1]))
+    if score <= 0:
+        raise UnknownFormat('unknown export format of %s' % (source if isinstance(source, (str, os.PathLike))
+                                                             else type(source).__name__))
+    return parsers[index]
+
+
+def _sort_key(payment):
+    return to_timestamp(payment.date)
+
+
+def _spool(source, directory, parsers):
+    """
+    Parse the file into a spool of date-sorted runs of pickled chunks,
+    returns its path, the (start, end) offsets of the runs, the number of
+    payments and the parser's name. A run following the previous one in
+    order is joined to it, so an ordered export is spooled as one run.
+    """
+    parser_class = sniff(source, parsers)
+    payments = iter(parser_class(source).parse())
+    runs = []
+    count = 0
+    last = None
+    descriptor, path = tempfile.mkstemp(suffix='.spool', dir=directory)
+    with os.fdopen(descriptor, 'wb') as f:
+        while True:
+            run = sorted(itertools.islice(payments, SPOOL_RUN), key=_sort_key)
+            if not run:
+                break
+            start = f.tell()
+            for offset in range(0, len(run), SPOOL_CHUNK):
+                pickle.dump(run[offset:offset + SPOOL_CHUNK], f, pickle.HIGHEST_PROTOCOL)
+            if runs and last <= _sort_key(run[0]):
+                runs[-1] = (runs[-1][0], f.tell())
+            else:
+                runs.append((start, f.tell()))
+            last = _sort_key(run[-1])
+            count += len(run)
+    return path, runs, count, parser_class.__name__
+
+
+def _read_run(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            yield from pickle.load(f)
+
+
+def _read_spool(path, runs):
+    """
+    The payments of the spool ordered by date, its runs merged lazily.
+    """
+    if len(runs) == 1:
+        return _read_run(path, *runs[0])
+    return heapq.merge(*[_read_run(path, start, end) for start, end in runs], key=_sort_key)
+
+
+def ingest(sources, workers=None, parsers=EXPORT_PARSERS, spool_dir=None, index=None):
+    """
+    Yield the payments of all export files ordered by date, payments of the
+    same date in the order of the files and rows.
+
+    :param sources: paths of the exports, optionally gzipped or zipped
+    :param workers: parsing processes, os.cpu_count() by default
+    :param spool_dir: directory for the temporary spool files
+    :param index: czech_banks.dedup.PaymentIndex skipping the payments recorded before,
+        each file is filtered on its own before the merge; the caller commits the index
+        once it kept the payments
+    """
+    sources = list(sources)
+    if not sources:
+        return
+    with tempfile.TemporaryDirectory(prefix='czech_banks-', dir=spool_dir) as directory:
+        with ProcessPoolExecutor(workers or os.cpu_count() or 1) as executor:
+            spools = list(executor.map(_spool, sources, [directory] * len(sources), [parsers] * len(sources)))
+        streams = [_read_spool(path, runs) for path, runs, count, name in spools]
+        if index is not None:
+            streams = [index.filter(stream, commit=False) for stream in streams]
+        yield from heapq.merge(*streams, key=_sort_key)
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Merge bank exports into one payment stream ordered by date.')
+    args.add_argument('files', nargs='+')
+    args.add_argument('--workers', type=int)
+    args.add_argument('--dedup', help='skip payments recorded in this fingerprint index (SQLite)')
+    args.add_argument('--store', help='append the payments to this SQLite store instead of printing them')
+    args.add_argument('--output', help='write the payments to this .csv, .tsv, .jsonl or .parquet file '
+                                       'instead of printing them')
+    args.add_argument('--spool-dir')
+    args = args.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        index = None
+        if args.dedup:
+            from czech_banks.dedup import PaymentIndex
+            index = stack.enter_context(PaymentIndex(args.dedup))
+        payments = ingest(args.files, args.workers, spool_dir=args.spool_dir, index=index)
+        # an interrupted run rolls the index back before it is closed
+        stack.callback(payments.close)
+        if args.store:
+            from czech_banks.storage import PaymentStore
+            with PaymentStore(args.store) as store:
+                written, _ = store.write(payments)
+            print('%d payments stored' % written, file=sys.stderr)
+        else:
+            from czech_banks.writers import TsvWriter, open_writer
+            with open_writer(args.output) if args.output else TsvWriter(sys.stdout) as writer:
+                written = writer.write(payments)
+            if args.output:
+                print('%d payments written' % written, file=sys.stderr)
+        if index is not None:
+            # the payments are stored or written, only now they count as seen
+            index.commit()
+
+if __name__ == '__main__':
+    main()
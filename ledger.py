@@ -0,0 +1,145 @@
+"""
+Balance of an account at any point in time.
+
+Every Balance snapshot is kept next to the account's payments, both sorted
+by time. Payments are summed up into prefix sums, so the balance at time T
+is the nearest snapshot at or before T plus the payments booked after it up
+to T (or the nearest later snapshot minus the payments up to it when T
+precedes the first snapshot): two binary searches and a subtraction.
+Amounts are kept in minor units, times in epoch microseconds as in
+czech_banks.batch. A payment dated exactly at a snapshot's time is taken as
+already included in that snapshot.
+
+New snapshots and payments are inserted in place; payments arriving out of
+order invalidate the prefix sums from their position only, which are
+recomputed on the next query.
+"""
+from bisect import bisect_right
+
+from czech_banks.batch import NAT, from_timestamp, to_minor_units, to_timestamp
+from czech_banks.models import Balance
+
+
+class AccountLedger:
+
+    def __init__(self, account):
+        self.account = account
+        self.snapshot_times = []
+        self.snapshots = []
+        self.currency = None
+        self.payment_times = []
+        self.amounts = []
+        # cumulative[i] is the sum of amounts[:i]; valid up to _valid entries
+        self._cumulative = [0]
+        self._valid = 0
+
+    def add_snapshot(self, timestamp, balance, currency=None):
+        index = bisect_right(self.snapshot_times, timestamp)
+        if index and self.snapshot_times[index - 1] == timestamp:
+            self.snapshots[index - 1] = balance
+        else:
+            self.snapshot_times.insert(index, timestamp)
+            self.snapshots.insert(index, balance)
+        if currency:
+            self.currency = currency
+
+    def add_payment(self, timestamp, amount):
+        index = bisect_right(self.payment_times, timestamp)
+        if index == len(self.payment_times):
+            self.payment_times.append(timestamp)
+            self.amounts.append(amount)
+            if self._valid == index:
+                self._cumulative.append(self._cumulative[-1] + amount)
+                self._valid += 1
+            return
+        self.payment_times.insert(index, timestamp)
+        self.amounts.insert(index, amount)
+        self._valid = min(self._valid, index)
+
+    def _paid_until(self, timestamp):
+        """
+        Sum of the payments at or before the timestamp.
+        """
+        if self._valid < len(self.amounts):
+            del self._cumulative[self._valid + 1:]
+            total = self._cumulative[-1]
+            for amount in self.amounts[self._valid:]:
+                total += amount
+                self._cumulative.append(total)
+            self._valid = len(self.amounts)
+        return self._cumulative[bisect_right(self.payment_times, timestamp)]
+
+    def balance_at(self, timestamp):
+        """
+        Balance in minor units, None without any snapshot to start from.
+        """
+        if not self.snapshots:
+            return None
+        index = bisect_right(self.snapshot_times, timestamp)
+        if index:
+            base = index - 1
+            return self.snapshots[base] + self._paid_until(timestamp) - self._paid_until(self.snapshot_times[base])
+        # before the first snapshot, undo the payments leading to it
+        return self.snapshots[0] - (self._paid_until(self.snapshot_times[0]) - self._paid_until(timestamp))
+
+
+class BalanceLedger:
+    """
+    Balance histories of many accounts.
+
+        ledger = BalanceLedger()
+        ledger.add_balances(UnicreditBalance(downloader).parse_snapshots())
+        ledger.add_payments(Unicredit('export.csv').parse())
+        ledger.balance_at('123456789/2700', datetime.datetime(2020, 3, 1))
+    """
+
+    def __init__(self):
+        self.accounts = {}
+
+    def _ledger(self, account):
+        ledger = self.accounts.get(account)
+        if ledger is None:
+            ledger = self.accounts[account] = AccountLedger(account)
+        return ledger
+
+    def add_balance(self, balance):
+        self._ledger(balance.account).add_snapshot(to_timestamp(balance.date), to_minor_units(balance.balance),
+                                                   balance.currency)
+
+    def add_balances(self, balances):
+        for balance in balances:
+            self.add_balance(balance)
+
+    def add_payment(self, payment, account=None):
+        """
+        :param account: own account the payment was booked on, payment.account_from by default
+        """
+        account = account or payment.account_from
+        if not account:
+            raise ValueError('payment without the account it was booked on')
+        timestamp = to_timestamp(payment.date)
+        if timestamp == NAT:
+            raise ValueError('payment without a date')
+        self._ledger(account).add_payment(timestamp, to_minor_units(payment.price))
+
+    def add_payments(self, payments, account=None):
+        for payment in payments:
+            self.add_payment(payment, account)
+
+    def balance_at(self, account, date):
+        """
+        Balance of the account at the date, None when the account has no snapshot.
+        """
+        ledger = self.accounts.get(account)
+        if ledger is None:
+            return None
+        timestamp = to_timestamp(date)
+        value = ledger.balance_at(timestamp)
+        if value is None:
+            return None
+        balance = Balance()
+        balance.account = account
+        balance.balance = value / 100
+        balance.date = from_timestamp(timestamp)
+        balance.currency = ledger.currency
+        return balance
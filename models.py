@@ -1,3 +1,14 @@
+import sys
+
+
+def intern_string(value):
+    """
+    Return the shared copy of a string that repeats across many records
+    (accounts, counterparties, merchants), other values are returned as they are.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
 class PaymentType:
     TYPE_UNDEFINED = 0
     TYPE_CARD = 1
@@ -8,28 +19,52 @@ class PaymentType:
 
 
 class Payment:
-    transaction_type = PaymentType.TYPE_UNDEFINED
-    price = 0
-    account = None
-    ks = None
-    ss = None
-    vs = None
-    detail_from = None
-    description = None
-    message = None
-    place = None
-    date = None
-    account_from = None
+    __slots__ = ('transaction_type', 'price', 'account', 'ks', 'ss', 'vs', 'detail_from', 'description', 'message',
+                 'place', 'date', 'account_from')
+
+    def __init__(self):
+        self.transaction_type = PaymentType.TYPE_UNDEFINED
+        self.price = 0
+        self.account = None
+        self.ks = None
+        self.ss = None
+        self.vs = None
+        self.detail_from = None
+        self.description = None
+        self.message = None
+        self.place = None
+        self.date = None
+        self.account_from = None
 
     def __str__(self):
         return '%s %s' % (self.price, self.account)
 
 
+class Invoice:
+    __slots__ = ('number', 'amount', 'paid', 'account', 'ks', 'ss', 'vs', 'due_date')
+
+    def __init__(self, number=None, amount=0, vs=None, ks=None, ss=None, account=None, due_date=None):
+        self.number = number
+        self.amount = amount
+        self.paid = 0
+        self.account = account
+        self.ks = ks
+        self.ss = ss
+        self.vs = vs
+        self.due_date = due_date
+
+    def __str__(self):
+        return '%s %s %s' % (self.number, self.amount, self.vs)
+
+
 class Balance:
-    account = None
-    balance = None
-    date = None
-    currency = None
+    __slots__ = ('account', 'balance', 'date', 'currency')
+
+    def __init__(self):
+        self.account = None
+        self.balance = None
+        self.date = None
+        self.currency = None
 
     def __str__(self):
         return '%s: %s %s' % (self.date, self.balance, self.currency)
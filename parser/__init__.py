@@ -1,6 +1,11 @@
+import csv
+import io
+import os
 from _csv import QUOTE_MINIMAL
-from email.header import decode_header
-from email.utils import parsedate_to_datetime
+from collections import deque
+
+from czech_banks.parser.source import SAMPLE_SIZE, detect_encoding, is_compressed, is_path, open_text
+from czech_banks.stats import NULL_STATS
 
 UCB_BANK_CODE = '2700'
 
@@ -15,6 +20,8 @@ class tsv:
 
 
 class Parser:
+    # czech_banks.stats.Stats recording parsing, nothing is recorded by default
+    stats = NULL_STATS
 
     def has_payments(self):
         return False
@@ -27,6 +34,75 @@ class Parser:
 
 
 class EmailParser(Parser):
+    # MIME types of the parts read by parse(), a downloader may skip the others
+    CONTENT_TYPES = ('text/plain',)
+    # IMAP SEARCH criteria (text or czech_banks.imap.Query) selecting the bank's messages, see accepts()
+    SEARCH_CRITERIA = 'ALL'
+
+    def __init__(self, downloader=None, stats=None):
+        self.downloader = downloader
+        self.stats = stats or NULL_STATS
+
+    def parse(self):
+        messages = self.downloader.download(self.search_query(), self.CONTENT_TYPES)
+        return self.parse_messages(messages)
+
+    def search_query(self):
+        """
+        The bank's unseen messages.
+        """
+        # imported here, export parsers have no use for the IMAP module and its regular expressions
+        from czech_banks.imap import UNSEEN
+        return UNSEEN & self.SEARCH_CRITERIA
+
+    def parse_messages(self, messages):
+        for num, message in messages:
+            if self.accepts(message):
+                yield from self._parse_message(message)
+            else:
+                self.downloader.set_unseen(num)
+
+    async def parse_async(self):
+        """
+        parse() for a downloader with an async download(), see czech_banks.aio.
+        """
+        messages = self.downloader.download(self.search_query(), self.CONTENT_TYPES)
+        try:
+            async for num, message in messages:
+                if self.accepts(message):
+                    for record in self._parse_message(message):
+                        yield record
+                else:
+                    await self.downloader.set_unseen(num)
+        finally:
+            # ends the session now when a parser fails, not when the generator is collected
+            await messages.aclose()
+
+    def parse_message(self, message):
+        raise NotImplementedError('Should be implemented!')
+
+    def _parse_message(self, message):
+        """
+        parse_message() recorded in the stats, a failure is counted for the bank and re-raised.
+        """
+        if not self.stats.enabled:
+            return self.parse_message(message)
+        bank = type(self).__name__
+        with self.stats.timer('parse', bank=bank):
+            records = list(self.parse_message(message))
+        self.stats.count('messages', bank=bank)
+        self.stats.count('records', len(records), bank=bank)
+        return records
+
+    def accepts(self, message):
+        """
+        Client-side counterpart of SEARCH_CRITERIA, tells whether the message
+        is a notification handled by parse_message().
+        """
+        return True
+
+    def _get_sender(self, message):
+        return (message['From'] or '').lower()
 
     def _get_message_part(self, message):
         if message.is_multipart():
@@ -37,6 +113,7 @@ class EmailParser(Parser):
             return message
 
     def _get_message_date(self, message):
+        from email.utils import parsedate_to_datetime
         return parsedate_to_datetime(message['Date'])
 
     def _get_message_content(self, message):
@@ -47,6 +124,7 @@ class EmailParser(Parser):
         return message.get_payload(decode=True).decode(charset)
 
     def _get_subject(self, message):
+        from email.header import decode_header
         sbj_bytes, encoding = decode_header(message['Subject'])[0]
         return sbj_bytes.decode(encoding) if type(sbj_bytes) == bytes else sbj_bytes
 
@@ -54,7 +132,246 @@ class EmailParser(Parser):
         return ' '.join(line.split(':')[1:]).strip()
 
 
+class BalanceEmailParser(EmailParser):
+
+    def has_balance(self):
+        return True
+
+    def parse(self):
+        # the newest balances are known after the last message only
+        with self.downloader.held_checkpoint():
+            return super().parse()
+
+    def parse_messages(self, messages):
+        return self.latest(super().parse_messages(messages))
+
+    def parse_snapshots(self):
+        """
+        parse() keeping every balance instead of the newest one per account, see czech_banks.ledger.
+        """
+        messages = self.downloader.download(self.search_query(), self.CONTENT_TYPES)
+        return super().parse_messages(messages)
+
+    async def parse_async(self):
+        with self.downloader.held_checkpoint():
+            balances = [balance async for balance in super().parse_async()]
+            for balance in self.latest(balances):
+                yield balance
+
+    def latest(self, balances):
+        """
+        Keep the newest balance of every account.
+        """
+        latest = {}
+        for balance in balances:
+            if balance.account not in latest or latest[balance.account].date < balance.date:
+                latest[balance.account] = balance
+        return list(latest.values())
+
+
 class CsvParser(Parser):
+    DIALECT = tsv
+    # None lets the encoding be detected from the data, see czech_banks.parser.source
+    ENCODING = None
+    # first column of the header row, None when the header is the first row
+    HEADER_PREFIX = None
+    # column layout, see czech_banks.parser.schema
+    SCHEMA = None
+
+    def __init__(self, source, encoding=None, member=None, stats=None):
+        """
+        :param source: path, binary file object or bytes-like buffer (bytes,
+            memoryview, mmap) of the export, optionally gzipped or zipped
+        :param encoding: overrides ENCODING
+        :param member: file to read from a zip archive, the first one by default
+        :param stats: czech_banks.stats.Stats recording rows, bytes and the parsing time
+        """
+        self.source = source
+        self.encoding = encoding or self.ENCODING
+        self.member = member
+        self.stats = stats or NULL_STATS
+
+    @property
+    def filename(self):
+        return self.source if is_path(self.source) else None
 
     def has_payments(self):
         return True
+
+    def parse(self):
+        if self.stats.enabled:
+            yield from self._parse_recorded()
+            return
+        with open_text(self.source, self.encoding, self.member) as csvfile:
+            reader = csv.reader(csvfile, dialect=self.DIALECT)
+            for row in reader:
+                if self._is_header(row):
+                    break
+            for payment in self._parse_rows(reader):
+                yield payment
+
+    def _parse_recorded(self):
+        """
+        parse() recording the rows read, payments yielded, decoded bytes, time
+        and failures of the bank. The time includes the consumer's work between
+        the payments.
+        """
+        bank = type(self).__name__
+        rows = payments = 0
+        with self.stats.timer('parse', bank=bank):
+            with open_text(self.source, self.encoding, self.member) as csvfile:
+                try:
+                    reader = csv.reader(csvfile, dialect=self.DIALECT)
+                    for row in reader:
+                        rows += 1
+                        if self._is_header(row):
+                            break
+                    for row in reader:
+                        rows += 1
+                        payment = self._parse_row(row)
+                        if payment is not None:
+                            payments += 1
+                            yield payment
+                finally:
+                    self.stats.count('rows', rows, bank=bank)
+                    self.stats.count('records', payments, bank=bank)
+                    # text streams passed in have no byte count
+                    buffer = getattr(csvfile, 'buffer', None)
+                    if buffer is not None and buffer.seekable():
+                        self.stats.count('bytes', buffer.tell(), bank=bank)
+
+    def parse_batches(self, batch_size=10000):
+        """
+        Yield the payments of parse() as columnar PaymentBatch objects of up
+        to batch_size rows, the rows are decoded into the columns directly.
+        """
+        bank = type(self).__name__
+        rows = payments = 0
+        from czech_banks.batch import PaymentBatch
+        with self.stats.timer('parse', bank=bank), open_text(self.source, self.encoding, self.member) as csvfile:
+            try:
+                reader = csv.reader(csvfile, dialect=self.DIALECT)
+                for row in reader:
+                    rows += 1
+                    if self._is_header(row):
+                        break
+                batch = PaymentBatch()
+                decode = self.SCHEMA.compile_batch(batch)
+                for row in reader:
+                    rows += 1
+                    if decode(row) and len(batch) >= batch_size:
+                        payments += len(batch)
+                        yield batch
+                        batch = PaymentBatch()
+                        decode = self.SCHEMA.compile_batch(batch)
+                payments += len(batch)
+                if len(batch):
+                    yield batch
+            finally:
+                if self.stats.enabled:
+                    self.stats.count('rows', rows, bank=bank)
+                    self.stats.count('records', payments, bank=bank)
+
+    def parse_parallel(self, workers=None, chunk_size=4 * 1024 * 1024):
+        """
+        parse() spread over a pool of worker processes. The data after the
+        header row is cut into byte ranges of about chunk_size ending on line
+        breaks, so records must not span lines. Payments are yielded in the
+        file order whatever the number of workers. Sources other than plain
+        files on disk are parsed serially.
+        """
+        if not is_path(self.source):
+            yield from self.parse()
+            return
+        with open(self.source, 'rb', buffering=SAMPLE_SIZE) as f:
+            if is_compressed(f):
+                yield from self.parse()
+                return
+            if self.encoding is None:
+                self.encoding = detect_encoding(f.peek(SAMPLE_SIZE))
+        from concurrent.futures import ProcessPoolExecutor
+        workers = workers or os.cpu_count() or 1
+        bank = type(self).__name__
+        with self.stats.timer('parse_parallel', bank=bank), ProcessPoolExecutor(workers) as executor:
+            pending = deque()
+            for start, end in self._data_ranges(chunk_size):
+                pending.append(executor.submit(_parse_range, self, start, end))
+                self.stats.count('bytes', end - start, bank=bank)
+                # keep a bounded window of chunks in flight, results are consumed in order
+                if len(pending) > 2 * workers:
+                    payments = pending.popleft().result()
+                    self.stats.count('records', len(payments), bank=bank)
+                    yield from payments
+            while pending:
+                payments = pending.popleft().result()
+                self.stats.count('records', len(payments), bank=bank)
+                yield from payments
+
+    def score(self, lines, limit=None):
+        """
+        How well the text lines, the start of an export, fit this format: the
+        payments decoded from the rows after the header less the rows failing
+        to decode. Telling the format of an unknown export, the best scoring
+        parser reads it.
+
+        :param limit: stop after this many payments, all rows by default
+        """
+        rows = csv.reader(lines, dialect=self.DIALECT)
+        for row in rows:
+            if self._is_header(row):
+                break
+        score = 0
+        for row in rows:
+            if limit is not None and score >= limit:
+                break
+            try:
+                payment = self._parse_row(row)
+            except (ValueError, IndexError, KeyError):
+                score -= 1
+                continue
+            if payment is not None:
+                score += 1
+        return score
+
+    def _parse_rows(self, rows):
+        for row in rows:
+            payment = self._parse_row(row)
+            if payment is not None:
+                yield payment
+
+    def _parse_row(self, row):
+        return self.SCHEMA.decode(row)
+
+    def _is_header(self, row):
+        if self.HEADER_PREFIX is None:
+            return True
+        return len(row) > 1 and row[0].startswith(self.HEADER_PREFIX)
+
+    def _data_ranges(self, chunk_size):
+        encoding = self.encoding
+        with open(self.source, 'rb') as f:
+            start = None
+            offset = 0
+            for line in f:
+                offset += len(line)
+                if self._is_header(next(csv.reader([line.decode(encoding)], dialect=self.DIALECT), [])):
+                    start = offset
+                    break
+            if start is None:
+                return
+            f.seek(0, io.SEEK_END)
+            size = f.tell()
+            while start < size:
+                f.seek(min(start + chunk_size, size))
+                f.readline()
+                end = min(f.tell(), size)
+                yield start, end
+                start = end
+
+
+def _parse_range(parser, start, end):
+    with open(parser.source, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    reader = csv.reader(io.StringIO(data.decode(parser.encoding), newline=''), dialect=parser.DIALECT)
+    return list(parser._parse_rows(reader))
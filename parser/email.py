@@ -1,8 +1,105 @@
 import datetime
+from operator import attrgetter
 
-import re
+from czech_banks.imap import header, subject
 from czech_banks.models import Payment, PaymentType, Balance
-from czech_banks.parser import EmailParser, UCB_BANK_CODE
+from czech_banks.parser import BalanceEmailParser, EmailParser, UCB_BANK_CODE
+from czech_banks.parser.rules import LineRules, contains, otherwise, prefix, regex
+
+
+class _CsobMessage:
+    """
+    Parsing state of a ČSOB notification listing one or more payments.
+    """
+
+    def __init__(self, date, types_map):
+        self.date = date
+        self.types_map = types_map
+        self.transaction_type = ''
+        self.valid = True
+        self.payments = []
+        self.new_payment()
+
+    def new_payment(self):
+        self.payment = Payment()
+        self.payment.date = self.date
+        self.payment.transaction_type = self.types_map.get(self.transaction_type, PaymentType.TYPE_UNDEFINED)
+        self.detail = False
+        self.sender_message = False
+        self.sender_name = False
+
+    def set_transaction_type(self, transaction_type):
+        self.transaction_type = transaction_type
+        self.payment.transaction_type = self.types_map.get(transaction_type, PaymentType.TYPE_UNDEFINED)
+
+    def balance(self, line, match):
+        if self.valid:
+            self.payments.append(self.payment)
+        self.new_payment()
+        self.valid = True
+
+    def transaction(self, line, match):
+        transaction_type = ' '.join(line.split(' ')[7:])[0:-1]
+        self.new_payment()
+        self.set_transaction_type(transaction_type)
+
+    def invalid(self, line, match):
+        self.valid = False
+
+    def price(self, line, match):
+        if ':' in line:
+            line = "castka " + line.split(':')[1].strip()
+        self.payment.price = float(line.split(' ')[1].replace(',', '.'))
+
+    def account_number(self, line, match):
+        self.payment.account = match.group(1)
+
+    def account(self, line, match):
+        self.payment.account = line.split(':')[1].strip()
+
+    def start_detail(self, line, match):
+        self.detail = True
+
+    def ks(self, line, match):
+        self.payment.ks = line.split(' ')[1]
+
+    def vs(self, line, match):
+        self.payment.vs = line.split(' ')[-1].lstrip('0')
+
+    def ss(self, line, match):
+        self.payment.ss = line.split(' ')[1]
+
+    def start_sender_message(self, line, match):
+        self.sender_message = True
+
+    def detail_line(self, line, match):
+        if not line.startswith('splatnost') and not line.startswith('zpr') and 'SPO' not in line:
+            self.payment.detail_from = line
+        if 'SPO' in line:
+            self.payment.description = line
+        if self.transaction_type == Csob.TYPE_TRANSACTION_ZPS:
+            self.payment.description = line
+        self.detail = False
+
+    def sender_name_line(self, line, match):
+        self.payment.detail_from = line
+        self.sender_name = False
+
+    def sender_message_line(self, line, match):
+        self.payment.message = line
+        self.sender_message = False
+
+    def sender(self, line, match):
+        self.payment.detail_from = " ".join(line.split(' ')[1:])
+
+    def start_sender_name(self, line, match):
+        self.sender_name = True
+
+    def place(self, line, match):
+        self.payment.place = " ".join(line.split(' ')[1:])
+
+    def saving(self, line, match):
+        self.set_transaction_type(Csob.TYPE_SAVING)
 
 
 class Csob(EmailParser):
@@ -24,92 +121,98 @@ class Csob(EmailParser):
         (TYPE_SAVING, PaymentType.TYPE_SAVING)
     )
 
-    def __init__(self, downloader):
-        self.downloader = downloader
+    RULES = LineRules(
+        contains('Zůstatek na účtu', _CsobMessage.balance),
+        prefix('dne', _CsobMessage.transaction),
+        contains('bude na', _CsobMessage.invalid),
+        prefix('částka', _CsobMessage.price, ignore_case=True),
+        regex(r'(?=.*účet)[^\d]+((\d+\-)?\d+/\d+)$', _CsobMessage.account_number),
+        prefix('číslo účtu', _CsobMessage.account, ignore_case=True,
+               guard=lambda state: state.transaction_type != Csob.TYPE_FEE_FX),
+        prefix(('detail', 'Účel platby'), _CsobMessage.start_detail),
+        prefix('KS', _CsobMessage.ks),
+        prefix('VS', _CsobMessage.vs),
+        prefix('SS', _CsobMessage.ss),
+        prefix('zpráva pro', _CsobMessage.start_sender_message),
+        otherwise(_CsobMessage.detail_line, guard=attrgetter('detail')),
+        otherwise(_CsobMessage.sender_name_line, guard=attrgetter('sender_name')),
+        otherwise(_CsobMessage.sender_message_line, guard=attrgetter('sender_message')),
+        prefix('Od', _CsobMessage.sender),
+        prefix('Plátce', _CsobMessage.start_sender_name),
+        prefix('Místo', _CsobMessage.place),
+        contains('úrok', _CsobMessage.saving),
+    )
+
+    SEARCH_CRITERIA = header('Subject', 'Info 24')
 
     def has_payments(self):
         return True
 
-    def parse(self):
-        messages = self.downloader.download('UNSEEN HEADER Subject "Info 24"')
-        for num, message in messages:
-            date = self._get_message_date(message)
-            subject = self._get_subject(message)
-            if 'Avízo' in subject:
-                body = self._get_message_content(message)
-                body = body[0:body.index('Vaše ČSOB')]
-                payment = Payment()
-                payment.date = date
-                if 'klientko' in body:
-                    body = '\n'.join(body.split('\n\n')[1:])
-                detail = False
-                account_num_regex = re.compile(r'[^\d]+((\d+\-)?\d+/\d+)$')
-                sender_message = False
-                sender_name = False
-                transaction_type = ''
-                valid = True
-                for line in body.split('\n'):
-                    account_number_matches = account_num_regex.match(line)
-                    if 'Zůstatek na účtu' in line:
-                        if valid:
-                            print(payment)
-                            yield payment
-                        payment = Payment()
-                        payment.date = date
-                        detail = False
-                        valid = True
-                        sender_message = False
-                        sender_name = False
-                    elif line.startswith('dne'):
-                        transaction_type = ' '.join(line.split(' ')[7:])[0:-1]
-                        detail = False
-                        sender_message = False
-                        sender_name = False
-                        payment = Payment()
-                        payment.date = date
-                    elif 'bude na' in line:
-                        valid = False
-                    elif line.lower().startswith('částka'):
-                        if ':' in line:
-                            line = "castka " + line.split(':')[1].strip()
-                        payment.price = float(line.split(' ')[1].replace(',', '.'))
-                    elif account_number_matches and 'účet' in line:
-                        payment.account = account_number_matches.group(1)
-                    elif line.lower().startswith('číslo účtu') and transaction_type != self.TYPE_FEE_FX:
-                        payment.account = line.split(':')[1].strip()
-                    elif line.startswith('detail') or line.startswith('Účel platby'):
-                        detail = True
-                    elif line.startswith('KS'):
-                        payment.ks = line.split(' ')[1]
-                    elif line.startswith('VS'):
-                        payment.vs = line.split(' ')[-1].lstrip('0')
-                    elif line.startswith('SS'):
-                        payment.ss = line.split(' ')[1]
-                    elif line.startswith('zpráva pro'):
-                        sender_message = True
-                    elif detail:
-                        if not line.startswith('splatnost') and not line.startswith('zpr') and 'SPO' not in line:
-                            payment.detail_from = line
-                        if 'SPO' in line:
-                            payment.description = line
-                        if transaction_type == self.TYPE_TRANSACTION_ZPS:
-                            payment.description = line
-                        detail = False
-                    elif sender_name:
-                        payment.detail_from = line
-                        sender_name = False
-                    elif sender_message:
-                        payment.message = line
-                        sender_message = False
-                    elif line.startswith('Od'):
-                        payment.detail_from = " ".join(line.split(' ')[1:])
-                    elif line.startswith('Plátce'):
-                        sender_name = True
-                    elif line.startswith('Místo'):
-                        payment.place = " ".join(line.split(' ')[1:])
-                    elif 'úrok' in line:
-                        transaction_type = self.TYPE_SAVING
-                    payment.transaction_type = dict(self.TYPES_MAP).get(transaction_type, PaymentType.TYPE_UNDEFINED)
+    def accepts(self, message):
+        return 'Info 24' in self._get_subject(message)
+
+    def parse_message(self, message):
+        date = self._get_message_date(message)
+        subject = self._get_subject(message)
+        if 'Avízo' in subject:
+            body = self._get_message_content(message)
+            body = body[0:body.index('Vaše ČSOB')]
+            if 'klientko' in body:
+                body = '\n'.join(body.split('\n\n')[1:])
+            state = self.RULES.dispatch(body.split('\n'), _CsobMessage(date, dict(self.TYPES_MAP)))
+            yield from state.payments
+
+
+class _RaiffeisenbankMessage:
+
+    def __init__(self, parser, message):
+        self.parser = parser
+        self.message = message
+        self.payment = Payment()
+        self.payment_type = 0
+
+    def outgoing(self, line, match):
+        self.payment.transaction_type = PaymentType.TYPE_TRANSACTION
+        self.payment_type = Raiffeisenbank.TYPE_OUTGOING
+
+    def incoming(self, line, match):
+        self.payment.transaction_type = PaymentType.TYPE_TRANSACTION
+        self.payment_type = Raiffeisenbank.TYPE_INCOMING
+
+    def source(self, line, match):
+        if self.payment_type == Raiffeisenbank.TYPE_INCOMING:
+            self.payment.account = '/'.join(self.parser._get_line_data(line).split('/')[0:2])
+        elif self.payment_type == Raiffeisenbank.TYPE_OUTGOING:
+            self.payment.account_from = '/'.join(self.parser._get_line_data(line).split('/')[0:2])
+
+    def target(self, line, match):
+        if self.payment_type == Raiffeisenbank.TYPE_OUTGOING:
+            self.payment.account = '/'.join(self.parser._get_line_data(line).split('/')[0:2])
+        elif self.payment_type == Raiffeisenbank.TYPE_INCOMING:
+            self.payment.account_from = '/'.join(self.parser._get_line_data(line).split('/')[0:2])
+
+    def price(self, line, match):
+        self.payment.price = float(''.join(self.parser._get_line_data(line).split(' ')[0:-1]).replace(',', '.'))
+        if self.payment_type == Raiffeisenbank.TYPE_OUTGOING:
+            self.payment.price = -1 * self.payment.price
+
+    def ks(self, line, match):
+        self.payment.ks = self.parser._get_line_data(line)
+
+    def vs(self, line, match):
+        self.payment.vs = self.parser._get_line_data(line)
+
+    def ss(self, line, match):
+        self.payment.ss = self.parser._get_line_data(line)
+
+    def date(self, line, match):
+        try:
+            self.payment.date = datetime.datetime.strptime(self.parser._get_line_data(line), '%d.%m.%Y %H:%M')
+        except ValueError:
+            self.payment.date = self.parser._get_message_date(self.message)
+
+    def text(self, line, match):
+        self.payment.message = self.parser._get_line_data(line)
 
 
 class Raiffeisenbank(EmailParser):
@@ -140,200 +243,201 @@ class Raiffeisenbank(EmailParser):
     TYPE_OUTGOING = 1
     TYPE_INCOMING = 2
 
-    def __init__(self, downloader):
-        self.downloader = downloader
+    RULES = LineRules(
+        contains('ODCHOZI', _RaiffeisenbankMessage.outgoing),
+        contains('PRICHOZI', _RaiffeisenbankMessage.incoming),
+        # the counterparty is the sender of incoming payments and the recipient of outgoing ones
+        prefix('Z:', _RaiffeisenbankMessage.source),
+        prefix('Na', _RaiffeisenbankMessage.target),
+        prefix('Castka:', _RaiffeisenbankMessage.price),
+        prefix('KS:', _RaiffeisenbankMessage.ks),
+        prefix('VS:', _RaiffeisenbankMessage.vs),
+        prefix('SS:', _RaiffeisenbankMessage.ss),
+        prefix('Dne:', _RaiffeisenbankMessage.date),
+        prefix('Zprava:', _RaiffeisenbankMessage.text),
+    )
 
-    def has_payments(self):
-        return True
+    SEARCH_CRITERIA = header('From', 'info@rb.cz')
 
-    def parse(self):
-        messages = self.downloader.download('UNSEEN HEADER From "info@rb.cz"')
-        for num, message in messages:
-            body = self._get_message_content(message)
-            payment = Payment()
-            payment_type = 0
-            for line in body.split('\n'):
-                if 'ODCHOZI' in line:
-                    payment.transaction_type = PaymentType.TYPE_TRANSACTION
-                    payment_type = self.TYPE_OUTGOING
-                elif 'PRICHOZI' in line:
-                    payment.transaction_type = PaymentType.TYPE_TRANSACTION
-                    payment_type = self.TYPE_INCOMING
-                elif (line.startswith('Z:') and payment_type == self.TYPE_INCOMING) or (
-                            line.startswith('Na') and payment_type == self.TYPE_OUTGOING):
-                    payment.account = '/'.join(self._get_line_data(line).split('/')[0:2])
-                elif (line.startswith('Z:') and payment_type == self.TYPE_OUTGOING) or (
-                            line.startswith('Na') and payment_type == self.TYPE_INCOMING):
-                    payment.account_from = '/'.join(self._get_line_data(line).split('/')[0:2])
-                elif line.startswith('Castka:'):
-                    payment.price = float(''.join(self._get_line_data(line).split(' ')[0:-1]).replace(',', '.'))
-                    if payment_type == self.TYPE_OUTGOING:
-                        payment.price = -1 * payment.price
-                elif line.startswith('KS:'):
-                    payment.ks = self._get_line_data(line)
-                elif line.startswith('VS:'):
-                    payment.vs = self._get_line_data(line)
-                elif line.startswith('SS:'):
-                    payment.ss = self._get_line_data(line)
-                elif line.startswith('Dne:'):
-                    try:
-                        payment.date = datetime.datetime.strptime(self._get_line_data(line), '%d.%m.%Y %H:%M')
-                    except ValueError as e:
-                        payment.date = self._get_message_date(message)
-                elif line.startswith('Zprava:'):
-                    payment.message = self._get_line_data(line)
-            yield payment
-
-
-class EquabankBalance(EmailParser):
-    def __init__(self, downloader):
-        self.downloader = downloader
-
-    def has_balance(self):
+    def has_payments(self):
         return True
 
-    def parse(self):
-        balances = {}
-        messages = self.downloader.download('UNSEEN HEADER From "info@equabank.cz"')
-        for num, message in messages:
-            message_balance = Balance()
-            body = self._get_message_content(message)
-            for line in body.split('\n'):
-                parts = line.split(' ')
-                if 'stka' in line:
-                    message_balance.account = self._extract_line_part(parts, 3, 4, '')
-                elif 'dne' in line:
-                    message_balance.balance = float(self._extract_line_part(parts, -2, -1, '').replace(',', '.'))
-                    message_balance.currency = self._extract_line_part(parts, -1, None, '').strip('.')
-                    try:
-                        message_balance.date = datetime.datetime.strptime(self._extract_line_part(parts, 3, 5, ' '),
-                                                                          '%d.%m.%Y %H:%M')
-                    except ValueError:
-                        message_balance.date = self._get_message_date(message)
-            if (message_balance.account not in balances.keys() or balances[
-                message_balance.account].date < message_balance.date):
-                balances[message_balance.account] = message_balance
-        return balances.values()
+    def accepts(self, message):
+        return 'info@rb.cz' in self._get_sender(message)
+
+    def parse_message(self, message):
+        state = _RaiffeisenbankMessage(self, message)
+        self.RULES.dispatch(self._get_message_content(message).split('\n'), state)
+        yield state.payment
+
+
+class EquabankBalance(BalanceEmailParser):
+    SEARCH_CRITERIA = header('From', 'info@equabank.cz')
+
+    def accepts(self, message):
+        return 'info@equabank.cz' in self._get_sender(message)
+
+    def parse_message(self, message):
+        message_balance = Balance()
+        body = self._get_message_content(message)
+        for line in body.split('\n'):
+            parts = line.split(' ')
+            if 'stka' in line:
+                message_balance.account = self._extract_line_part(parts, 3, 4, '')
+            elif 'dne' in line:
+                message_balance.balance = float(self._extract_line_part(parts, -2, -1, '').replace(',', '.'))
+                message_balance.currency = self._extract_line_part(parts, -1, None, '').strip('.')
+                try:
+                    message_balance.date = datetime.datetime.strptime(self._extract_line_part(parts, 3, 5, ' '),
+                                                                      '%d.%m.%Y %H:%M')
+                except ValueError:
+                    message_balance.date = self._get_message_date(message)
+        yield message_balance
 
     def _extract_line_part(self, parts, start, end, delimiter):
         return delimiter.join(parts[start:end if end is not None else len(parts)]).strip()
 
 
-class MbankBalance(EmailParser):
-    def __init__(self, downloader):
-        self.downloader = downloader
+class MbankBalance(BalanceEmailParser):
+    CONTENT_TYPES = ('text/html',)
+    SEARCH_CRITERIA = header('From', 'kontakt@mbank.cz') & subject('Email Push')
+
+    def accepts(self, message):
+        return 'kontakt@mbank.cz' in self._get_sender(message) and 'Email Push' in self._get_subject(message)
+
+    def parse_message(self, message):
+        if not message.is_multipart():
+            return
+        message_balance = Balance()
+        body = None
+        for part in message.walk():
+            if part.get_content_type() == 'text/html' and 'Vlast.prostr' in part.get_payload():
+                body = part.get_payload()
+                break
+        if not body:
+            return
+        tmp = body[body.rindex('Vlast.prostr'):]
+        tmp = ''.join(tmp[0:tmp.index('<')].split(':')[1]).strip('.').strip()
+        message_balance.date = self._get_message_date(message)
+        message_balance.balance = float(''.join(tmp.split(' ')[0]).replace(',', '.'))
+        message_balance.currency = ''.join(tmp.split(' ')[-1])
+        yield message_balance
+
+
+class _UnicreditMessage:
+
+    def __init__(self, parser, message):
+        self.parser = parser
+        self.message = message
+        self.payment = Payment()
+
+    def account_from(self, line, match):
+        self.payment.account_from = ''.join(''.join(line.split(':')[1]).strip().split(' ')[0]) + \
+                                    '/' + UCB_BANK_CODE
+
+    def account(self, line, match):
+        self.payment.account = self.parser._get_line_data(line).lstrip('0/') or None
+
+    def detail_from(self, line, match):
+        self.payment.detail_from = self.parser._get_line_data(line) or None
+
+    def price(self, line, match):
+        self.payment.price = float(''.join(self.parser._get_line_data(line).split(' ')[0])
+                                   .replace('.', '')
+                                   .replace(',', '.'))
+
+    def ks(self, line, match):
+        self.payment.ks = self.parser._get_line_data(line) or None
+
+    def vs(self, line, match):
+        self.payment.vs = self.parser._get_line_data(line) or None
+
+    def ss(self, line, match):
+        self.payment.ss = self.parser._get_line_data(line) or None
+
+    def date(self, line, match):
+        try:
+            self.payment.date = datetime.datetime.strptime(self.parser._get_line_data(line), '%d.%m.%Y %H:%M')
+        except ValueError:
+            self.payment.date = self.parser._get_message_date(self.message)
+
+    def details(self, line, match):
+        line_content = self.parser._get_line_data(line)
+        details = line_content.split('                ')
+        if len(details) == 5:
+            self.payment.place = details[4].strip()
+            self.payment.description = ' '.join([x.strip() for x in details[0:3]])
+        elif len(details) > 0:
+            self.payment.description = ' '.join(details) or None
+        else:
+            self.payment.message = line_content or None
 
-    def has_balance(self):
+
+class Unicredit(EmailParser):
+    SEARCH_CRITERIA = header('From', 'unicreditbank@unicreditgroup.cz') & ~subject('o zůstatku')
+
+    RULES = LineRules(
+        contains('Vás informuje', _UnicreditMessage.account_from),
+        prefix('Číslo účtu protistrany:', _UnicreditMessage.account),
+        prefix('Název účtu protistrany:', _UnicreditMessage.detail_from),
+        prefix('Částka:', _UnicreditMessage.price),
+        prefix('Konstatní symbol:', _UnicreditMessage.ks),
+        prefix('Variabilní symbol:', _UnicreditMessage.vs),
+        prefix('Specifický symbol:', _UnicreditMessage.ss),
+        prefix('Datum:', _UnicreditMessage.date),
+        prefix('Detaily transakce:', _UnicreditMessage.details),
+    )
+
+    def has_payments(self):
         return True
 
-    def parse(self):
-        balance = Balance()
-        messages = self.downloader.download('UNSEEN HEADER From "kontakt@mbank.cz"')
-        for num, message in messages:
-            if 'Email Push' in self._get_subject(message):
-                message_balance = Balance()
-                if not message.is_multipart():
-                    continue
-                body = None
-                for part in message.walk():
-                    if part.get_content_type() == 'text/html' and 'Vlast.prostr' in part.get_payload():
-                        body = part.get_payload()
-                        break
-                if not body:
-                    continue
-                tmp = body[body.rindex('Vlast.prostr'):]
-                tmp = ''.join(tmp[0:tmp.index('<')].split(':')[1]).strip('.').strip()
-                message_balance.date = self._get_message_date(message)
-                message_balance.balance = float(''.join(tmp.split(' ')[0]).replace(',', '.'))
-                message_balance.currency = ''.join(tmp.split(' ')[-1])
-                if balance.balance is None or balance.date < message_balance.date:
-                    balance = message_balance
-        return [balance]
+    def accepts(self, message):
+        return 'unicreditbank@unicreditgroup.cz' in self._get_sender(message) and \
+            'o zůstatku' not in self._get_subject(message)
 
+    def parse_message(self, message):
+        state = _UnicreditMessage(self, message)
+        self.RULES.dispatch(self._get_message_content(message).split('\n'), state)
+        yield state.payment
 
-class Unicredit(EmailParser):
 
-    def __init__(self, downloader):
-        self.downloader = downloader
+class _UnicreditBalanceMessage:
 
-    def has_payments(self):
-        return True
+    def __init__(self, parser, message):
+        self.parser = parser
+        self.message = message
+        self.balance = Balance()
 
-    def parse(self):
-        messages = self.downloader.download('UNSEEN HEADER From "unicreditbank@unicreditgroup.cz"')
-        for num, message in messages:
-            if 'o zůstatku' not in self._get_subject(message):
-                self.downloader.set_unseen(num)
+    def account(self, line, match):
+        self.balance.account = ''.join(''.join(line.split(':')[1]).strip().split('/')[0]) + '/' + UCB_BANK_CODE
 
-            body = self._get_message_content(message)
-            payment = Payment()
-            for line in body.split('\n'):
-                if 'Vás informuje' in line:
-                    payment.account_from = ''.join(''.join(line.split(':')[1]).strip().split(' ')[0]) + \
-                                           '/' + UCB_BANK_CODE
-                elif line.startswith('Číslo účtu protistrany:'):
-                    payment.account = self._get_line_data(line).lstrip('0/') or None
-                elif line.startswith('Název účtu protistrany:'):
-                    payment.detail_from = self._get_line_data(line) or None
-                elif line.startswith('Částka:'):
-                    payment.price = float(''.join(self._get_line_data(line).split(' ')[0])
-                                          .replace('.', '')
-                                          .replace(',', '.'))
-                elif line.startswith('Konstatní symbol:'):
-                    payment.ks = self._get_line_data(line) or None
-                elif line.startswith('Variabilní symbol:'):
-                    payment.vs = self._get_line_data(line) or None
-                elif line.startswith('Specifický symbol:'):
-                    payment.ss = self._get_line_data(line) or None
-                elif line.startswith('Datum:'):
-                    try:
-                        payment.date = datetime.datetime.strptime(self._get_line_data(line), '%d.%m.%Y %H:%M')
-                    except ValueError as e:
-                        payment.date = self._get_message_date(message)
-                elif line.startswith('Detaily transakce:'):
-                    line_content = self._get_line_data(line)
-                    details = line_content.split('                ')
-                    if len(details) == 5:
-                        payment.place = details[4].strip()
-                        payment.description = ' '.join([x.strip() for x in details[0:3]])
-                    elif len(details) > 0:
-                        payment.description = ' '.join(details) or None
-                    else:
-                        payment.message = line_content or None
-
-            yield payment
-
-
-class UnicreditBalance(EmailParser):
-    def __init__(self, downloader):
-        self.downloader = downloader
-
-    def has_balance(self):
-        return True
+    def amount(self, line, match):
+        tmp = self.parser._get_line_data(line)
+        self.balance.balance = float(''.join(tmp.split(' ')[0]).replace('.', '').replace(',', '.'))
+        self.balance.currency = ''.join(tmp.split(' ')[-1])
+
+    def date(self, line, match):
+        try:
+            self.balance.date = datetime.datetime.strptime(self.parser._get_line_data(line), '%d.%m.%Y %H:%M')
+        except ValueError:
+            self.balance.date = self.parser._get_message_date(self.message)
+
+
+class UnicreditBalance(BalanceEmailParser):
+    SEARCH_CRITERIA = header('From', 'unicreditbank@unicreditgroup.cz') & subject('o zůstatku')
+
+    RULES = LineRules(
+        # the account line is checked on its own, the other two rules form a chain
+        contains('Vás informuje', _UnicreditBalanceMessage.account, fallthrough=True),
+        contains('Disponibilní zůstatek', _UnicreditBalanceMessage.amount),
+        contains('Datum:', _UnicreditBalanceMessage.date),
+    )
+
+    def accepts(self, message):
+        return 'unicreditbank@unicreditgroup.cz' in self._get_sender(message) and \
+            'o zůstatku' in self._get_subject(message)
 
-    def parse(self):
-        balances = {}
-        messages = self.downloader.download('UNSEEN HEADER From "unicreditbank@unicreditgroup.cz"')
-        for num, message in messages:
-            if 'o zůstatku' not in self._get_subject(message):
-                self.downloader.set_unseen(num)
-            else:
-                msg_balance = Balance()
-                body = self._get_message_content(message)
-                for line in body.split('\n'):
-                    if 'Vás informuje' in line:
-                        msg_balance.account_from = ''.join(''.join(line.split(':')[1]).strip().split('/')[0]) + \
-                                               '/' + UCB_BANK_CODE
-                    if 'Disponibilní zůstatek' in line:
-                        tmp = self._get_line_data(line)
-                        msg_balance.balance = float(''.join(tmp.split(' ')[0]).replace('.', '').replace(',', '.'))
-                        msg_balance.currency = ''.join(tmp.split(' ')[-1])
-                    elif 'Datum:' in line:
-                        try:
-                            msg_balance.date = datetime.datetime.strptime(self._get_line_data(line), '%d.%m.%Y %H:%M')
-                        except ValueError as e:
-                            msg_balance.date = self._get_message_date(message)
-                if (msg_balance.account not in balances.keys() or
-                        balances[msg_balance.account].date < msg_balance.date):
-                    balances[msg_balance.account] = msg_balance
-        return balances.values()
+    def parse_message(self, message):
+        state = _UnicreditBalanceMessage(self, message)
+        self.RULES.dispatch(self._get_message_content(message).split('\n'), state)
+        yield state.balance
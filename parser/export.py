@@ -1,8 +1,12 @@
-import csv
-import datetime
+from czech_banks.models import PaymentType, intern_string
+from czech_banks.parser import CsvParser, UCB_BANK_CODE
+from czech_banks.parser.schema import Schema
 
-from czech_banks.models import PaymentType, Payment
-from czech_banks.parser import CsvParser, tsv, UCB_BANK_CODE
+
+def _equabank_post(payment, row):
+    payment.description = row[8] or row[9]
+    if payment.transaction_type != PaymentType.TYPE_CARD:
+        payment.account = intern_string(row[2])
 
 
 class Equabank(CsvParser):
@@ -18,27 +22,17 @@ class Equabank(CsvParser):
         ('Výběr z bankomatu', PaymentType.TYPE_CARD),
     )
 
-    def __init__(self, filename):
-        self.filename = filename
-
-    def parse(self):
-        with open(self.filename, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile, dialect=tsv)
-            header = True
-            for row in reader:
-                if header:
-                    header = False
-                    continue
-                my_account_num, iban, contra_account, name, date1, date2, price, detail, description, category, code = row
-                payment = Payment()
-                payment.price = float(price.replace(',', '.'))
-                payment.detail_from = name.strip('.').strip() or None
-                payment.date = datetime.datetime.strptime(date1, '%d.%m.%Y')
-                payment.description = description or category
-                payment.transaction_type = dict(self.TYPE_MAP).get(detail, PaymentType.TYPE_UNDEFINED)
-                if payment.transaction_type != PaymentType.TYPE_CARD:
-                    payment.account = contra_account
-                yield payment
+    SCHEMA = Schema(
+        amount=6, date=4, date_format='%d.%m.%Y', transaction_type=7, type_map=TYPE_MAP, min_columns=11,
+        fields=(
+            ('detail_from', 3, lambda name: intern_string(name.strip('.').strip()) or None),
+        ),
+        post=_equabank_post,
+    )
+
+
+def _zuno_post(payment, row):
+    payment.account = intern_string((row[3].lstrip('0') + '/' + row[4]).strip('/').strip())
 
 
 class Zuno(CsvParser):
@@ -61,26 +55,30 @@ class Zuno(CsvParser):
         ('Výběr z bankomatu', PaymentType.TYPE_CARD),
     )
 
-    def __init__(self, filename):
-        self.filename = filename
-
-    def parse(self):
-        with open(self.filename, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            header = True
-            for row in reader:
-                if header:
-                    header = False
-                    continue
-                date, tr_type, acc_name, contra_account, contra_account_code, description, price = row[0:7]
-                payment = Payment()
-                payment.price = float(price.replace(',', '.').replace(' ', ''))
-                payment.date = datetime.datetime.strptime(date, '%d.%m.%Y')
-                payment.message = description
-                payment.description = description
-                payment.account = (contra_account.lstrip('0') + '/' + contra_account_code).strip('/').strip()
-                payment.transaction_type = dict(self.TYPE_MAP).get(tr_type, PaymentType.TYPE_UNDEFINED)
-                yield payment
+    DIALECT = 'excel'
+    SCHEMA = Schema(
+        amount=6, date=0, date_format='%d.%m.%Y', transaction_type=1, type_map=TYPE_MAP, min_columns=7,
+        fields=(
+            ('message', 5, None),
+            ('description', 5, None),
+        ),
+        post=_zuno_post,
+    )
+
+
+def _mbank_post(payment, row):
+    description = row[3].strip(' \'')
+    from_name = row[4].strip(' \'')
+    if '                            ' in description:
+        description = description.split('                            ')[0]
+    if '/' in description:
+        parts = description.split('/')
+        from_name = '/'.join(parts[0:-1])
+        payment.place = intern_string(parts[-1].strip())
+        description = ''
+    payment.description = description.strip()
+    payment.detail_from = intern_string(from_name)
+    payment.account = intern_string(row[5].strip(' \'').lstrip('0').lstrip('-').lstrip('0'))
 
 
 class Mbank(CsvParser):
@@ -97,39 +95,27 @@ class Mbank(CsvParser):
         ('ZÚČTOVÁNÍ ÚROKŮ', PaymentType.TYPE_SAVING),
     )
 
-    def __init__(self, filename):
-        self.filename = filename
-
-    def parse(self):
-        with open(self.filename, 'r', newline='', encoding='iso-8859-2') as csvfile:
-            reader = csv.reader(csvfile, dialect=tsv)
-            header = True
-            for row in reader:
-                if header:
-                    if len(row) > 1 and row[0].startswith('#Datum'):
-                        header = False
-                    continue
-                if len(row) < 11:
-                    continue
-                date, date2, tr_type, description, from_name, contra_account, ks, vs, ss, price, balance = row[0:11]
-                payment = Payment()
-                payment.price = float(price.replace(',', '.').replace(' ', ''))
-                payment.date = datetime.datetime.strptime(date, '%d-%m-%Y')
-                description = description.strip(' \'')
-                from_name = from_name.strip(' \'')
-                contra_account = contra_account.strip(' \'')
-                if '                            ' in description:
-                    description = description.split('                            ')[0]
-                if '/' in description:
-                    parts = description.split('/')
-                    from_name = '/'.join(parts[0:-1])
-                    payment.place = parts[-1].strip()
-                    description = ''
-                payment.description = description.strip()
-                payment.detail_from = from_name
-                payment.account = contra_account.lstrip('0').lstrip('-').lstrip('0')
-                payment.transaction_type = dict(self.TYPE_MAP).get(tr_type, PaymentType.TYPE_UNDEFINED)
-                yield payment
+    ENCODING = 'iso-8859-2'
+    HEADER_PREFIX = '#Datum'
+    SCHEMA = Schema(
+        amount=9, date=0, date_format='%d-%m-%Y', transaction_type=2, type_map=TYPE_MAP, min_columns=11,
+        post=_mbank_post,
+    )
+
+
+def _unicredit_post(payment, row):
+    payment.account = intern_string((row[8] + '/' + row[5]).strip('/'))
+    payment.account_from = intern_string(row[0] + '/' + UCB_BANK_CODE)
+    if payment.transaction_type == PaymentType.TYPE_UNDEFINED:
+        tr_type = row[13]
+        if tr_type.lower().startswith('poplat'):
+            payment.transaction_type = PaymentType.TYPE_FEES
+        else:
+            payment.transaction_type = PaymentType.TYPE_TRANSACTION
+            payment.message = tr_type
+    if payment.transaction_type == PaymentType.TYPE_CARD:
+        payment.place = intern_string(row[18])
+    payment.description = ('%s %s %s' % (row[14], row[15], row[16])).strip()
 
 
 class Unicredit(CsvParser):
@@ -149,39 +135,14 @@ class Unicredit(CsvParser):
         ('SRÁŽKOVÁ DAŇ', PaymentType.TYPE_SAVING),
     )
 
-    def __init__(self, filename):
-        self.filename = filename
-
-    def parse(self):
-        with open(self.filename, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile, dialect=tsv)
-            header = True
-            for row in reader:
-                if header:
-                    if len(row) > 1 and row[0].startswith('Účet'):
-                        header = False
-                    continue
-                if len(row) < 24:
-                    continue
-                acc, price, currency, date, date2, bank_code, bank_name, bank_name2, account, detail_from, add1, add2, add3, \
-                    tr_type, detail1, detail2, detail3, detail4, detail5, ks, vs, ss, pay_title, ref_num = row[0:24]
-                payment = Payment()
-                payment.price = float(price.replace(',', '.'))
-                payment.date = datetime.datetime.strptime(date, '%Y-%m-%d')
-                payment.account = (account + '/' + bank_code).strip('/')
-                payment.account_from = acc + '/' + UCB_BANK_CODE
-                payment.detail_from = detail_from
-                payment.transaction_type = dict(self.TYPE_MAP).get(tr_type, PaymentType.TYPE_UNDEFINED)
-                if payment.transaction_type == PaymentType.TYPE_UNDEFINED:
-                    if tr_type.lower().startswith('poplat'):
-                        payment.transaction_type = PaymentType.TYPE_FEES
-                    else:
-                        payment.transaction_type = PaymentType.TYPE_TRANSACTION
-                        payment.message = tr_type
-                if payment.transaction_type == PaymentType.TYPE_CARD:
-                    payment.place = detail5
-                payment.description = ('%s %s %s' % (detail1, detail2, detail3)).strip()
-                payment.vs = vs
-                payment.ks = ks
-                payment.ss = ss
-                yield payment
+    HEADER_PREFIX = 'Účet'
+    SCHEMA = Schema(
+        amount=1, date=3, date_format='%Y-%m-%d', transaction_type=13, type_map=TYPE_MAP, min_columns=24,
+        fields=(
+            ('detail_from', 9, intern_string),
+            ('ks', 19, None),
+            ('vs', 20, None),
+            ('ss', 21, None),
+        ),
+        post=_unicredit_post,
+    )
@@ -0,0 +1,139 @@
+"""
+Line dispatch for the e-mail notification parsers.
+
+A bank's template is described by an ordered table of rules, each pairing a
+line test (a prefix, a substring or a regular expression) and an optional
+guard on the parsing state with a handler. Like an if/elif chain, the first
+rule whose test and guard pass handles the line. The tests of all rules are
+compiled into one alternation, so a line is classified by a single regex
+match instead of a test per branch; only when the matched rule's guard
+fails is the line matched again against the rules after it.
+
+    RULES = LineRules(
+        prefix('Zprava:', _Message.text),
+        prefix(('VS:', 'Variabilní symbol:'), _Message.vs),
+        otherwise(_Message.detail_line, guard=attrgetter('detail')),
+        contains('úrok', _Message.saving),
+    )
+    state = RULES.dispatch(body.split('\\n'), _Message())
+"""
+import re
+
+
+class Rule:
+    __slots__ = ('pattern', 'handler', 'guard', 'fallthrough', 'regex')
+
+    def __init__(self, pattern, handler, guard=None, fallthrough=False, regex=None):
+        """
+        :param pattern: regular expression matched at the start of the line, None matches every line
+        :param handler: callable(state, line, match), match being the regex match of regex rules, else None
+        :param guard: callable(state), the rule is skipped when it returns a false value
+        :param fallthrough: after the handler, keep looking for a rule among the following ones
+        :param regex: compiled expression whose match is passed to the handler
+        """
+        self.pattern = pattern
+        self.handler = handler
+        self.guard = guard
+        self.fallthrough = fallthrough
+        self.regex = regex
+
+
+def prefix(text, handler, guard=None, ignore_case=False, fallthrough=False):
+    """
+    Rule for lines starting with the text, or with any of them when given a tuple.
+    """
+    texts = (text,) if isinstance(text, str) else text
+    pattern = '|'.join(re.escape(text) for text in texts)
+    if ignore_case:
+        pattern = '(?i:%s)' % pattern
+    return Rule(pattern, handler, guard, fallthrough)
+
+
+def contains(text, handler, guard=None, fallthrough=False):
+    """
+    Rule for lines containing the text.
+    """
+    # greedy, the regex engine then looks for the text backwards instead of trying every position
+    return Rule('.*' + re.escape(text), handler, guard, fallthrough)
+
+
+def regex(pattern, handler, guard=None, fallthrough=False):
+    """
+    Rule for lines matching the expression (re.match), the handler gets the match.
+    """
+    return Rule(pattern, handler, guard, fallthrough, re.compile(pattern, re.DOTALL))
+
+
+def otherwise(handler, guard=None, fallthrough=False):
+    """
+    Rule for any line, usually guarded by the state set by a previous line.
+    """
+    return Rule(None, handler, guard, fallthrough)
+
+
+class LineRules:
+
+    def __init__(self, *rules):
+        self.rules = rules
+        # combined expressions of rules[start:] with (rule index, handler or None) per group, compiled on first use
+        self._combined = {}
+
+    def _combined_from(self, start):
+        combined = self._combined.get(start)
+        if combined is None:
+            expression = re.compile('|'.join(
+                '(%s)' % ('' if rule.pattern is None else rule.pattern) for rule in self.rules[start:]), re.DOTALL)
+            # the group of a rule closes after the groups of its pattern, so it is the match's lastindex;
+            # the handler is given for rules needing nothing but the line, the rest take the slow path
+            groups = [None] * (expression.groups + 1)
+            group = 1
+            for index, rule in enumerate(self.rules[start:], start):
+                simple = rule.guard is None and rule.regex is None and not rule.fallthrough
+                groups[group] = (index, rule.handler if simple else None)
+                group += 1 + (0 if rule.regex is None else rule.regex.groups)
+            combined = self._combined[start] = (expression.match, groups)
+        return combined
+
+    def classify(self, line, state, start=0):
+        """
+        Index of the first rule from start on handling the line, None when no rule does.
+        """
+        rules = self.rules
+        while start < len(rules):
+            rule = rules[start]
+            if rule.pattern is None:
+                index = start
+            else:
+                match, groups = self._combined_from(start)
+                matched = match(line)
+                if matched is None:
+                    return None
+                index = groups[matched.lastindex][0]
+                rule = rules[index]
+            if rule.guard is None or rule.guard(state):
+                return index
+            start = index + 1
+        return None
+
+    def dispatch(self, lines, state):
+        """
+        Run the handler of the matching rule for every line.
+        """
+        rules = self.rules
+        match, groups = self._combined_from(0)
+        for line in lines:
+            matched = match(line)
+            if matched is None:
+                continue
+            index, handler = groups[matched.lastindex]
+            if handler is not None:
+                handler(state, line, None)
+                continue
+            rule = rules[index]
+            if rule.guard is not None and not rule.guard(state):
+                index = self.classify(line, state, index + 1)
+            while index is not None:
+                rule = rules[index]
+                rule.handler(state, line, rule.regex.match(line) if rule.regex is not None else None)
+                index = self.classify(line, state, index + 1) if rule.fallthrough else None
+        return state
@@ -0,0 +1,156 @@
+"""
+Declarative column layouts of the CSV exports, compiled into row decoders.
+
+A Schema names the amount, date and transaction type columns, the plain
+field columns with optional converters and an optional post-processing
+hook for what does not fit a single column (composed accounts, splitting
+descriptions). compile() turns it into one function with the lookup
+tables, the memoised date parser and the amount parser bound up front.
+"""
+import datetime
+
+from czech_banks.models import Payment, PaymentType
+
+# deletes thousands separators (spaces, non-breaking spaces, dots), turns the decimal comma into a dot
+_CZECH_NUMBER = str.maketrans({' ': None, '\xa0': None, '.': None, ',': '.'})
+
+
+def parse_czech_number(text):
+    """
+    Parse amounts like '1 234,56', '1.234,56', '-12,5' or '1234.56'.
+    """
+    if ',' in text:
+        text = text.translate(_CZECH_NUMBER)
+    elif ' ' in text:
+        text = text.replace(' ', '')
+    return float(text)
+
+
+def date_parser(date_format, cache_size=100000, convert=None):
+    """
+    strptime() with a cache, exports repeat the same few dates on many rows.
+
+    :param convert: applied to the parsed dates before they are cached
+    """
+    cache = {}
+    strptime = datetime.datetime.strptime
+
+    def parse_date(text):
+        date = cache.get(text)
+        if date is None:
+            if len(cache) >= cache_size:
+                cache.clear()
+            date = strptime(text, date_format)
+            date = cache[text] = date if convert is None else convert(date)
+        return date
+
+    return parse_date
+
+
+class Schema:
+
+    def __init__(self, amount, date, date_format, transaction_type, type_map, fields=(), post=None, min_columns=0,
+                 default_type=PaymentType.TYPE_UNDEFINED):
+        """
+        :param amount: index of the amount column
+        :param date: index of the date column parsed with date_format
+        :param transaction_type: index of the column looked up in type_map
+        :param fields: (field name, column index, converter or None) triples
+        :param post: callable(payment, row) finishing the payment, it may set the
+            transaction type and the string fields (see czech_banks.batch.STRING_FIELDS)
+        :param min_columns: shorter rows are skipped
+        """
+        self.amount = amount
+        self.date = date
+        self.date_format = date_format
+        self.transaction_type = transaction_type
+        self.type_map = type_map
+        self.fields = fields
+        self.post = post
+        self.min_columns = min_columns
+        self.default_type = default_type
+        self._decoder = None
+        self._parse_timestamp = None
+
+    def decode(self, row):
+        if self._decoder is None:
+            self._decoder = self.compile()
+        return self._decoder(row)
+
+    def compile(self):
+        amount, date, transaction_type = self.amount, self.date, self.transaction_type
+        type_map = dict(self.type_map)
+        default_type = self.default_type
+        parse_date = date_parser(self.date_format)
+        fields = tuple(self.fields)
+        post = self.post
+        min_columns = self.min_columns
+
+        def decode(row):
+            if len(row) < min_columns:
+                return None
+            payment = Payment()
+            payment.price = parse_czech_number(row[amount])
+            payment.date = parse_date(row[date])
+            payment.transaction_type = type_map.get(row[transaction_type], default_type)
+            for name, index, convert in fields:
+                setattr(payment, name, row[index] if convert is None else convert(row[index]))
+            if post is not None:
+                post(payment, row)
+            return payment
+
+        return decode
+
+    def compile_batch(self, batch):
+        """
+        Row decoder appending to the columns of a czech_banks.batch.PaymentBatch
+        without building a Payment per row, it returns whether the row was
+        added. The post hook gets one Payment reused for all rows.
+        """
+        from czech_banks.batch import STRING_FIELDS, to_minor_units, to_timestamp
+        amount, date, transaction_type = self.amount, self.date, self.transaction_type
+        type_map = dict(self.type_map)
+        default_type = self.default_type
+        if self._parse_timestamp is None:
+            # shared by the batches of a file, dates are converted once
+            self._parse_timestamp = date_parser(self.date_format, convert=to_timestamp)
+        parse_timestamp = self._parse_timestamp
+        fields = tuple(self.fields)
+        post = self.post
+        min_columns = self.min_columns
+        append_price = batch.price.append
+        append_date = batch.date.append
+        append_type = batch.transaction_type.append
+        # DictionaryColumn.append() inlined, a call per string cell costs more than the rest of the row
+        strings = tuple((field, column._lookup, column.values, column.codes.append)
+                        for field, column in batch.strings.items())
+        record = Payment()
+        # fields read from their columns are overwritten on every row, the others are reset
+        column_fields = set(name for name, index, convert in fields)
+        reset = tuple(field for field in STRING_FIELDS if field not in column_fields)
+
+        def decode(row):
+            if len(row) < min_columns:
+                return False
+            price = to_minor_units(parse_czech_number(row[amount]))
+            timestamp = parse_timestamp(row[date])
+            for field in reset:
+                setattr(record, field, None)
+            record.transaction_type = type_map.get(row[transaction_type], default_type)
+            for name, index, convert in fields:
+                setattr(record, name, row[index] if convert is None else convert(row[index]))
+            if post is not None:
+                post(record, row)
+            append_type(record.transaction_type)
+            for field, lookup, values, append_code in strings:
+                value = getattr(record, field)
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(values)
+                    values.append(value)
+                append_code(code)
+            append_price(price)
+            append_date(timestamp)
+            return True
+
+        return decode
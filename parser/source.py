@@ -0,0 +1,135 @@
+"""
+Opening CSV export sources: paths, binary file objects, bytes-like buffers
+(bytes, memoryview, mmap), transparently gunzipped or unzipped, decoded
+with a detected encoding. Everything is streamed, buffers are not copied.
+"""
+import codecs
+import contextlib
+import io
+import mmap
+import os
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+SAMPLE_SIZE = 64 * 1024
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable binary stream reading from a bytes-like object without copying it.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), len(self._view) - self._position)
+        b[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def open_binary(source, stack, member=None):
+    """
+    Open the source as a peekable binary stream, decompressing gzip and zip
+    data. For a zip archive the named member or the first file is read.
+    Streams opened here are registered with the ExitStack, file objects
+    passed in by the caller are left open.
+    """
+    if is_path(source):
+        stream = stack.enter_context(open(source, 'rb', buffering=SAMPLE_SIZE))
+    elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        # closing releases the view, so the caller can close an mmap afterwards
+        stream = stack.enter_context(io.BufferedReader(BufferReader(source), SAMPLE_SIZE))
+    elif hasattr(source, 'peek'):
+        stream = source
+    else:
+        stream = io.BufferedReader(source, SAMPLE_SIZE)
+        stack.callback(stream.detach)
+    magic = stream.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        import gzip
+        return io.BufferedReader(stack.enter_context(gzip.GzipFile(fileobj=stream)), SAMPLE_SIZE)
+    if magic == ZIP_MAGIC:
+        import zipfile
+        archive = stack.enter_context(zipfile.ZipFile(stream))
+        if member is None:
+            member = next(info for info in archive.infolist() if not info.is_dir())
+        return io.BufferedReader(stack.enter_context(archive.open(member)), SAMPLE_SIZE)
+    return stream
+
+
+def is_compressed(stream):
+    magic = stream.peek(4)[:4]
+    return magic.startswith(GZIP_MAGIC) or magic == ZIP_MAGIC
+
+
+def detect_encoding(sample):
+    """
+    Guess the encoding of a Czech export from its first bytes: a BOM, valid
+    UTF-8, else one of the single-byte encodings sharing most Czech letters.
+    cp1250 puts š, ž, ť, Š, Ž, Ť at 0x8a-0x9e where iso-8859-2 only has
+    control characters; iso-8859-2 puts them at 0xa9-0xbe. The sample is
+    iso-8859-2 when it has only the latter, cp1250 otherwise, which is also
+    the fallback for a sample with neither.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # the sample may end in the middle of a multi-byte sequence
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    if any(0x80 <= byte <= 0x9f for byte in sample):
+        return 'cp1250'
+    if any(byte in b'\xa9\xab\xae\xb9\xbb\xbe' for byte in sample):
+        return 'iso-8859-2'
+    return 'cp1250'
+
+
+@contextlib.contextmanager
+def open_text(source, encoding=None, member=None):
+    """
+    Open the source as a text stream suitable for csv.reader. With no
+    encoding given it is detected from the first bytes.
+    """
+    if isinstance(source, io.TextIOBase):
+        yield source
+        return
+    with contextlib.ExitStack() as stack:
+        stream = open_binary(source, stack, member)
+        if encoding is None:
+            encoding = detect_encoding(stream.peek(SAMPLE_SIZE))
+        text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+        try:
+            yield text
+        finally:
+            # closing is up to the stack, a caller's file object stays open
+            text.detach()
@@ -0,0 +1,240 @@
+"""
+Matching of incoming payments to open invoices.
+
+Open invoices are indexed by their variable symbol, by the counterparty
+account and by the outstanding amount, so a payment is matched with a few
+dictionary lookups however many invoices are open. The rules are tried in
+order:
+
+- RULE_VS: an invoice with the payment's variable symbol (leading zeros are
+  ignored like in the Csob notifications). Several invoices sharing the
+  symbol are paid in the order they were added, the first one whose
+  outstanding amount equals the payment within the tolerance, otherwise the
+  first one, partially or overpaid.
+- RULE_ACCOUNT: the only invoice of the counterparty account with the
+  outstanding amount equal to the payment within the tolerance.
+- RULE_AMOUNT: the only invoice with that outstanding amount, off by default.
+
+Constant and specific symbols set on both sides must agree, and so must the
+variable symbols for the rules not keyed by them. Amounts are compared in
+minor units as in czech_banks.batch.
+
+    reconciler = Reconciler(open_invoices, tolerance=0.5)
+    for payment, match in reconciler.reconcile(Csob(downloader).parse()):
+        if match is not None and match.status == PAID:
+            ...
+
+Matching a payment updates the index: paid invoices are removed, partially
+paid ones wait for the rest. add() and remove() keep it in step with
+invoices issued or settled in the meantime.
+"""
+from czech_banks.batch import to_minor_units
+from czech_banks.dedup import normalize_account, normalize_symbol
+
+RULE_VS = 'vs'
+RULE_ACCOUNT = 'account'
+RULE_AMOUNT = 'amount'
+RULES = (RULE_VS, RULE_ACCOUNT, RULE_AMOUNT)
+
+SYMBOLS = ('vs', 'ks', 'ss')
+
+PAID = 'paid'
+PARTIAL = 'partial'
+OVERPAID = 'overpaid'
+
+
+class Match:
+    __slots__ = ('payment', 'invoice', 'rule', 'remaining')
+
+    def __init__(self, payment, invoice, rule, remaining):
+        self.payment = payment
+        self.invoice = invoice
+        self.rule = rule
+        # outstanding amount of the invoice after the payment, negative when overpaid
+        self.remaining = remaining
+
+    @property
+    def status(self):
+        if self.remaining > 0:
+            return PARTIAL
+        if self.remaining < 0:
+            return OVERPAID
+        return PAID
+
+    def __str__(self):
+        return '%s -> %s (%s, %s)' % (self.payment, self.invoice.number, self.rule, self.status)
+
+
+class _OpenInvoice:
+    __slots__ = ('invoice', 'vs', 'ks', 'ss', 'account', 'outstanding')
+
+    def __init__(self, invoice):
+        self.invoice = invoice
+        self.vs = normalize_symbol(invoice.vs)
+        self.ks = normalize_symbol(invoice.ks)
+        self.ss = normalize_symbol(invoice.ss)
+        self.account = normalize_account(invoice.account)
+        self.outstanding = to_minor_units(invoice.amount) - to_minor_units(invoice.paid or 0)
+
+
+class Reconciler:
+
+    def __init__(self, invoices=(), tolerance=0, partial=True, rules=(RULE_VS, RULE_ACCOUNT)):
+        """
+        :param invoices: open czech_banks.models.Invoice objects, their number identifies them
+        :param tolerance: difference from the outstanding amount still paying an invoice in full
+        :param partial: let a payment matched by the variable symbol pay less or more than
+            outstanding, otherwise such payments are left to the other rules
+        :param rules: the rules tried, in this order
+        """
+        for rule in rules:
+            if rule not in RULES:
+                raise ValueError('unknown rule %r, known are %s' % (rule, ', '.join(RULES)))
+        self.tolerance = to_minor_units(tolerance)
+        self.partial = partial
+        self.rules = tuple(rules)
+        self._invoices = {}
+        # the indexes map a key to the invoice numbers, dicts keeping the order they were added in
+        self._by_vs = {}
+        self._by_account = {}
+        # outstanding amounts in buckets one tolerance wide, a match lies in at most three of them
+        self._by_amount = {}
+        self._width = self.tolerance + 1
+        for invoice in invoices:
+            self.add(invoice)
+
+    def __len__(self):
+        return len(self._invoices)
+
+    def __contains__(self, number):
+        return number in self._invoices
+
+    def open_invoices(self):
+        return [entry.invoice for entry in self._invoices.values()]
+
+    def add(self, invoice):
+        """
+        Index the invoice, replacing an open one of the same number. Invoices
+        paid in full already are not indexed.
+        """
+        if invoice.number in self._invoices:
+            self.remove(invoice.number)
+        entry = _OpenInvoice(invoice)
+        if entry.outstanding <= 0:
+            return
+        self._invoices[invoice.number] = entry
+        if entry.vs:
+            self._by_vs.setdefault(entry.vs, {})[invoice.number] = entry
+        if entry.account:
+            self._by_account.setdefault(entry.account, {})[invoice.number] = entry
+        self._by_amount.setdefault(entry.outstanding // self._width, {})[invoice.number] = entry
+
+    def remove(self, number):
+        """
+        Drop an invoice settled by other means, returns it or None when it is not open.
+        """
+        entry = self._invoices.pop(number, None)
+        if entry is None:
+            return None
+        if entry.vs:
+            _discard(self._by_vs, entry.vs, number)
+        if entry.account:
+            _discard(self._by_account, entry.account, number)
+        _discard(self._by_amount, entry.outstanding // self._width, number)
+        return entry.invoice
+
+    def match(self, payment):
+        """
+        Match the payment and book it on the invoice, returns a Match or None.
+        Booking adds the payment to the matched invoice's paid amount, the
+        Invoice object passed in is updated. Outgoing payments are never matched.
+        """
+        amount = to_minor_units(payment.price or 0)
+        if amount <= 0:
+            return None
+        symbols = (normalize_symbol(payment.vs), normalize_symbol(payment.ks), normalize_symbol(payment.ss))
+        for rule in self.rules:
+            if rule == RULE_VS:
+                entry = self._match_vs(symbols, amount)
+            elif rule == RULE_ACCOUNT:
+                account = normalize_account(payment.account)
+                entry = self._match_unique(self._amount_candidates(amount, account), symbols)
+            else:
+                entry = self._match_unique(self._amount_candidates(amount), symbols)
+            if entry is not None:
+                return self._book(payment, entry, rule, amount)
+        return None
+
+    def reconcile(self, payments):
+        """
+        Yield (payment, Match or None) for the payments, matching them in turn.
+        """
+        for payment in payments:
+            yield payment, self.match(payment)
+
+    def _match_vs(self, symbols, amount):
+        if not symbols[0]:
+            return None
+        candidates = [entry for entry in self._by_vs.get(symbols[0], {}).values()
+                      if _compatible(entry, symbols, ('ks', 'ss'))]
+        for entry in candidates:
+            if abs(entry.outstanding - amount) <= self.tolerance:
+                return entry
+        if candidates and self.partial:
+            return candidates[0]
+        return None
+
+    def _amount_candidates(self, amount, account=None):
+        """
+        Open invoices with the outstanding amount within the tolerance of amount, of the account if given.
+        """
+        if account is not None:
+            by_account = self._by_account.get(account)
+            if not by_account:
+                return []
+        buckets = [self._by_amount.get(bucket) for bucket in
+                   range((amount - self.tolerance) // self._width, (amount + self.tolerance) // self._width + 1)]
+        buckets = [bucket for bucket in buckets if bucket]
+        if account is not None and len(by_account) < sum(len(bucket) for bucket in buckets):
+            buckets = [by_account]
+            account = None
+        return [entry for bucket in buckets for entry in bucket.values()
+                if abs(entry.outstanding - amount) <= self.tolerance and (account is None or entry.account == account)]
+
+    def _match_unique(self, candidates, symbols):
+        candidates = [entry for entry in candidates if _compatible(entry, symbols, SYMBOLS)]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def _book(self, payment, entry, rule, amount):
+        number = entry.invoice.number
+        _discard(self._by_amount, entry.outstanding // self._width, number)
+        entry.outstanding -= amount
+        entry.invoice.paid = (to_minor_units(entry.invoice.paid or 0) + amount) / 100
+        remaining = entry.outstanding
+        if abs(remaining) <= self.tolerance:
+            remaining = 0
+        if remaining > 0:
+            self._by_amount.setdefault(entry.outstanding // self._width, {})[number] = entry
+        else:
+            self.remove(number)
+        return Match(payment, entry.invoice, rule, remaining / 100)
+
+
+def _compatible(entry, symbols, fields):
+    """
+    Whether the payment's (vs, ks, ss) agree with the invoice's in the fields set on both sides.
+    """
+    for field, value in zip(SYMBOLS, symbols):
+        if value and field in fields:
+            expected = getattr(entry, field)
+            if expected and expected != value:
+                return False
+    return True
+
+
+def _discard(index, key, number):
+    numbers = index.get(key)
+    if numbers is not None:
+        numbers.pop(number, None)
+        if not numbers:
+            del index[key]
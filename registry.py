@@ -0,0 +1,116 @@
+"""
+Bank parsers by bank id and source kind.
+
+A parser class is looked up by the bank id and the kind of its source:
+EXPORT (a CSV export file), EMAIL (payment notification e-mails) or BALANCE
+(balance notification e-mails). Parser modules are imported on the first
+lookup of one of their classes, so a command reading Unicredit exports
+never loads the e-mail parsers.
+
+    from czech_banks.registry import EXPORT, get_parser
+    payments = get_parser('unicredit', EXPORT)('export.csv').parse()
+
+Other packages add banks through the 'czech_banks.parsers' entry point
+group, an entry point named '<bank>.<kind>' pointing to the parser class:
+
+    [project.entry-points.'czech_banks.parsers']
+    fio.export = 'czech_banks_fio:FioExport'
+
+Entry points are read on the first lookup missing the built-in parsers and
+do not replace them, register() does.
+"""
+EXPORT = 'export'
+EMAIL = 'email'
+BALANCE = 'balance'
+KINDS = (EXPORT, EMAIL, BALANCE)
+
+ENTRY_POINT_GROUP = 'czech_banks.parsers'
+
+# (bank, kind): 'module:class' of the parsers shipped with the package
+PARSERS = {
+    ('equabank', EXPORT): 'czech_banks.parser.export:Equabank',
+    ('mbank', EXPORT): 'czech_banks.parser.export:Mbank',
+    ('unicredit', EXPORT): 'czech_banks.parser.export:Unicredit',
+    ('zuno', EXPORT): 'czech_banks.parser.export:Zuno',
+    ('csob', EMAIL): 'czech_banks.parser.email:Csob',
+    ('raiffeisenbank', EMAIL): 'czech_banks.parser.email:Raiffeisenbank',
+    ('unicredit', EMAIL): 'czech_banks.parser.email:Unicredit',
+    ('equabank', BALANCE): 'czech_banks.parser.email:EquabankBalance',
+    ('mbank', BALANCE): 'czech_banks.parser.email:MbankBalance',
+    ('unicredit', BALANCE): 'czech_banks.parser.email:UnicreditBalance',
+}
+
+
+class UnknownParser(LookupError):
+    pass
+
+
+_registry = dict(PARSERS)
+_entry_points_loaded = False
+
+
+def register(bank, kind, parser):
+    """
+    Add or replace the parser of the bank's source kind.
+
+    :param parser: parser class or its 'module:class' name, imported on the first lookup
+    """
+    if kind not in KINDS:
+        raise ValueError('unknown source kind %r, known are %s' % (kind, ', '.join(KINDS)))
+    _registry[bank.lower(), kind] = parser
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    from importlib.metadata import entry_points
+    try:
+        found = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10
+        found = entry_points().get(ENTRY_POINT_GROUP, ())
+    for entry_point in found:
+        bank, _, kind = entry_point.name.rpartition('.')
+        if bank and kind in KINDS:
+            _registry.setdefault((bank.lower(), kind), entry_point.value)
+
+
+def _resolve(name):
+    import importlib
+    module, _, attribute = name.partition(':')
+    value = importlib.import_module(module)
+    for part in attribute.split('.'):
+        value = getattr(value, part)
+    return value
+
+
+def get_parser(bank, kind=EXPORT):
+    """
+    Parser class of the bank's source kind.
+    """
+    key = bank.lower(), kind
+    if key not in _registry:
+        _load_entry_points()
+    parser = _registry.get(key)
+    if parser is None:
+        raise UnknownParser('no %s parser of bank %r' % (kind, bank))
+    if isinstance(parser, str):
+        parser = _registry[key] = _resolve(parser)
+    return parser
+
+
+def banks(kind=None):
+    """
+    Sorted ids of the banks having a parser of the kind, of any kind by default.
+    """
+    _load_entry_points()
+    return sorted(set(bank for bank, parser_kind in _registry if kind is None or parser_kind == kind))
+
+
+def parsers(kind):
+    """
+    Parser classes of the kind ordered by bank id, their modules are imported.
+    """
+    return [get_parser(bank, kind) for bank in banks(kind)]
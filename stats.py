@@ -0,0 +1,169 @@
+"""
+Optional instrumentation of downloads and parsing.
+
+Downloaders and parsers take a `stats` object and report to it the duration
+of every stage (IMAP login, search, fetch, MIME decoding, parsing), byte,
+message and row counts and failures, labelled by server or bank. The
+default NULL_STATS ignores everything, so disabled instrumentation costs a
+method call per stage and nothing per row.
+
+    stats = Stats()
+    downloader = EmailDownloader(..., stats=stats)
+    payments = list(Csob(downloader, stats=stats).parse())
+    print(stats.to_prometheus())
+"""
+import time
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullStats:
+    """
+    Stats that record nothing.
+    """
+    enabled = False
+
+    def timer(self, stage, **labels):
+        return _NULL_TIMER
+
+    def count(self, name, value=1, **labels):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+class _Timer:
+    __slots__ = ('_stats', '_key', '_start')
+
+    def __init__(self, stats, key):
+        self._stats = stats
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats._add_timing(self._key, time.perf_counter() - self._start, exc_type is not None)
+        return False
+
+
+class Stats(NullStats):
+    """
+    Thread-safe in-process collection of stage timings and counters.
+
+    A stage keeps the number of calls, the total and the longest duration in
+    seconds and the number of calls that raised. Counters are plain sums.
+    Both are keyed by name and labels.
+    """
+    enabled = True
+
+    def __init__(self):
+        # imported here, the parsers import NULL_STATS and most runs record nothing
+        import threading
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def __getstate__(self):
+        # parsers are pickled to worker processes, their stats stay behind
+        return {'timings': {}, 'counters': {}}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def timer(self, stage, **labels):
+        """
+        Context manager timing one run of the stage, an exception leaving it counts as an error.
+        """
+        return _Timer(self, (stage, tuple(sorted(labels.items()))))
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def _add_timing(self, key, seconds, failed):
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0}
+            timing['calls'] += 1
+            timing['seconds'] += seconds
+            timing['max_seconds'] = max(timing['max_seconds'], seconds)
+            timing['errors'] += failed
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'stages': [dict(stage=stage, labels=dict(labels), **timing)
+                           for (stage, labels), timing in sorted(self.timings.items())],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+            }
+
+    def to_json(self, **kwargs):
+        import json
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix='czech_banks'):
+        """
+        Render the stats in the Prometheus text exposition format.
+        """
+        data = self.to_dict()
+        metrics = [
+            ('stage_calls_total', 'counter', 'Number of runs of the stage.', 'calls'),
+            ('stage_seconds_total', 'counter', 'Time spent in the stage.', 'seconds'),
+            ('stage_max_seconds', 'gauge', 'Longest run of the stage.', 'max_seconds'),
+            ('stage_errors_total', 'counter', 'Runs of the stage that failed.', 'errors'),
+        ]
+        lines = []
+        for metric, metric_type, help_text, field in metrics:
+            if not data['stages']:
+                break
+            name = '%s_%s' % (prefix, metric)
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for stage in data['stages']:
+                labels = dict(stage['labels'], stage=stage['stage'])
+                lines.append('%s%s %s' % (name, _labels(labels), _number(stage[field])))
+        names = []
+        for counter in data['counters']:
+            if counter['name'] not in names:
+                names.append(counter['name'])
+        for counter_name in names:
+            name = '%s_%s_total' % (prefix, counter_name)
+            lines.append('# TYPE %s counter' % name)
+            for counter in data['counters']:
+                if counter['name'] == counter_name:
+                    lines.append('%s%s %s' % (name, _labels(counter['labels']), _number(counter['value'])))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{%s}' % ','.join('%s="%s"' % (key, value) for key, value in zip(labels, escaped))
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,182 @@
+"""
+SQLite storage of parsed payments and balances.
+
+    with PaymentStore('payments.db') as store:
+        store.write(Unicredit('export.csv').parse())
+        for payment in store.payments(account='19-123/0100', since=datetime.datetime(2020, 1, 1)):
+            ...
+
+Records are written in large executemany() transactions to a WAL journalled
+database, amounts as integer minor units and dates as integer microseconds
+since the epoch like in czech_banks.batch (aware datetimes are stored in
+UTC and come back naive). Queries stream rows from a cursor instead of
+loading whole tables.
+"""
+import itertools
+import sqlite3
+
+from czech_banks.batch import NAT, STRING_FIELDS, PaymentBatch, from_timestamp, to_minor_units, to_timestamp
+from czech_banks.models import Balance, Payment
+
+PAYMENT_COLUMNS = ('transaction_type', 'price', 'date') + STRING_FIELDS
+BALANCE_COLUMNS = ('account', 'balance', 'date', 'currency')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY,
+    transaction_type INTEGER NOT NULL,
+    price INTEGER NOT NULL,
+    date INTEGER,
+    %s
+);
+CREATE INDEX IF NOT EXISTS payments_account_date ON payments (account, date);
+CREATE INDEX IF NOT EXISTS payments_date ON payments (date);
+CREATE INDEX IF NOT EXISTS payments_vs ON payments (vs);
+CREATE INDEX IF NOT EXISTS payments_transaction_type ON payments (transaction_type);
+CREATE TABLE IF NOT EXISTS balances (
+    id INTEGER PRIMARY KEY,
+    account TEXT,
+    balance REAL,
+    date INTEGER,
+    currency TEXT
+);
+CREATE INDEX IF NOT EXISTS balances_account_date ON balances (account, date);
+""" % ',\n    '.join('%s TEXT' % field for field in STRING_FIELDS)
+
+
+def _timestamp(date):
+    timestamp = to_timestamp(date)
+    return None if timestamp == NAT else timestamp
+
+
+def _payment_row(payment):
+    return ((payment.transaction_type, to_minor_units(payment.price), _timestamp(payment.date)) +
+            tuple(getattr(payment, field) for field in STRING_FIELDS))
+
+
+class PaymentStore:
+
+    def __init__(self, filename, batch_size=10000):
+        """
+        :param filename: SQLite database, created when missing
+        :param batch_size: records inserted by one executemany() and transaction
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        self._insert_payment = 'INSERT INTO payments (%s) VALUES (%s)' % (
+            ', '.join(PAYMENT_COLUMNS), ', '.join('?' * len(PAYMENT_COLUMNS)))
+        self._insert_balance = 'INSERT INTO balances (%s) VALUES (%s)' % (
+            ', '.join(BALANCE_COLUMNS), ', '.join('?' * len(BALANCE_COLUMNS)))
+
+    def write(self, records):
+        """
+        Append the payments and balances yielded by a parser, returns the
+        number of (payments, balances) written. Each batch_size records are
+        committed together, so an interrupted write keeps the batches before.
+        """
+        payments = balances = 0
+        records = iter(records)
+        while True:
+            chunk = list(itertools.islice(records, self.batch_size))
+            if not chunk:
+                return payments, balances
+            payment_rows = [_payment_row(record) for record in chunk if isinstance(record, Payment)]
+            balance_rows = [(record.account, record.balance, _timestamp(record.date), record.currency)
+                            for record in chunk if isinstance(record, Balance)]
+            with self._connection:
+                self._connection.executemany(self._insert_payment, payment_rows)
+                self._connection.executemany(self._insert_balance, balance_rows)
+            payments += len(payment_rows)
+            balances += len(balance_rows)
+
+    def write_batch(self, batch):
+        """
+        Append the payments of a PaymentBatch, returns their number.
+        """
+        dates = (None if date == NAT else date for date in batch.date)
+        columns = [batch.transaction_type, batch.price, dates] + [batch.strings[field] for field in STRING_FIELDS]
+        with self._connection:
+            self._connection.executemany(self._insert_payment, zip(*columns))
+        return len(batch)
+
+    def _where(self, account=None, since=None, until=None, vs=None, transaction_type=None):
+        conditions = []
+        params = []
+        if account is not None:
+            conditions.append('account = ?')
+            params.append(account)
+        if since is not None:
+            conditions.append('date >= ?')
+            params.append(_timestamp(since))
+        if until is not None:
+            conditions.append('date < ?')
+            params.append(_timestamp(until))
+        if vs is not None:
+            conditions.append('vs = ?')
+            params.append(vs)
+        if transaction_type is not None:
+            conditions.append('transaction_type = ?')
+            params.append(transaction_type)
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+    def _select(self, table, columns, **filters):
+        where, params = self._where(**filters)
+        return self._connection.execute('SELECT %s FROM %s%s ORDER BY date, id' % (
+            ', '.join(columns), table, where), params)
+
+    def payments(self, account=None, since=None, until=None, vs=None, transaction_type=None):
+        """
+        Yield the stored payments matching all the given filters ordered by
+        date, since is inclusive and until exclusive.
+        """
+        for row in self._select('payments', PAYMENT_COLUMNS, account=account, since=since, until=until, vs=vs,
+                                transaction_type=transaction_type):
+            payment = Payment()
+            payment.transaction_type = row[0]
+            payment.price = row[1] / 100
+            payment.date = from_timestamp(row[2]) if row[2] is not None else None
+            for field, value in zip(STRING_FIELDS, row[3:]):
+                setattr(payment, field, value)
+            yield payment
+
+    def payment_batches(self, account=None, since=None, until=None, vs=None, transaction_type=None,
+                        batch_size=100000):
+        """
+        payments() as columnar PaymentBatch objects of up to batch_size rows.
+        """
+        cursor = self._select('payments', PAYMENT_COLUMNS, account=account, since=since, until=until, vs=vs,
+                              transaction_type=transaction_type)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            batch = PaymentBatch()
+            columns = list(zip(*rows))
+            batch.transaction_type.extend(columns[0])
+            batch.price.extend(columns[1])
+            batch.date.extend(NAT if date is None else date for date in columns[2])
+            for field, values in zip(STRING_FIELDS, columns[3:]):
+                column = batch.strings[field]
+                for value in values:
+                    column.append(value)
+            yield batch
+
+    def balances(self, account=None, since=None, until=None):
+        for row in self._select('balances', BALANCE_COLUMNS, account=account, since=since, until=until):
+            balance = Balance()
+            balance.account, balance.balance, date, balance.currency = row
+            balance.date = from_timestamp(date) if date is not None else None
+            yield balance
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,192 @@
+"""
+Push delivery of payments from notification e-mails with IMAP IDLE.
+
+The watcher holds one IMAP session in IDLE (RFC 2177) and wakes up when the
+server reports new messages, searches the messages above the last processed
+UID, fetches them and hands every parsed record to a callback or a queue.
+IDLE is re-issued every idle_timeout seconds, before servers drop idle
+clients (RFC 2177 allows them to do so after 30 minutes), and a lost
+connection is re-established with exponential backoff.
+
+    watcher = MailboxWatcher(EmailDownloader(..., checkpoints=CheckpointStore('watch.json')),
+                             [Csob(), Raiffeisenbank()], callback=confirm_payment)
+    threading.Thread(target=watcher.run).start()
+    ...
+    watcher.stop()
+
+The downloader runs in the incremental mode, so flags on the server are left
+alone and a restarted watcher resumes after the last processed message.
+Records of a message are delivered before the message counts as processed,
+a message whose delivery failed is delivered again after a restart.
+"""
+import imaplib
+import random
+import select
+import socket
+import ssl
+import threading
+import time
+
+from czech_banks.dispatcher import MailboxDispatcher
+from czech_banks.downloader import DownloadingError
+
+# RFC 2177 servers may log out clients idle for 30 minutes
+IDLE_TIMEOUT = 29 * 60
+
+
+class MailboxWatcher:
+
+    def __init__(self, downloader, parsers, callback=None, queue=None, idle_timeout=IDLE_TIMEOUT,
+                 backoff=1, max_backoff=300, backlog=False):
+        """
+        :param downloader: EmailDownloader with checkpoints (the incremental mode)
+        :param parsers: e-mail parsers the messages are dispatched to like in MailboxDispatcher
+        :param callback: called with (parser, record) for every payment and balance
+        :param queue: queue.Queue receiving the (parser, record) pairs
+        :param idle_timeout: seconds after which IDLE is re-issued
+        :param backoff: seconds before the first reconnection, doubled up to max_backoff
+        :param backlog: deliver the messages present before the first start as well, without a
+            checkpoint only the messages arriving while watching are delivered
+        """
+        if downloader.checkpoints is None:
+            raise ValueError('the downloader needs checkpoints to tell new messages apart')
+        if callback is None and queue is None:
+            raise ValueError('either a callback or a queue is needed')
+        self.downloader = downloader
+        self.dispatcher = MailboxDispatcher(downloader, parsers)
+        self.callback = callback
+        self.queue = queue
+        self.idle_timeout = idle_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.backlog = backlog
+        self.stats = downloader.stats
+        self._stopped = threading.Event()
+        # stop() writes to the pair to wake up a waiting select()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+
+    def run(self):
+        """
+        Watch the mailbox until stop() is called, once per watcher. Connection
+        failures are retried, errors of the parsers and the callback are raised.
+        """
+        query = self.dispatcher.search_query()
+        content_types = self.dispatcher.content_types()
+        delay = self.backoff
+        first = True
+        try:
+            while not self._stopped.is_set():
+                try:
+                    if not self.downloader.open():
+                        raise DownloadingError('cannot select INBOX')
+                    delay = self.backoff
+                    try:
+                        self._deliver_new(query, content_types, skip=first and not self.backlog)
+                        first = False
+                        while not self._stopped.is_set() and self._idle():
+                            self._deliver_new(query, content_types)
+                    finally:
+                        self._close()
+                except (OSError, imaplib.IMAP4.abort, DownloadingError):
+                    if self._stopped.is_set():
+                        break
+                    self.stats.count('reconnects', server=self.downloader.server)
+                    # jitter keeps many watchers of one server from reconnecting together
+                    self._stopped.wait(delay * random.uniform(0.5, 1))
+                    delay = min(delay * 2, self.max_backoff)
+        finally:
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
+
+    def stop(self):
+        """
+        Make run() return, may be called from any thread.
+        """
+        self._stopped.set()
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def _deliver_new(self, query, content_types, skip=False):
+        nums = self.downloader.search(query)
+        if skip:
+            self.downloader.mark_processed(nums)
+            return
+        for num, message in self.downloader.fetch(nums, content_types):
+            for parser in self.dispatcher.parsers:
+                if parser.accepts(message):
+                    for record in parser._parse_message(message):
+                        self._deliver(parser, record)
+
+    def _deliver(self, parser, record):
+        if self.callback is not None:
+            self.callback(parser, record)
+        if self.queue is not None:
+            self.queue.put((parser, record))
+
+    def _idle(self):
+        """
+        Wait in IDLE until the server reports changes of the mailbox, the
+        idle_timeout passes or the watcher is stopped. Returns False when stopped.
+        """
+        handle = self.downloader._handle
+        tag = handle._new_tag()
+        handle.send(b'%s IDLE\r\n' % tag)
+        line = handle._get_line()
+        if not line.startswith(b'+'):
+            del handle.tagged_commands[tag]
+            raise DownloadingError('IDLE refused: %r' % line)
+        deadline = time.monotonic() + self.idle_timeout
+        sock = handle.socket()
+        changed = False
+        while not changed and not self._stopped.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not _buffered(handle):
+                # the socket's file object cannot survive a timeout, wait for data before reading it
+                readable, _, _ = select.select([sock, self._wakeup_reader], [], [], remaining)
+                if sock not in readable:
+                    continue
+            line = handle._get_line()
+            # lines after this one may be buffered already, so any update
+            # (EXPUNGE, FETCH) leads to a search, not only EXISTS
+            changed = not line.startswith(b'* OK')
+        if changed:
+            self.stats.count('idle_wakeups', server=self.downloader.server)
+        handle.send(b'DONE\r\n')
+        while True:
+            line = handle._get_line()
+            if line.startswith(tag + b' '):
+                break
+        del handle.tagged_commands[tag]
+        if not line[len(tag) + 1:].startswith(b'OK'):
+            raise DownloadingError('IDLE failed: %r' % line)
+        return not self._stopped.is_set()
+
+    def _close(self):
+        try:
+            self.downloader.close()
+        except (OSError, imaplib.IMAP4.error):
+            self.downloader.abort()
+
+
+def _buffered(handle):
+    """
+    Whether data was received but not read yet, select() does not see the
+    buffer of the socket's file object (the server may send the first
+    updates together with the IDLE continuation) nor the decrypted TLS data.
+    """
+    sock = handle.socket()
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    timeout = sock.gettimeout()
+    # peek() reads the socket when the buffer is empty, it must not block
+    sock.settimeout(0)
+    try:
+        return bool(handle.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
@@ -0,0 +1,237 @@
+"""
+Streaming writers of parsed payments and balances.
+
+A writer consumes any parse() generator record by record, keeps at most
+buffer_size normalised rows and writes them out when the buffer fills or
+flush_interval seconds passed since the last write, so memory stays flat
+whatever the size of the input and slow sources (e-mail) still reach the
+file regularly.
+
+    with open_writer('payments.parquet') as writer:
+        writer.write(Unicredit('2019.csv').parse())
+        writer.write(UnicreditBalance(downloader).parse())
+
+All formats share the columns of FIELDS: the record kind ('payment' or
+'balance'), then the payment and balance attributes, empty (None) where a
+record has no such attribute. Dates are written in ISO 8601 (Parquet
+timestamps in UTC like czech_banks.batch), amounts with two decimals.
+Parquet needs pyarrow.
+"""
+import csv
+import json
+import os
+import time
+
+from czech_banks.batch import NAT, STRING_FIELDS, to_timestamp
+from czech_banks.models import Balance, Payment
+
+FIELDS = ('record', 'transaction_type', 'price', 'date') + STRING_FIELDS + ('balance', 'currency')
+
+RECORD_KINDS = {Payment: 'payment', Balance: 'balance'}
+
+
+def normalize(record):
+    """
+    Tuple of the record's values in FIELDS order.
+    """
+    kind = RECORD_KINDS.get(type(record))
+    if kind is None:
+        kind = _record_kind(record)
+    # slots a record does not have are None
+    return (kind,) + tuple(getattr(record, field, None) for field in FIELDS[1:])
+
+
+def _record_kind(record):
+    # subclasses of the models, in the order of RECORD_KINDS
+    for record_class, kind in RECORD_KINDS.items():
+        if isinstance(record, record_class):
+            return kind
+    raise TypeError('cannot write %s records' % type(record).__name__)
+
+
+def _amount(value):
+    return None if value is None else round(value, 2)
+
+
+def _isoformat(date):
+    return None if date is None else date.isoformat()
+
+
+class RecordWriter:
+    """
+    Base class of the writers, subclasses implement _write_rows() of a list of normalize() tuples.
+    """
+    # opens a path target for writing
+    MODE = 'w'
+
+    def __init__(self, target, buffer_size=10000, flush_interval=None):
+        """
+        :param target: path or file object, a path is opened and closed by the writer
+        :param buffer_size: records kept before they are written out
+        :param flush_interval: write out the buffered records at least every this many seconds
+        """
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._buffer = []
+        self._flushed = time.monotonic()
+        if isinstance(target, (str, os.PathLike)):
+            self._stream = self._open(target)
+            self._owned = True
+        else:
+            self._stream = target
+            self._owned = False
+
+    def _open(self, path):
+        return open(path, self.MODE, encoding='utf-8', newline='')
+
+    def write(self, records):
+        """
+        Write all records of the iterable, returns their number.
+        """
+        count = self.count
+        for record in records:
+            self.write_record(record)
+        return self.count - count
+
+    def write_record(self, record):
+        self._buffer.append(normalize(record))
+        self.count += 1
+        if len(self._buffer) >= self.buffer_size or (
+                self.flush_interval is not None and time.monotonic() - self._flushed >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._write_rows(self._buffer)
+            self._buffer = []
+        if hasattr(self._stream, 'flush'):
+            self._stream.flush()
+        self._flushed = time.monotonic()
+
+    def _write_rows(self, rows):
+        raise NotImplementedError('Should be implemented!')
+
+    def close(self):
+        self.flush()
+        if self._owned:
+            self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvWriter(RecordWriter):
+    DIALECT = 'excel'
+
+    def __init__(self, target, dialect=None, header=True, buffer_size=10000, flush_interval=None):
+        """
+        :param dialect: csv dialect, DIALECT by default
+        :param header: start with a row of the FIELDS names
+        """
+        super().__init__(target, buffer_size, flush_interval)
+        self._writer = csv.writer(self._stream, dialect=dialect or self.DIALECT)
+        if header:
+            self._writer.writerow(FIELDS)
+
+    def _write_rows(self, rows):
+        self._writer.writerows(row[:2] + (_format_amount(row[2]), _isoformat(row[3])) + row[4:-2] +
+                               (_format_amount(row[-2]), row[-1]) for row in rows)
+
+
+class tab_separated(csv.excel_tab):
+    lineterminator = '\n'
+
+
+class TsvWriter(CsvWriter):
+    """
+    Tab-separated values, quotes in values are doubled like in CSV.
+    """
+    DIALECT = tab_separated
+
+
+def _format_amount(value):
+    return None if value is None else '%.2f' % value
+
+
+class JsonLinesWriter(RecordWriter):
+    """
+    One JSON object per line holding the fields of the record kind only.
+    """
+
+    def _write_rows(self, rows):
+        lines = []
+        for row in rows:
+            if row[0] == 'payment':
+                transaction_type, price, date = row[1:4]
+                data = {'record': 'payment', 'transaction_type': transaction_type, 'price': _amount(price),
+                        'date': _isoformat(date)}
+                data.update(zip(STRING_FIELDS, row[4:-2]))
+            else:
+                data = {'record': 'balance', 'account': row[4], 'balance': _amount(row[-2]),
+                        'date': _isoformat(row[3]), 'currency': row[-1]}
+            lines.append(json.dumps(data, ensure_ascii=False))
+        lines.append('')
+        self._stream.write('\n'.join(lines))
+
+
+class ParquetWriter(RecordWriter):
+    """
+    Writes every flush of the buffer as one row group, so buffer_size is the row group size.
+    """
+    MODE = 'wb'
+
+    def __init__(self, target, buffer_size=100000, flush_interval=None, compression='zstd'):
+        import pyarrow
+        import pyarrow.parquet
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema(
+            [('record', pyarrow.string()), ('transaction_type', pyarrow.uint8()), ('price', pyarrow.float64()),
+             ('date', pyarrow.timestamp('us', tz='UTC'))] +
+            [(field, pyarrow.string()) for field in STRING_FIELDS] +
+            [('balance', pyarrow.float64()), ('currency', pyarrow.string())])
+        super().__init__(target, buffer_size, flush_interval)
+        self._writer = pyarrow.parquet.ParquetWriter(self._stream, self._schema, compression=compression)
+
+    def _open(self, path):
+        return open(path, self.MODE)
+
+    def _write_rows(self, rows):
+        columns = list(zip(*rows))
+        date_index = FIELDS.index('date')
+        columns[date_index] = [_utc_timestamp(date) for date in columns[date_index]]
+        arrays = [self._pyarrow.array(column, type=field.type) for column, field in zip(columns, self._schema)]
+        self._writer.write_table(self._pyarrow.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        if self._owned:
+            self._stream.close()
+
+
+def _utc_timestamp(date):
+    timestamp = to_timestamp(date)
+    return None if timestamp == NAT else timestamp
+
+
+WRITERS = {
+    '.csv': CsvWriter,
+    '.tsv': TsvWriter,
+    '.jsonl': JsonLinesWriter,
+    '.parquet': ParquetWriter,
+}
+
+
+def open_writer(path, **options):
+    """
+    Writer of the format given by the file extension, see WRITERS.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    writer_class = WRITERS.get(extension)
+    if writer_class is None:
+        raise ValueError('no writer for %s files, known are %s' % (extension or path, ', '.join(sorted(WRITERS))))
+    return writer_class(path, **options)